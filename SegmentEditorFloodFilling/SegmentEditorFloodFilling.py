@@ -46,6 +46,10 @@ class SegmentEditorFloodFillingTest(ScriptedLoadableModuleTest):
     """
     self.setUp()
     self.test_SegmentEditorFloodFilling1()
+    self.setUp()
+    self.test_SegmentEditorFloodFillingSummedVolumeTable()
+    self.setUp()
+    self.test_SegmentEditorFloodFillingToleranceMap()
 
   def test_SegmentEditorFloodFilling1(self):
     """
@@ -139,3 +143,140 @@ class SegmentEditorFloodFillingTest(ScriptedLoadableModuleTest):
     self.assertEqual( round(segStatLogic.statistics["Background","LM volume cc"]), 3010)
 
     self.delayDisplay('test_SegmentEditorFloodFilling1 passed')
+
+  def test_SegmentEditorFloodFillingSummedVolumeTable(self):
+    """
+    Compare summed volume table filling to the reference implementations:
+    - without neighborhood: vtkImageThresholdConnectivity
+    - with neighborhood: box neighborhood test computed by brute force, then flooding of the voxels that pass the test
+    """
+
+    self.delayDisplay("Starting test_SegmentEditorFloodFillingSummedVolumeTable")
+
+    import numpy as np
+    from vtk.util import numpy_support
+    import SegmentEditorFloodFillingLib
+
+    sourceImageData = self.createTestImage()
+    dimensions = sourceImageData.GetDimensions()
+    shape = (dimensions[2], dimensions[1], dimensions[0])
+    sourceVoxels = numpy_support.vtk_to_numpy(sourceImageData.GetPointData().GetScalars()).reshape(shape)
+    seedIJK = (22, 14, 9)
+    seedValue = sourceImageData.GetScalarComponentAsFloat(seedIJK[0], seedIJK[1], seedIJK[2], 0)
+    neighborhoodFraction = 0.5
+
+    for tolerance in [5.0, 15.0, 30.0]:
+      lowerThreshold = seedValue - tolerance
+      upperThreshold = seedValue + tolerance
+      for neighborhoodRadius in [0.0, 1.0, 2.5]:
+        filledImageData = SegmentEditorFloodFillingLib.SegmentEditorEffect.floodFillUsingSummedVolumeTable(sourceImageData, seedIJK,
+          lowerThreshold, upperThreshold, None, neighborhoodRadius, neighborhoodFraction)
+        filledVoxels = numpy_support.vtk_to_numpy(filledImageData.GetPointData().GetScalars()).reshape(shape)
+
+        if neighborhoodRadius == 0:
+          expectedVoxels = self.floodFillUsingThresholdConnectivity(sourceImageData, seedIJK, lowerThreshold, upperThreshold)
+        else:
+          # Voxels that are in the intensity range and have enough neighbors in the intensity range
+          inRangeVoxels = (sourceVoxels >= lowerThreshold) & (sourceVoxels <= upperThreshold)
+          radius = int(neighborhoodRadius)
+          passingVoxels = np.zeros(shape, np.uint8)
+          for k, j, i in zip(*np.nonzero(inRangeVoxels)):
+            neighborhood = inRangeVoxels[max(k-radius, 0):k+radius+1, max(j-radius, 0):j+radius+1, max(i-radius, 0):i+radius+1]
+            passingVoxels[k, j, i] = neighborhood.sum() >= neighborhoodFraction * neighborhood.size
+          passingImageData = vtk.vtkImageData()
+          passingImageData.CopyStructure(sourceImageData)
+          passingImageData.GetPointData().SetScalars(numpy_support.numpy_to_vtk(passingVoxels.ravel(), deep=True))
+          expectedVoxels = self.floodFillUsingThresholdConnectivity(passingImageData, seedIJK, 1, 1)
+
+        self.assertEqual(np.count_nonzero(filledVoxels != expectedVoxels), 0,
+          f"Summed volume table result differs from reference (tolerance={tolerance}, radius={neighborhoodRadius})")
+
+    self.delayDisplay('test_SegmentEditorFloodFillingSummedVolumeTable passed')
+
+  def test_SegmentEditorFloodFillingToleranceMap(self):
+    """
+    Compare regions obtained by thresholding the tolerance map to the result of vtkImageThresholdConnectivity,
+    with and without edit mask, for several neighborhood sizes and tolerances.
+    """
+
+    self.delayDisplay("Starting test_SegmentEditorFloodFillingToleranceMap")
+
+    import numpy as np
+    from vtk.util import numpy_support
+
+    segmentEditorWidget = slicer.qMRMLSegmentEditorWidget()
+    segmentEditorWidget.setMRMLScene(slicer.mrmlScene)
+    effect = segmentEditorWidget.effectByName("Flood filling").self()
+
+    sourceImageData = self.createTestImage()
+    dimensions = sourceImageData.GetDimensions()
+    shape = (dimensions[2], dimensions[1], dimensions[0])
+
+    # Edit mask excludes the first 20 rows
+    maskVoxels = np.zeros(shape, np.uint8)
+    maskVoxels[:, :20, :] = 1
+    maskImageData = vtk.vtkImageData()
+    maskImageData.CopyStructure(sourceImageData)
+    maskImageData.GetPointData().SetScalars(numpy_support.numpy_to_vtk(maskVoxels.ravel(), deep=True))
+    maskToStencil = vtk.vtkImageToImageStencil()
+    maskToStencil.SetInputData(maskImageData)
+    maskToStencil.ThresholdByLower(0)
+    maskToStencil.Update()
+    editMaskStencil = maskToStencil.GetOutput()
+
+    neighborhoodFraction = 0.5
+    for seedIJK in [(22, 24, 9), (7, 25, 30)]:
+      seedValue = sourceImageData.GetScalarComponentAsFloat(seedIJK[0], seedIJK[1], seedIJK[2], 0)
+      for stencil in [None, editMaskStencil]:
+        for neighborhoodRadius in [0.0, 1.0, 2.5]:
+          toleranceMap = effect.getToleranceMap(sourceImageData, seedIJK, stencil, neighborhoodRadius, neighborhoodFraction)
+          for tolerance in [1.0, 5.0, 20.0, 40.0]:
+            filledImageData = effect.thresholdToleranceMap(toleranceMap, sourceImageData, tolerance)
+            filledVoxels = numpy_support.vtk_to_numpy(filledImageData.GetPointData().GetScalars()).reshape(shape)
+            expectedVoxels = self.floodFillUsingThresholdConnectivity(sourceImageData, seedIJK,
+              seedValue - tolerance, seedValue + tolerance, neighborhoodRadius, neighborhoodFraction, stencil)
+            self.assertEqual(np.count_nonzero(filledVoxels != expectedVoxels), 0,
+              f"Tolerance map result differs from reference (seed={seedIJK}, mask={stencil is not None},"
+              f" radius={neighborhoodRadius}, tolerance={tolerance})")
+
+    self.delayDisplay('test_SegmentEditorFloodFillingToleranceMap passed')
+
+  def createTestImage(self):
+    """Create a smooth random image with non-zero extent start, for comparing filling methods"""
+    import numpy as np
+    import SimpleITK as sitk
+    from vtk.util import numpy_support
+    randomGenerator = np.random.RandomState(3)
+    shape = (30, 34, 38)
+    noiseImage = sitk.GetImageFromArray(randomGenerator.rand(*shape).astype(np.float32))
+    voxels = sitk.GetArrayFromImage(sitk.SmoothingRecursiveGaussian(noiseImage, 2.0))
+    voxels = (voxels - voxels.min()) / (voxels.max() - voxels.min()) * 100.0
+    imageData = vtk.vtkImageData()
+    imageData.SetExtent(3, 3+shape[2]-1, -2, -2+shape[1]-1, 5, 5+shape[0]-1)
+    imageData.SetSpacing(1.0, 1.2, 2.0)
+    imageData.SetOrigin(4.0, 5.0, 6.0)
+    imageData.GetPointData().SetScalars(numpy_support.numpy_to_vtk(voxels.ravel(), deep=True, array_type=vtk.VTK_FLOAT))
+    return imageData
+
+  def floodFillUsingThresholdConnectivity(self, imageData, ijk, lowerThreshold, upperThreshold, neighborhoodRadius=0.0,
+      neighborhoodFraction=0.5, stencil=None):
+    """Reference implementation of filling: returns voxels (KJI order) filled by vtkImageThresholdConnectivity"""
+    from vtk.util import numpy_support
+    floodFillingFilter = vtk.vtkImageThresholdConnectivity()
+    floodFillingFilter.SetInputData(imageData)
+    origin = imageData.GetOrigin()
+    spacing = imageData.GetSpacing()
+    seedPoints = vtk.vtkPoints()
+    seedPoints.InsertNextPoint(origin[0]+ijk[0]*spacing[0], origin[1]+ijk[1]*spacing[1], origin[2]+ijk[2]*spacing[2])
+    floodFillingFilter.SetSeedPoints(seedPoints)
+    if stencil is not None:
+      floodFillingFilter.SetStencilData(stencil)
+    floodFillingFilter.SetNeighborhoodRadius(neighborhoodRadius, neighborhoodRadius, neighborhoodRadius)
+    floodFillingFilter.SetNeighborhoodFraction(neighborhoodFraction)
+    floodFillingFilter.ThresholdBetween(lowerThreshold, upperThreshold)
+    floodFillingFilter.SetInValue(1)
+    floodFillingFilter.SetOutValue(0)
+    floodFillingFilter.Update()
+    dimensions = imageData.GetDimensions()
+    return numpy_support.vtk_to_numpy(floodFillingFilter.GetOutput().GetPointData().GetScalars()).reshape(
+      dimensions[2], dimensions[1], dimensions[0])
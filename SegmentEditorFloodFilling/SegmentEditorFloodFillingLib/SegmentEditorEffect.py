@@ -11,8 +11,25 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
     scriptedEffect.perSegment = False # this effect operates on all segments at once (not on a single selected segment)
     AbstractScriptedSegmentEditorEffect.__init__(self, scriptedEffect)
     self.clippedMasterImageData = None
-    self.lastRoiNodeId = ""
-    self.lastRoiNodeModifiedTime = 0
+    # Recently clipped source images of this effect: list of (key, clippedImageData), see cropOrientedImage
+    self.croppedImageCache = []
+    self.sceneEndCloseObserver = None
+    # Edit mask stencil is reused between clicks while masking settings and segments are unchanged
+    self.editMaskStencil = None
+    self.editMaskStencilKey = None
+    # Tolerance map of the last seed is reused when filling from the same seed with a different tolerance
+    self.toleranceMap = None
+    self.toleranceMapKey = None
+    # Live preview: result of the last click is shown in a preview segmentation until it is applied
+    self.previewSeedIJK = None
+    self.previewFillKey = None
+    self.previewTolerance = None
+    self.previewLabelmap = None
+    self.previewSegmentationNode = None
+    self.previewTimer = qt.QTimer()
+    self.previewTimer.setSingleShot(True)
+    self.previewTimer.setInterval(PREVIEW_UPDATE_DELAY_MS)
+    self.previewTimer.connect('timeout()', self.updatePreview)
     self.autoUpdateParametersFromSourceVolume = True
 
   def clone(self):
@@ -33,12 +50,37 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorEffect):
     return """Fill connected voxels with similar intensity\n.
 Click in the image to add voxels that have similar intensity to the clicked voxel.
 Masking settings can be used to restrict growing to a specific region.
+Method: Flooding grows the region from the clicked voxel. Tolerance map computes for each voxel the smallest tolerance
+that would include it, which makes filling from the same position with a different tolerance instant.
+Computing the map for a new position takes longer than flooding, so it is only useful if the tolerance is adjusted after clicking.
+The map is only computed for neighborhood size up to 3, flooding is used for larger neighborhoods.
+Summed volume table uses a box-shaped neighborhood, which is checked in constant time for any neighborhood size.
+Live preview: the clicked region is only previewed and updated when tolerance or neighborhood size is changed.
+When flooding, changing only the tolerance refills just the previous region (lower tolerance) or continues from its boundary (higher tolerance).
+Click Apply to add it to the segment.
 """
 
   def activate(self):
+    # Clipped images must not be kept after the scene is closed
+    self.sceneEndCloseObserver = slicer.mrmlScene.AddObserver(slicer.mrmlScene.EndCloseEvent, self.onSceneEndClose)
     # Update intensity range
     self.sourceVolumeNodeChanged()
 
+  def deactivate(self):
+    self.cancelPreview()
+    if self.sceneEndCloseObserver is not None:
+      slicer.mrmlScene.RemoveObserver(self.sceneEndCloseObserver)
+      self.sceneEndCloseObserver = None
+    self.clearCroppedImageCache()
+
+  def onSceneEndClose(self, caller=None, event=None):
+    self.clearCroppedImageCache()
+
+  def clearCroppedImageCache(self):
+    # Clipped images may share voxels with the source volume, release them so that the source voxels can be freed
+    self.croppedImageCache = []
+    self.clippedMasterImageData = None
+
   def setupOptionsFrame(self):
 
     self.intensityToleranceSlider = ctk.ctkSliderWidget()
@@ -63,6 +105,38 @@ Masking settings can be used to restrict growing to a specific region.
     self.neighborhoodSizeMmSlider.connect("valueChanged(double)", self.updateMRMLFromGUI)
     self.intensityToleranceSlider.connect("valueChanged(double)", self.updateMRMLFromGUI)
 
+    self.methodSelector = qt.QComboBox()
+    self.methodSelector.addItem(METHOD_FLOODING)
+    self.methodSelector.addItem(METHOD_TOLERANCE_MAP)
+    self.methodSelector.addItem(METHOD_SUMMED_VOLUME_TABLE)
+    self.methodSelector.setToolTip("Flooding: grow the region from the clicked voxel.\n"
+      "Tolerance map: compute the smallest tolerance that includes each voxel, for the clicked voxel."
+      " The map is reused when filling from the same voxel again, with any tolerance."
+      " Each new click takes longer than flooding. Only available for neighborhood size up to 3,"
+      " flooding is used for larger neighborhoods.\n"
+      "Summed volume table: check the neighborhood of voxels using a summed volume table of voxels in the intensity range."
+      " The neighborhood is a box and computation time does not depend on its size.")
+    self.scriptedEffect.addLabeledOptionsWidget("Method:", self.methodSelector)
+    self.methodSelector.connect("currentIndexChanged(int)", self.updateMRMLFromGUI)
+
+    self.livePreviewCheckBox = qt.QCheckBox()
+    self.livePreviewCheckBox.setToolTip("If checked then clicking only previews the filled region,"
+      " which is updated when intensity tolerance or neighborhood size is changed. Click Apply to add it to the segment.")
+    self.applyPreviewButton = qt.QPushButton("Apply")
+    self.applyPreviewButton.objectName = self.__class__.__name__ + 'Apply'
+    self.applyPreviewButton.setToolTip("Add the previewed region to the selected segment.")
+    self.cancelPreviewButton = qt.QPushButton("Cancel")
+    self.cancelPreviewButton.objectName = self.__class__.__name__ + 'Cancel'
+    self.cancelPreviewButton.setToolTip("Discard the previewed region.")
+    livePreviewFrame = qt.QHBoxLayout()
+    livePreviewFrame.addWidget(self.livePreviewCheckBox)
+    livePreviewFrame.addWidget(self.applyPreviewButton)
+    livePreviewFrame.addWidget(self.cancelPreviewButton)
+    self.scriptedEffect.addLabeledOptionsWidget("Live preview:", livePreviewFrame)
+    self.livePreviewCheckBox.connect("toggled(bool)", self.updateMRMLFromGUI)
+    self.applyPreviewButton.connect("clicked()", self.applyPreview)
+    self.cancelPreviewButton.connect("clicked()", self.cancelPreview)
+
     # Add ROI options
     self.roiSelector = slicer.qMRMLNodeComboBox()
     self.roiSelector.nodeTypes = ['vtkMRMLMarkupsROINode', 'vtkMRMLAnnotationROINode']
@@ -79,6 +153,7 @@ Masking settings can be used to restrict growing to a specific region.
   def updateParametersFromSourceVolume(self):
     # Force recomputation of clipped source image data
     self.clippedMasterImageData = None
+    self.cancelPreview()
 
     # Set scalar range of source volume image data to threshold slider
     import math
@@ -121,6 +196,8 @@ Masking settings can be used to restrict growing to a specific region.
   def setMRMLDefaults(self):
     self.scriptedEffect.setParameterDefault("IntensityTolerance", 10.0)
     self.scriptedEffect.setParameterDefault("NeighborhoodSizeMm", 1.0)
+    self.scriptedEffect.setParameterDefault("Method", METHOD_FLOODING)
+    self.scriptedEffect.setParameterDefault("LivePreview", 0)
     self.scriptedEffect.parameterSetNode().SetNodeReferenceID("FloodFilling.ROI", None)
 
   def updateGUIFromMRML(self):
@@ -133,11 +210,27 @@ Masking settings can be used to restrict growing to a specific region.
     wasBlocked = self.roiSelector.blockSignals(True)
     self.roiSelector.setCurrentNode(self.scriptedEffect.parameterSetNode().GetNodeReference("FloodFilling.ROI"))
     self.roiSelector.blockSignals(wasBlocked)
+    wasBlocked = self.methodSelector.blockSignals(True)
+    self.methodSelector.setCurrentText(self.scriptedEffect.parameter("Method"))
+    self.methodSelector.blockSignals(wasBlocked)
+    wasBlocked = self.livePreviewCheckBox.blockSignals(True)
+    self.livePreviewCheckBox.checked = (self.scriptedEffect.integerParameter("LivePreview") != 0)
+    self.livePreviewCheckBox.blockSignals(wasBlocked)
+    self.applyPreviewButton.enabled = self.previewSeedIJK is not None
+    self.cancelPreviewButton.enabled = self.previewSeedIJK is not None
 
   def updateMRMLFromGUI(self):
     self.scriptedEffect.setParameter("IntensityTolerance", self.intensityToleranceSlider.value)
     self.scriptedEffect.setParameter("NeighborhoodSizeMm", self.neighborhoodSizeMmSlider.value)
     self.scriptedEffect.parameterSetNode().SetNodeReferenceID("FloodFilling.ROI", self.roiSelector.currentNodeID)
+    self.scriptedEffect.setParameter("Method", self.methodSelector.currentText)
+    self.scriptedEffect.setParameter("LivePreview", 1 if self.livePreviewCheckBox.checked else 0)
+    if not self.livePreviewCheckBox.checked:
+      # Preview is discarded when live preview is turned off
+      self.cancelPreview()
+    elif self.previewSeedIJK is not None:
+      # Update the preview after the settings have not been changed for a short time
+      self.previewTimer.start()
 
   def getClippedSourceImageData(self):
     # Return sourceImageData unchanged if there is no ROI
@@ -145,24 +238,75 @@ Masking settings can be used to restrict growing to a specific region.
     roiNode = self.roiSelector.currentNode()
     if roiNode is None or sourceImageData is None:
       self.clippedMasterImageData = None
-      self.lastRoiNodeId = ""
-      self.lastRoiNodeModifiedTime = 0
       return sourceImageData
 
-    # Return last clipped image data if there was no change
-    if (self.clippedMasterImageData is not None
-      and roiNode.GetID() == self.lastRoiNodeId
-      and roiNode.GetMTime() == self.lastRoiNodeModifiedTime):
-      # Use cached clipped source image data
-      return self.clippedMasterImageData
-
-    # Compute clipped source image
+    # Clipped source image is cached by cropOrientedImage while the ROI and the source image data are not modified
     import SegmentEditorLocalThresholdLib
-    self.clippedMasterImageData = SegmentEditorLocalThresholdLib.SegmentEditorEffect.cropOrientedImage(sourceImageData, roiNode)
-    self.lastRoiNodeId = roiNode.GetID()
-    self.lastRoiNodeModifiedTime = roiNode.GetMTime()
+    self.clippedMasterImageData = SegmentEditorLocalThresholdLib.SegmentEditorEffect.cropOrientedImage(
+      sourceImageData, roiNode, self.croppedImageCache, self.scriptedEffect.parameterSetNode().GetSourceVolumeNode())
     return self.clippedMasterImageData
 
+  def getEditMaskStencil(self, sourceImageData):
+    """Get stencil of the region where editing is allowed, as specified by the masking settings.
+    The stencil is cached and only recomputed if masking settings, the source image, or segments
+    that the mask depends on are modified. Returns None if the edit mask cannot be generated.
+    """
+    import vtkSegmentationCorePython as vtkSegmentationCore
+    parameterSetNode = self.scriptedEffect.parameterSetNode()
+    segmentationNode = parameterSetNode.GetSegmentationNode()
+    maskMode = parameterSetNode.GetMaskMode()
+    selectedSegmentID = parameterSetNode.GetSelectedSegmentID()
+    maskSegmentID = parameterSetNode.GetMaskSegmentID() if parameterSetNode.GetMaskSegmentID() else ""
+    intensityBasedMasking = parameterSetNode.GetSourceVolumeIntensityMask()
+    intensityMaskRange = tuple(parameterSetNode.GetSourceVolumeIntensityMaskRange()) if intensityBasedMasking else None
+
+    # Modified times of segments (and their visibility) that the edit mask depends on
+    segmentation = segmentationNode.GetSegmentation()
+    if maskMode == slicer.vtkMRMLSegmentationNode.EditAllowedEverywhere:
+      maskSegmentIDs = []
+    elif maskMode == slicer.vtkMRMLSegmentationNode.EditAllowedInsideSingleSegment:
+      maskSegmentIDs = [maskSegmentID]
+    else:
+      maskSegmentIDs = [segmentID for segmentID in segmentation.GetSegmentIDs() if segmentID != selectedSegmentID]
+    binaryLabelmapName = vtkSegmentationCore.vtkSegmentationConverter.GetBinaryLabelmapRepresentationName()
+    segmentModifiedTimes = []
+    for segmentID in maskSegmentIDs:
+      segment = segmentation.GetSegment(segmentID)
+      if segment is None:
+        segmentModifiedTimes.append(None)
+        continue
+      representation = segment.GetRepresentation(binaryLabelmapName)
+      segmentModifiedTimes.append(representation.GetMTime() if representation else segment.GetMTime())
+    displayNode = segmentationNode.GetDisplayNode()
+    displayModifiedTime = displayNode.GetMTime() if (displayNode and maskSegmentIDs) else None
+
+    editMaskStencilKey = (
+      segmentationNode.GetID(), maskMode, selectedSegmentID, maskSegmentID, intensityMaskRange,
+      id(sourceImageData), sourceImageData.GetMTime(),
+      tuple(maskSegmentIDs), tuple(segmentModifiedTimes), displayModifiedTime)
+    if self.editMaskStencilKey == editMaskStencilKey:
+      return self.editMaskStencil
+    self.editMaskStencil = None
+    self.editMaskStencilKey = None
+
+    maskImageData = vtkSegmentationCore.vtkOrientedImageData()
+    success = segmentationNode.GenerateEditMask(maskImageData,
+      maskMode,
+      sourceImageData, # reference geometry
+      selectedSegmentID,
+      maskSegmentID,
+      sourceImageData if intensityBasedMasking else None,
+      intensityMaskRange)
+    if not success:
+      return None
+    stencil = vtk.vtkImageToImageStencil()
+    stencil.SetInputData(maskImageData)
+    stencil.ThresholdByLower(0)
+    stencil.Update()
+    self.editMaskStencil = stencil.GetOutput()
+    self.editMaskStencilKey = editMaskStencilKey
+    return self.editMaskStencil
+
   def processInteractionEvents(self, callerInteractor, eventId, viewWidget):
     abortEvent = False
 
@@ -190,21 +334,79 @@ Masking settings can be used to restrict growing to a specific region.
   def floodFillFromPoint(self, ijk):
     """Fills the segment taking based on the current source volume.
     Input IJK position is voxel coordinates of source volume.
+    If live preview is enabled then the filled region is only previewed.
     """
-    self.scriptedEffect.saveStateForUndo()
+    if self.scriptedEffect.integerParameter("LivePreview") != 0:
+      self.previewSeedIJK = ijk
+      self.previewLabelmap = None
+      self.updatePreview()
+      return
 
     # Get source volume image data
-    import vtkSegmentationCorePython as vtkSegmentationCore
     sourceImageData = self.getClippedSourceImageData()
-    selectedSegmentLabelmap = self.scriptedEffect.selectedSegmentLabelmap()
 
     # Get modifier labelmap
     modifierLabelmap = self.scriptedEffect.defaultModifierLabelmap()
 
+    filledImageData = self.computeFloodFill(sourceImageData, ijk)
+
+    # Only the filled region is copied to the modifier labelmap, so that only that region is merged into the segment
+    filledExtent = SegmentEditorEffect.getNonZeroExtent(filledImageData)
+    if filledExtent is None:
+      return
+    clip = vtk.vtkImageClip()
+    clip.SetInputData(filledImageData)
+    clip.SetOutputWholeExtent(filledExtent)
+    clip.ClipDataOn()
+    clip.Update()
+    modifierLabelmap.ShallowCopy(clip.GetOutput())
+
+    # Apply changes. Undo state is only saved if the segment is modified.
+    self.scriptedEffect.saveStateForUndo()
+    self.scriptedEffect.modifySelectedSegmentByLabelmap(modifierLabelmap, slicer.qSlicerSegmentEditorAbstractEffect.ModificationModeAdd)
+
+  def getFillMethod(self):
+    """Get the method that is used for filling with the current settings.
+    Tolerance map stores all neighborhood values of a voxel at once, therefore flooding is used instead
+    if the neighborhood is larger than TOLERANCE_MAP_MAXIMUM_NEIGHBORHOOD_SIZE_MM.
+    """
+    method = self.scriptedEffect.parameter("Method")
+    if method == METHOD_TOLERANCE_MAP and self.neighborhoodSizeMmSlider.value > TOLERANCE_MAP_MAXIMUM_NEIGHBORHOOD_SIZE_MM:
+      return METHOD_FLOODING
+    return method
+
+  def computeFloodFill(self, sourceImageData, ijk, restrictingImageData=None, includedImageData=None):
+    """Get image data that contains 1 in voxels that are filled from the seed and 0 elsewhere.
+    If restrictingImageData is specified then only its non-zero voxels can be filled,
+    therefore it must contain the result (for example, the region filled with a higher tolerance).
+    If includedImageData is specified then its non-zero voxels must be part of the result
+    (for example, the region filled with a lower tolerance) and flooding only continues from its boundary.
+    """
+    import numpy as np
+    from vtk.util import numpy_support
+    selectedSegmentLabelmap = self.scriptedEffect.selectedSegmentLabelmap()
+
     pixelValue = sourceImageData.GetScalarComponentAsFloat(ijk[0], ijk[1], ijk[2], 0)
 
     useSegmentationAsStencil = False
 
+    editMaskStencil = self.getEditMaskStencil(sourceImageData)
+    if editMaskStencil is None:
+      logging.error("Failed to create edit mask")
+
+    neighborhoodSizeMm = self.neighborhoodSizeMmSlider.value
+    pixelValueTolerance = float(self.intensityToleranceSlider.value)
+
+    method = self.getFillMethod()
+    if method == METHOD_TOLERANCE_MAP:
+      toleranceMap = self.getToleranceMap(sourceImageData, ijk, editMaskStencil, neighborhoodSizeMm, NEIGHBORHOOD_FRACTION)
+      return SegmentEditorEffect.thresholdToleranceMap(toleranceMap, sourceImageData, pixelValueTolerance)
+
+    if method == METHOD_SUMMED_VOLUME_TABLE:
+      return SegmentEditorEffect.floodFillUsingSummedVolumeTable(sourceImageData, ijk,
+        pixelValue-pixelValueTolerance, pixelValue+pixelValueTolerance,
+        editMaskStencil, neighborhoodSizeMm, NEIGHBORHOOD_FRACTION)
+
     # Perform thresholding
     floodFillingFilter = vtk.vtkImageThresholdConnectivity()
     floodFillingFilter.SetInputData(sourceImageData)
@@ -214,28 +416,82 @@ Masking settings can be used to restrict growing to a specific region.
     seedPoints.InsertNextPoint(origin[0]+ijk[0]*spacing[0], origin[1]+ijk[1]*spacing[1], origin[2]+ijk[2]*spacing[2])
     floodFillingFilter.SetSeedPoints(seedPoints)
 
-    maskImageData = vtkSegmentationCore.vtkOrientedImageData()
-    intensityBasedMasking = self.scriptedEffect.parameterSetNode().GetSourceVolumeIntensityMask()
-    segmentationNode = self.scriptedEffect.parameterSetNode().GetSegmentationNode()
-    success = segmentationNode.GenerateEditMask(maskImageData,
-      self.scriptedEffect.parameterSetNode().GetMaskMode(),
-      sourceImageData, # reference geometry
-      self.scriptedEffect.parameterSetNode().GetSelectedSegmentID(),
-      self.scriptedEffect.parameterSetNode().GetMaskSegmentID() if self.scriptedEffect.parameterSetNode().GetMaskSegmentID() else "",
-      sourceImageData if intensityBasedMasking else None,
-      self.scriptedEffect.parameterSetNode().GetSourceVolumeIntensityMaskRange() if intensityBasedMasking else None)
-    if success:
-      stencil = vtk.vtkImageToImageStencil()
-      stencil.SetInputData(maskImageData)
-      stencil.ThresholdByLower(0)
-      stencil.Update()
-      floodFillingFilter.SetStencilData(stencil.GetOutput())
-    else:
-      logging.error("Failed to create edit mask")
+    if editMaskStencil is not None:
+      floodFillingFilter.SetStencilData(editMaskStencil)
+
+    if restrictingImageData is not None:
+      restrictingExtent = SegmentEditorEffect.getNonZeroExtent(restrictingImageData)
+      if restrictingExtent is None:
+        return restrictingImageData
+      # Only the restricting region is flooded. Input is padded by the neighborhood size so that
+      # voxels have the same neighborhood as in the full image.
+      import math
+      padding = int(math.floor(neighborhoodSizeMm))
+      sourceExtent = sourceImageData.GetExtent()
+      for axis in range(3):
+        restrictingExtent[2*axis] = max(restrictingExtent[2*axis] - padding, sourceExtent[2*axis])
+        restrictingExtent[2*axis+1] = min(restrictingExtent[2*axis+1] + padding, sourceExtent[2*axis+1])
+      sourceClip = vtk.vtkImageClip()
+      sourceClip.SetInputData(sourceImageData)
+      sourceClip.SetOutputWholeExtent(restrictingExtent)
+      sourceClip.ClipDataOn()
+      sourceClip.Update()
+      floodFillingFilter.SetInputData(sourceClip.GetOutput())
+      # Restricting region is already within the edit mask. It is padded to the extent of the clipped input,
+      # as the restricting image may only contain the previously filled region.
+      restrictingPad = vtk.vtkImageConstantPad()
+      restrictingPad.SetInputData(restrictingImageData)
+      restrictingPad.SetOutputWholeExtent(restrictingExtent)
+      restrictingPad.SetConstant(0)
+      restrictingStencil = vtk.vtkImageToImageStencil()
+      restrictingStencil.SetInputConnection(restrictingPad.GetOutputPort())
+      restrictingStencil.ThresholdByUpper(0.5)
+      restrictingStencil.Update()
+      floodFillingFilter.SetStencilData(restrictingStencil.GetOutput())
+
+    includedVoxels = None
+    if includedImageData is not None and restrictingImageData is None:
+      includedVoxels = SegmentEditorEffect.getPaddedVoxels(includedImageData, sourceImageData.GetExtent())
+      # Voxels whose face neighbors are all included cannot lead to new voxels, so they are not flooded again.
+      # Voxels at the image boundary are only checked within the image.
+      interiorVoxels = includedVoxels.copy()
+      for axis in range(3):
+        lowerSlices = [slice(None)] * 3
+        upperSlices = [slice(None)] * 3
+        lowerSlices[axis] = slice(None, -1)
+        upperSlices[axis] = slice(1, None)
+        interiorVoxels[tuple(lowerSlices)] &= includedVoxels[tuple(upperSlices)]
+        interiorVoxels[tuple(upperSlices)] &= includedVoxels[tuple(lowerSlices)]
+      boundaryIndices = np.nonzero(includedVoxels & ~interiorVoxels)
+      if len(boundaryIndices[0]) == 0:
+        # Included region fills the image, it cannot grow
+        includedImage = vtk.vtkImageData()
+        includedImage.CopyStructure(sourceImageData)
+        includedImage.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+        numpy_support.vtk_to_numpy(includedImage.GetPointData().GetScalars())[:] = includedVoxels.ravel()
+        return includedImage
+      # Flooding starts from all boundary voxels of the included region
+      boundaryPoints = np.empty((len(boundaryIndices[0]), 3))
+      for axis in range(3):
+        boundaryPoints[:, axis] = origin[axis] + (boundaryIndices[2-axis] + sourceImageData.GetExtent()[2*axis]) * spacing[axis]
+      seedPoints = vtk.vtkPoints()
+      seedPoints.SetData(numpy_support.numpy_to_vtk(boundaryPoints, deep=True))
+      floodFillingFilter.SetSeedPoints(seedPoints)
+      allowedVoxels = ~interiorVoxels
+      if editMaskStencil is not None:
+        allowedVoxels &= SegmentEditorEffect.getStencilVoxels(editMaskStencil, allowedVoxels.shape) != 0
+      allowedImage = vtk.vtkImageData()
+      allowedImage.CopyStructure(sourceImageData)
+      allowedImage.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+      numpy_support.vtk_to_numpy(allowedImage.GetPointData().GetScalars())[:] = allowedVoxels.ravel()
+      allowedStencil = vtk.vtkImageToImageStencil()
+      allowedStencil.SetInputData(allowedImage)
+      allowedStencil.ThresholdByUpper(0.5)
+      allowedStencil.Update()
+      floodFillingFilter.SetStencilData(allowedStencil.GetOutput())
 
-    neighborhoodSizeMm = self.neighborhoodSizeMmSlider.value
     floodFillingFilter.SetNeighborhoodRadius(neighborhoodSizeMm,neighborhoodSizeMm,neighborhoodSizeMm)
-    floodFillingFilter.SetNeighborhoodFraction(0.5)
+    floodFillingFilter.SetNeighborhoodFraction(NEIGHBORHOOD_FRACTION)
 
     if useSegmentationAsStencil:
       stencilFilter = vtk.vtkImageToImageStencil()
@@ -244,13 +500,374 @@ Masking settings can be used to restrict growing to a specific region.
       stencilFilter.Update()
       floodFillingFilter.SetStencilData(stencilFilter.GetOutput())
 
-    pixelValueTolerance = float(self.intensityToleranceSlider.value)
     floodFillingFilter.ThresholdBetween(pixelValue-pixelValueTolerance, pixelValue+pixelValueTolerance)
 
     floodFillingFilter.SetInValue(1)
     floodFillingFilter.SetOutValue(0)
     floodFillingFilter.Update()
-    modifierLabelmap.DeepCopy(floodFillingFilter.GetOutput())
+    filledImageData = floodFillingFilter.GetOutput()
+    if includedVoxels is not None:
+      filledVoxels = numpy_support.vtk_to_numpy(filledImageData.GetPointData().GetScalars())
+      filledVoxels[includedVoxels.ravel()] = 1
+      filledImageData.Modified()
+    return filledImageData
+
+  def updatePreview(self):
+    """Fill from the last clicked position with the current settings and show the result in the preview segmentation"""
+    if self.previewSeedIJK is None:
+      return
+    sourceImageData = self.getClippedSourceImageData()
+    extent = sourceImageData.GetExtent() if sourceImageData else None
+    if extent is None or any([not (extent[2*axis] <= self.previewSeedIJK[axis] <= extent[2*axis+1]) for axis in range(3)]):
+      # Seed is not in the source image anymore (e.g., ROI is changed)
+      self.cancelPreview()
+      return
 
-    # Apply changes
-    self.scriptedEffect.modifySelectedSegmentByLabelmap(modifierLabelmap, slicer.qSlicerSegmentEditorAbstractEffect.ModificationModeAdd)
+    qt.QApplication.setOverrideCursor(qt.Qt.WaitCursor)
+    try:
+      method = self.getFillMethod()
+      tolerance = float(self.intensityToleranceSlider.value)
+      editMaskStencil = self.getEditMaskStencil(sourceImageData)
+      previewFillKey = (method, self.neighborhoodSizeMmSlider.value, id(sourceImageData), sourceImageData.GetMTime(),
+        id(editMaskStencil), editMaskStencil.GetMTime() if editMaskStencil else None)
+      # Decreasing the tolerance can only shrink the region, so only the previous region is flooded again.
+      # Increasing the tolerance can only grow the region, so flooding continues from the boundary of the previous region.
+      # Tolerance map method does not need this, as the map is computed once and then just thresholded.
+      restrictingImageData = None
+      includedImageData = None
+      if (method == METHOD_FLOODING and previewFillKey == self.previewFillKey
+          and self.previewLabelmap is not None and not self.previewLabelmap.IsEmpty()):
+        if tolerance <= self.previewTolerance:
+          restrictingImageData = self.previewLabelmap
+        else:
+          includedImageData = self.previewLabelmap
+      filledImageData = self.computeFloodFill(sourceImageData, self.previewSeedIJK, restrictingImageData, includedImageData)
+      self.previewFillKey = previewFillKey
+      self.previewTolerance = tolerance
+
+      # Only the filled region is kept, it is shown in the preview and restricts the next update
+      previewLabelmap = slicer.vtkOrientedImageData()
+      filledExtent = SegmentEditorEffect.getNonZeroExtent(filledImageData)
+      if filledExtent is not None:
+        clip = vtk.vtkImageClip()
+        clip.SetInputData(filledImageData)
+        clip.SetOutputWholeExtent(filledExtent)
+        clip.ClipDataOn()
+        clip.Update()
+        previewLabelmap.ShallowCopy(clip.GetOutput())
+      previewLabelmap.CopyDirections(sourceImageData)
+      self.previewLabelmap = previewLabelmap
+      self.showPreviewLabelmap(previewLabelmap)
+    finally:
+      qt.QApplication.restoreOverrideCursor()
+    self.updateGUIFromMRML()
+
+  def showPreviewLabelmap(self, previewLabelmap):
+    segmentationNode = self.scriptedEffect.parameterSetNode().GetSegmentationNode()
+    if self.previewSegmentationNode is None:
+      self.previewSegmentationNode = slicer.mrmlScene.AddNewNodeByClass("vtkMRMLSegmentationNode",
+        slicer.mrmlScene.GenerateUniqueName("FloodFillingPreview"))
+      self.previewSegmentationNode.SetHideFromEditors(True)
+      self.previewSegmentationNode.SetSaveWithScene(False)
+      self.previewSegmentationNode.CreateDefaultDisplayNodes()
+      self.previewSegmentationNode.GetDisplayNode().SetVisibility3D(False)
+      selectedSegment = segmentationNode.GetSegmentation().GetSegment(self.scriptedEffect.parameterSetNode().GetSelectedSegmentID())
+      self.previewSegmentationNode.GetSegmentation().AddEmptySegment(PREVIEW_SEGMENT_ID, PREVIEW_SEGMENT_ID,
+        selectedSegment.GetColor() if selectedSegment else PREVIEW_SEGMENT_COLOR)
+    self.previewSegmentationNode.SetAndObserveTransformNodeID(segmentationNode.GetTransformNodeID())
+    slicer.vtkSlicerSegmentationsModuleLogic.SetBinaryLabelmapToSegment(previewLabelmap, self.previewSegmentationNode, PREVIEW_SEGMENT_ID)
+
+  def applyPreview(self):
+    if self.previewSeedIJK is None:
+      return
+    # Make sure that the preview reflects the current settings
+    if self.previewTimer.isActive():
+      self.previewTimer.stop()
+      self.updatePreview()
+    previewLabelmap = self.previewLabelmap
+    self.cancelPreview()
+    if previewLabelmap is None or previewLabelmap.IsEmpty():
+      return
+    self.scriptedEffect.saveStateForUndo()
+    self.scriptedEffect.modifySelectedSegmentByLabelmap(previewLabelmap, slicer.qSlicerSegmentEditorAbstractEffect.ModificationModeAdd)
+
+  def cancelPreview(self):
+    self.previewTimer.stop()
+    self.previewSeedIJK = None
+    self.previewFillKey = None
+    self.previewTolerance = None
+    self.previewLabelmap = None
+    if self.previewSegmentationNode is not None:
+      slicer.mrmlScene.RemoveNode(self.previewSegmentationNode)
+      self.previewSegmentationNode = None
+    if hasattr(self, "applyPreviewButton"):
+      self.applyPreviewButton.enabled = False
+      self.cancelPreviewButton.enabled = False
+
+  @staticmethod
+  def getPaddedVoxels(imageData, extent):
+    """Get numpy array (in KJI order) of the specified extent that is True in the non-zero voxels of the image data"""
+    from vtk.util import numpy_support
+    pad = vtk.vtkImageConstantPad()
+    pad.SetInputData(imageData)
+    pad.SetOutputWholeExtent(extent)
+    pad.SetConstant(0)
+    pad.Update()
+    paddedImageData = pad.GetOutput()
+    dimensions = paddedImageData.GetDimensions()
+    voxels = numpy_support.vtk_to_numpy(paddedImageData.GetPointData().GetScalars())
+    return voxels.reshape(dimensions[2], dimensions[1], dimensions[0]) != 0
+
+  @staticmethod
+  def getNonZeroExtent(imageData):
+    """Get extent of the non-zero voxels of the image data. Returns None if all voxels are zero."""
+    import numpy as np
+    from vtk.util import numpy_support
+    extent = imageData.GetExtent()
+    dimensions = imageData.GetDimensions()
+    voxels = numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars()).reshape(
+      dimensions[2], dimensions[1], dimensions[0])
+    nonZeroExtent = [0, -1, 0, -1, 0, -1]
+    # voxels array axes are in KJI order
+    for axis, otherAxes in enumerate([(0, 1), (0, 2), (1, 2)]):
+      nonZeroIndices = np.flatnonzero(voxels.any(axis=otherAxes))
+      if len(nonZeroIndices) == 0:
+        return None
+      nonZeroExtent[2*axis] = extent[2*axis] + int(nonZeroIndices[0])
+      nonZeroExtent[2*axis+1] = extent[2*axis] + int(nonZeroIndices[-1])
+    return nonZeroExtent
+
+  def getToleranceMap(self, sourceImageData, ijk, editMaskStencil, neighborhoodRadius, neighborhoodFraction):
+    """Get the tolerance map of the seed voxel, which contains for each voxel the smallest intensity tolerance
+    that would include the voxel in the region filled from the seed. Voxels that cannot be reached contain
+    the maximum value of the map's data type. The last map is reused if called again with the same inputs.
+    """
+    editMaskStencilModifiedTime = editMaskStencil.GetMTime() if editMaskStencil is not None else None
+    toleranceMapKey = (id(sourceImageData), sourceImageData.GetMTime(), tuple([int(round(c)) for c in ijk]),
+      id(editMaskStencil), editMaskStencilModifiedTime, neighborhoodRadius, neighborhoodFraction)
+    if self.toleranceMapKey == toleranceMapKey:
+      return self.toleranceMap
+    self.toleranceMap = None
+    self.toleranceMapKey = None
+
+    import numpy as np
+    import SimpleITK as sitk
+    from vtk.util import numpy_support
+    extent = sourceImageData.GetExtent()
+    dimensions = sourceImageData.GetDimensions()
+    sourceVoxels = numpy_support.vtk_to_numpy(sourceImageData.GetPointData().GetScalars())
+    if sourceVoxels.ndim > 1:
+      sourceVoxels = sourceVoxels[:, 0]
+    sourceVoxels = sourceVoxels.reshape(dimensions[2], dimensions[1], dimensions[0])
+    seedIndex = tuple([int(round(ijk[axis])) - extent[2*axis] for axis in [2, 1, 0]])
+
+    # Cost of each voxel is the smallest tolerance that puts the voxel in the intensity range
+    # and passes the neighborhood test. Integer images with a small intensity range use 16-bit costs,
+    # which halves memory usage and makes sorting and reconstruction faster.
+    lo, hi = sourceImageData.GetScalarRange()
+    if np.issubdtype(sourceVoxels.dtype, np.integer) and hi - lo < np.iinfo(np.uint16).max:
+      costType = np.uint16
+      costVoxels = np.abs(sourceVoxels.astype(np.int32) - int(sourceVoxels[seedIndex])).astype(costType)
+    else:
+      costType = np.float64 if sourceImageData.GetScalarType() == vtk.VTK_DOUBLE else np.float32
+      costVoxels = np.abs(sourceVoxels.astype(costType) - costType(sourceVoxels[seedIndex]))
+    costVoxels = np.maximum(costVoxels,
+      SegmentEditorEffect.computeNeighborhoodTolerance(costVoxels, neighborhoodRadius, neighborhoodFraction))
+    # Maximum cost is larger than the intensity range, therefore it is not reached by any tolerance
+    unreachableCost = SegmentEditorEffect.getMaximumCost(costType)
+    if editMaskStencil is not None:
+      costVoxels[SegmentEditorEffect.getStencilVoxels(editMaskStencil, costVoxels.shape) == 0] = unreachableCost
+
+    # Smallest tolerance that connects each voxel to the seed is the minimum over all paths of the
+    # maximum cost along the path, which is the grayscale reconstruction by erosion from the seed
+    markerVoxels = np.full(costVoxels.shape, unreachableCost, costType)
+    markerVoxels[seedIndex] = costVoxels[seedIndex]
+    toleranceImage = sitk.ReconstructionByErosion(sitk.GetImageFromArray(markerVoxels), sitk.GetImageFromArray(costVoxels), False)
+    self.toleranceMap = sitk.GetArrayFromImage(toleranceImage)
+    self.toleranceMapKey = toleranceMapKey
+    return self.toleranceMap
+
+  @staticmethod
+  def thresholdToleranceMap(toleranceMap, referenceImageData, tolerance):
+    """Get image data that contains 1 in voxels that are filled with the specified tolerance and 0 elsewhere"""
+    import numpy as np
+    from vtk.util import numpy_support
+    filledImageData = vtk.vtkImageData()
+    filledImageData.CopyStructure(referenceImageData)
+    filledImageData.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+    filledVoxels = numpy_support.vtk_to_numpy(filledImageData.GetPointData().GetScalars()).reshape(toleranceMap.shape)
+    np.less_equal(toleranceMap, tolerance, out=filledVoxels, casting="unsafe")
+    return filledImageData
+
+  @staticmethod
+  def getNeighborhoodOffsets(neighborhoodRadius):
+    """Get KJI offsets of the voxels in the neighborhood that vtkImageThresholdConnectivity uses:
+    an ellipsoid with the specified radius in voxels.
+    """
+    import math
+    radius = int(math.floor(neighborhoodRadius))
+    if radius <= 0:
+      return [(0, 0, 0)]
+    offsets = []
+    for k in range(-radius, radius+1):
+      for j in range(-radius, radius+1):
+        for i in range(-radius, radius+1):
+          if (i*i + j*j + k*k) <= neighborhoodRadius * neighborhoodRadius:
+            offsets.append((k, j, i))
+    return offsets
+
+  @staticmethod
+  def getMaximumCost(costType):
+    """Get the largest value of the cost data type, which is reserved for voxels that are never filled"""
+    import numpy as np
+    if np.issubdtype(costType, np.integer):
+      return np.iinfo(costType).max
+    return np.finfo(costType).max
+
+  @staticmethod
+  def computeNeighborhoodTolerance(costVoxels, neighborhoodRadius, neighborhoodFraction):
+    """Get the smallest tolerance for each voxel that puts at least neighborhoodFraction of the voxels
+    of its neighborhood (within the image) in the intensity range, i.e., the k-th smallest cost in the neighborhood.
+    """
+    import numpy as np
+    offsets = SegmentEditorEffect.getNeighborhoodOffsets(neighborhoodRadius)
+    if len(offsets) == 1:
+      return costVoxels
+    radius = max([max(offset) for offset in offsets])
+    outsideCost = SegmentEditorEffect.getMaximumCost(costVoxels.dtype)
+    neighborhoodTolerance = np.empty_like(costVoxels)
+    shape = costVoxels.shape
+    # Neighborhood values are processed in blocks to limit memory usage. Blocks contain whole rows if possible,
+    # but are split along all axes if a single row or slice has too many neighborhood values.
+    # Neighborhood values of a block are stored twice while they are reordered for sorting.
+    maximumNumberOfVoxels = max(1, NEIGHBORHOOD_TOLERANCE_MAX_ELEMENTS // (2 * len(offsets)))
+    blockSize = [0, 0, min(shape[2], maximumNumberOfVoxels)]
+    blockSize[1] = min(shape[1], max(1, maximumNumberOfVoxels // blockSize[2]))
+    blockSize[0] = min(shape[0], max(1, maximumNumberOfVoxels // (blockSize[1] * blockSize[2])))
+    for blockStart in [(k, j, i) for k in range(0, shape[0], blockSize[0])
+        for j in range(0, shape[1], blockSize[1]) for i in range(0, shape[2], blockSize[2])]:
+      blockEnd = [min(blockStart[axis] + blockSize[axis], shape[axis]) for axis in range(3)]
+      blockShape = tuple([blockEnd[axis] - blockStart[axis] for axis in range(3)])
+      # Only the block and its margin is padded with the outside cost, not the whole image
+      paddedBlock = np.full([blockShape[axis] + 2*radius for axis in range(3)], outsideCost, costVoxels.dtype)
+      sourceStart = [max(blockStart[axis] - radius, 0) for axis in range(3)]
+      sourceEnd = [min(blockEnd[axis] + radius, shape[axis]) for axis in range(3)]
+      paddedBlock[tuple([slice(sourceStart[axis] - blockStart[axis] + radius, sourceEnd[axis] - blockStart[axis] + radius)
+        for axis in range(3)])] = costVoxels[tuple([slice(sourceStart[axis], sourceEnd[axis]) for axis in range(3)])]
+      offsetValues = np.empty((len(offsets),) + blockShape, costVoxels.dtype)
+      for offsetIndex, (k, j, i) in enumerate(offsets):
+        offsetValues[offsetIndex] = paddedBlock[radius+k:radius+k+blockShape[0],
+          radius+j:radius+j+blockShape[1], radius+i:radius+i+blockShape[2]]
+      del paddedBlock
+      # Neighborhood values of each voxel are made contiguous, as sorting along the last axis is several times faster
+      neighborhoodValues = np.moveaxis(offsetValues, 0, -1).copy()
+      del offsetValues
+      neighborhoodValues.sort(axis=-1)
+      # Voxels outside of the image are sorted to the end and not counted.
+      # Only voxels near the image boundary have such values in their neighborhood.
+      numberOfValues = np.full(blockShape, len(offsets))
+      nearBoundary = (neighborhoodValues[..., -1] == outsideCost)
+      numberOfValues[nearBoundary] = (neighborhoodValues[nearBoundary] != outsideCost).sum(axis=-1)
+      valueIndex = np.maximum(np.ceil(neighborhoodFraction * numberOfValues).astype(int), 1) - 1
+      neighborhoodTolerance[tuple([slice(blockStart[axis], blockEnd[axis]) for axis in range(3)])] = np.take_along_axis(
+        neighborhoodValues, valueIndex[..., np.newaxis], axis=-1)[..., 0]
+    return neighborhoodTolerance
+
+  @staticmethod
+  def getStencilVoxels(stencil, shape):
+    """Get numpy array (in KJI order) that contains 1 inside the stencil and 0 outside"""
+    from vtk.util import numpy_support
+    stencilToImage = vtk.vtkImageStencilToImage()
+    stencilToImage.SetInputData(stencil)
+    stencilToImage.SetInsideValue(1)
+    stencilToImage.SetOutsideValue(0)
+    stencilToImage.SetOutputScalarTypeToUnsignedChar()
+    stencilToImage.Update()
+    return numpy_support.vtk_to_numpy(stencilToImage.GetOutput().GetPointData().GetScalars()).reshape(shape)
+
+  @staticmethod
+  def floodFillUsingSummedVolumeTable(sourceImageData, ijk, lowerThreshold, upperThreshold,
+      editMaskStencil, neighborhoodRadius, neighborhoodFraction):
+    """Get image data that contains 1 in voxels that are filled from the seed and 0 elsewhere.
+    Voxels are filled if they are in the intensity range and at least neighborhoodFraction of the voxels
+    of the box-shaped neighborhood (within the image) are in the intensity range.
+    Number of voxels in range in the neighborhood is computed from a summed volume table.
+    """
+    import math
+    import numpy as np
+    import SimpleITK as sitk
+    from vtk.util import numpy_support
+    extent = sourceImageData.GetExtent()
+    dimensions = sourceImageData.GetDimensions()
+    shape = (dimensions[2], dimensions[1], dimensions[0])
+    sourceVoxels = numpy_support.vtk_to_numpy(sourceImageData.GetPointData().GetScalars())
+    if sourceVoxels.ndim > 1:
+      sourceVoxels = sourceVoxels[:, 0]
+    sourceVoxels = sourceVoxels.reshape(shape)
+    if np.issubdtype(sourceVoxels.dtype, np.integer):
+      # Thresholds are truncated to the scalar type, the same way as in vtkImageThresholdConnectivity
+      lowerThreshold = int(lowerThreshold)
+      upperThreshold = int(upperThreshold)
+    inRangeVoxels = (sourceVoxels >= lowerThreshold) & (sourceVoxels <= upperThreshold)
+    filledVoxels = inRangeVoxels
+
+    radius = int(math.floor(neighborhoodRadius))
+    if radius > 0:
+      sumType = np.int32 if inRangeVoxels.size < 2**31 else np.int64
+      summedVolumeTable = np.zeros((shape[0]+1, shape[1]+1, shape[2]+1), sumType)
+      np.cumsum(inRangeVoxels, axis=0, dtype=sumType, out=summedVolumeTable[1:, 1:, 1:])
+      np.cumsum(summedVolumeTable[1:, 1:, 1:], axis=1, out=summedVolumeTable[1:, 1:, 1:])
+      np.cumsum(summedVolumeTable[1:, 1:, 1:], axis=2, out=summedVolumeTable[1:, 1:, 1:])
+      # Neighborhood bounds along each axis, limited to the image
+      lowerBounds = []
+      upperBounds = []
+      for axis in range(3):
+        indices = np.arange(shape[axis])
+        lowerBounds.append(np.maximum(indices - radius, 0))
+        upperBounds.append(np.minimum(indices + radius + 1, shape[axis]))
+      numberOfInRangeVoxels = np.zeros(shape, sumType)
+      for cornerK, cornerJ, cornerI in [(k, j, i) for k in range(2) for j in range(2) for i in range(2)]:
+        sign = -1 if (cornerK + cornerJ + cornerI) % 2 else 1
+        boundK = upperBounds[0] if cornerK == 0 else lowerBounds[0]
+        boundJ = upperBounds[1] if cornerJ == 0 else lowerBounds[1]
+        boundI = upperBounds[2] if cornerI == 0 else lowerBounds[2]
+        numberOfInRangeVoxels += sign * summedVolumeTable[np.ix_(boundK, boundJ, boundI)]
+      neighborhoodSizes = [upperBounds[axis] - lowerBounds[axis] for axis in range(3)]
+      numberOfVoxels = np.multiply.outer(np.multiply.outer(neighborhoodSizes[0], neighborhoodSizes[1]), neighborhoodSizes[2])
+      filledVoxels = filledVoxels & (numberOfInRangeVoxels >= neighborhoodFraction * numberOfVoxels)
+
+    if editMaskStencil is not None:
+      filledVoxels = filledVoxels & (SegmentEditorEffect.getStencilVoxels(editMaskStencil, shape) != 0)
+
+    filledImageData = vtk.vtkImageData()
+    filledImageData.CopyStructure(sourceImageData)
+    filledImageData.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+    outputVoxels = numpy_support.vtk_to_numpy(filledImageData.GetPointData().GetScalars()).reshape(shape)
+    seedIndex = [int(round(ijk[axis])) - extent[2*axis] for axis in range(3)]
+    if not filledVoxels[seedIndex[2], seedIndex[1], seedIndex[0]]:
+      outputVoxels[:] = 0
+      return filledImageData
+    # Keep the face-connected region of the seed
+    connectedImage = sitk.ConnectedThreshold(sitk.GetImageFromArray(filledVoxels.astype(np.uint8)),
+      seedList=[seedIndex], lower=1, upper=1)
+    outputVoxels[:] = sitk.GetArrayViewFromImage(connectedImage)
+    return filledImageData
+
+METHOD_FLOODING = "Flooding"
+METHOD_TOLERANCE_MAP = "Tolerance map"
+METHOD_SUMMED_VOLUME_TABLE = "Summed volume table"
+
+# Fraction of the neighborhood that must be within the intensity range
+NEIGHBORHOOD_FRACTION = 0.5
+
+# Maximum number of values that are stored at once when computing neighborhood tolerance
+NEIGHBORHOOD_TOLERANCE_MAX_ELEMENTS = 16 * 1024 * 1024
+
+# Tolerance map sorts all neighborhood values of each voxel (123 values at this size),
+# with larger neighborhoods flooding is used instead
+TOLERANCE_MAP_MAXIMUM_NEIGHBORHOOD_SIZE_MM = 3.0
+
+# Live preview is updated when settings have not been changed for this time
+PREVIEW_UPDATE_DELAY_MS = 100
+PREVIEW_SEGMENT_ID = "FloodFillingPreview"
+PREVIEW_SEGMENT_COLOR = (1.0, 1.0, 0.0)
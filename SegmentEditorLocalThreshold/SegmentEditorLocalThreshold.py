@@ -42,3 +42,147 @@ class SegmentEditorLocalThresholdTest(ScriptedLoadableModuleTest):
     """Run as few or as many tests as needed here.
     """
     self.setUp()
+    self.test_SegmentEditorLocalThresholdBoxMorphology()
+    self.setUp()
+    self.test_SegmentEditorLocalThresholdSnapPoints()
+
+  def test_SegmentEditorLocalThresholdBoxMorphology(self):
+    """
+    Check separable box morphology:
+    - runningMaximumMinimum against a brute-force sliding window
+    - dilateErodeBox against a brute-force box filter
+    - dilateErodeBox against vtkImageDilateErode3D (kernel morphology engine), which gives the same result
+      for kernels that are one voxel thick along at least one axis and 3 voxels along the others. For larger kernels
+      vtkImageDilateErode3D uses an ellipsoid, which is inside the box, therefore box dilation contains the
+      kernel dilation and box erosion is contained in the kernel erosion.
+    """
+    self.delayDisplay("Starting test_SegmentEditorLocalThresholdBoxMorphology")
+
+    import numpy as np
+    import vtk
+    from vtk.util import numpy_support
+    import SegmentEditorLocalThresholdLib
+
+    randomGenerator = np.random.RandomState(0)
+
+    # Running maximum and minimum along each axis
+    voxels = randomGenerator.randint(0, 1000, (9, 11, 13)).astype(np.uint16)
+    for axis in range(3):
+      for windowSize in [1, 2, 3, 4, 7, 30]:
+        for maximum in [True, False]:
+          result = SegmentEditorLocalThresholdLib.SegmentEditorEffect.runningMaximumMinimum(voxels, axis, windowSize, maximum)
+          lowerOffset = (windowSize - 1) // 2
+          expected = np.empty_like(voxels)
+          for index in range(voxels.shape[axis]):
+            window = np.take(voxels, range(max(index - lowerOffset, 0), min(index - lowerOffset + windowSize, voxels.shape[axis])), axis=axis)
+            expectedSlices = [slice(None)] * 3
+            expectedSlices[axis] = index
+            expected[tuple(expectedSlices)] = window.max(axis=axis) if maximum else window.min(axis=axis)
+          self.assertTrue(np.array_equal(result, expected),
+            f"Running {'maximum' if maximum else 'minimum'} differs from reference (axis={axis}, window={windowSize})")
+
+    # Box dilation and erosion
+    shape = (9, 11, 13)
+    for density in [0.05, 0.6, 0.95]:
+      labelVoxels = (randomGenerator.rand(*shape) < density).astype(np.uint8)
+      labelmap = vtk.vtkImageData()
+      labelmap.SetExtent(2, 2+shape[2]-1, 0, shape[1]-1, -1, -1+shape[0]-1)
+      labelmap.GetPointData().SetScalars(numpy_support.numpy_to_vtk(labelVoxels.ravel(), deep=True))
+      for kernelSize in [(1, 1, 1), (7, 1, 1), (1, 9, 1), (1, 1, 5), (3, 3, 1), (3, 1, 3), (3, 3, 3), (5, 7, 3)]:
+        for dilate in [True, False]:
+          boxLabelmap = SegmentEditorLocalThresholdLib.SegmentEditorEffect.dilateErodeBox(labelmap, kernelSize, dilate)
+          boxVoxels = numpy_support.vtk_to_numpy(boxLabelmap.GetPointData().GetScalars()).reshape(shape)
+
+          expectedVoxels = np.empty_like(labelVoxels)
+          radius = [(size - 1) // 2 for size in kernelSize]
+          for k, j, i in np.ndindex(*shape):
+            window = labelVoxels[max(k-radius[2], 0):k+radius[2]+1, max(j-radius[1], 0):j+radius[1]+1, max(i-radius[0], 0):i+radius[0]+1]
+            expectedVoxels[k, j, i] = window.max() if dilate else window.min()
+          self.assertTrue(np.array_equal(boxVoxels, expectedVoxels),
+            f"Box {'dilation' if dilate else 'erosion'} differs from reference (kernel={kernelSize}, density={density})")
+
+          kernelFilter = vtk.vtkImageDilateErode3D()
+          kernelFilter.SetInputData(labelmap)
+          kernelFilter.SetDilateValue(1 if dilate else 0)
+          kernelFilter.SetErodeValue(0 if dilate else 1)
+          kernelFilter.SetKernelSize(*kernelSize)
+          kernelFilter.Update()
+          kernelVoxels = numpy_support.vtk_to_numpy(kernelFilter.GetOutput().GetPointData().GetScalars()).reshape(shape)
+          if sorted(kernelSize)[:2] == [1, 1] or sorted(kernelSize) == [1, 3, 3]:
+            self.assertTrue(np.array_equal(boxVoxels, kernelVoxels),
+              f"Box {'dilation' if dilate else 'erosion'} differs from kernel morphology (kernel={kernelSize}, density={density})")
+          elif dilate:
+            self.assertTrue(np.all(boxVoxels >= kernelVoxels))
+          else:
+            self.assertTrue(np.all(boxVoxels <= kernelVoxels))
+
+    self.delayDisplay('test_SegmentEditorLocalThresholdBoxMorphology passed')
+
+  def test_SegmentEditorLocalThresholdSnapPoints(self):
+    """
+    Compare snapIJKPointsToLabel to the reference implementation that checks voxels of the kernel window one by one.
+    Points are near and outside the labelmap extent, labelmaps are sparse so that some points have no label in their window.
+    """
+    self.delayDisplay("Starting test_SegmentEditorLocalThresholdSnapPoints")
+
+    import types
+    import numpy as np
+    import vtk
+    from vtk.util import numpy_support
+    import SegmentEditorLocalThresholdLib
+
+    randomGenerator = np.random.RandomState(0)
+    shape = (12, 15, 17)
+    for density in [0.005, 0.05, 0.5]:
+      labelmap = vtk.vtkImageData()
+      labelmap.SetExtent(-3, -3+shape[2]-1, 4, 4+shape[1]-1, 0, shape[0]-1)
+      labelVoxels = (randomGenerator.rand(*shape) < density).astype(np.uint8)
+      labelmap.GetPointData().SetScalars(numpy_support.numpy_to_vtk(labelVoxels.ravel(), deep=True))
+      extent = labelmap.GetExtent()
+      ijkPoints = vtk.vtkPoints()
+      for pointIndex in range(200):
+        ijkPoints.InsertNextPoint([randomGenerator.uniform(extent[2*axis] - 3, extent[2*axis+1] + 3) for axis in range(3)])
+      ijkPoints.InsertNextPoint(extent[0], extent[2], extent[4])
+      for kernelSize in [[1, 1, 1], [3, 3, 3], [5, 3, 1], [7, 9, 5]]:
+        # Kernel size is normally computed from the minimum diameter and the segment spacing
+        effect = types.SimpleNamespace(getKernelSizePixel=lambda: kernelSize)
+        snappedPoints = SegmentEditorLocalThresholdLib.SegmentEditorEffect.snapIJKPointsToLabel(effect, ijkPoints, labelmap)
+        expectedPoints = self.snapIJKPointsToLabelUsingLoop(ijkPoints, labelmap, kernelSize)
+        self.assertEqual(snappedPoints.GetNumberOfPoints(), len(expectedPoints))
+        for pointIndex, expectedPoint in enumerate(expectedPoints):
+          self.assertEqual(list(snappedPoints.GetPoint(pointIndex)), expectedPoint,
+            f"Snapped point differs from reference (kernel={kernelSize}, density={density})")
+
+    self.delayDisplay('test_SegmentEditorLocalThresholdSnapPoints passed')
+
+  def snapIJKPointsToLabelUsingLoop(self, ijkPoints, labelmap, kernelSize):
+    """Reference implementation of snapIJKPointsToLabel, returns the snapped points as a list"""
+    import math
+    import vtk
+    snappedPoints = []
+    kernelOffset = [int(math.ceil(kernelSize[axis]-1)/2) for axis in range(3)]
+    labelmapExtent = labelmap.GetExtent()
+    for pointIndex in range(ijkPoints.GetNumberOfPoints()):
+      point = ijkPoints.GetPoint(pointIndex)
+      closestDistance = vtk.VTK_INT_MAX
+      closestPoint = None
+      for kOffset in range(-kernelOffset[2], kernelOffset[2]+1):
+        k = int(point[2] + kOffset)
+        for jOffset in range(-kernelOffset[1], kernelOffset[1]+1):
+          j = int(point[1] + jOffset)
+          for iOffset in range(-kernelOffset[0], kernelOffset[0]+1):
+            i = int(point[0] + iOffset)
+            if (labelmapExtent[0] > i or labelmapExtent[1] < i or
+                labelmapExtent[2] > j or labelmapExtent[3] < j or
+                labelmapExtent[4] > k or labelmapExtent[5] < k):
+              continue # Voxel not in image
+            if labelmap.GetScalarComponentAsFloat(i, j, k, 0) <= 0:
+              continue # Label is empty
+            distance = vtk.vtkMath.Distance2BetweenPoints(point, [i, j, k])
+            if distance >= closestDistance:
+              continue
+            closestPoint = [float(i), float(j), float(k)]
+            closestDistance = distance
+      if closestPoint is not None:
+        snappedPoints.append(closestPoint)
+    return snappedPoints
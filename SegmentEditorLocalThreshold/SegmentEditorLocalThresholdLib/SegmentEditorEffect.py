@@ -18,6 +18,27 @@ class SegmentEditorEffect(SegmentEditorThresholdEffect):
     scriptedEffect.name = 'Local Threshold'
     scriptedEffect.title = _("Local threshold")
     self.previewSteps = 4
+    # Thresholded and eroded island labelmap is reused between clicks while its inputs are unchanged
+    self.islandLabelmapKey = None
+    self.thresholdLabelmapKey = None
+    self.clippedSourceImageData = None
+    self.islandIdVoxels = None
+    self.sceneEndCloseObserver = None
+    # Distance of each voxel from the nearest voxel outside the threshold range (for distance map morphology)
+    self.thresholdDistanceVoxels = None
+    # Island outline shown while moving the mouse with Ctrl key pressed (sliceWidget -> IslandHoverPipeline)
+    self.hoverPipelines = {}
+    self.hoverViewWidget = None
+    self.hoverPosition = None
+    # Limit the update rate of the island outline while the mouse is moving
+    self.hoverTimer = qt.QTimer()
+    self.hoverTimer.setSingleShot(True)
+    self.hoverTimer.setInterval(HOVER_PREVIEW_UPDATE_INTERVAL_MS)
+    self.hoverTimer.connect('timeout()', self.updateHoverPreview)
+    # Seed points collected in batch mode, processed together when seeds are applied
+    self.batchSeedIJKPoints = vtk.vtkPoints()
+    self.batchSeedRASPoints = vtk.vtkPoints()
+    self.batchSeedPipelines = {}
 
   def clone(self):
     import qSlicerSegmentationsEditorEffectsPythonQt as effects
@@ -36,14 +57,23 @@ class SegmentEditorEffect(SegmentEditorThresholdEffect):
 Fill segment in a selected region based on source volume intensity range<br>.
 <p>
   <b>Ctrl + left-click:</b> Add the selected island within the threshold to the segment.
+  <b>Ctrl + mouse move:</b> Outline the island that would be selected (if hover preview is enabled). The outline is computed in the displayed slice only, therefore it may differ slightly from the result.
+  If <b>Batch seeds</b> is enabled then Ctrl + left-click only adds a seed point and all the seeds are added to the segment at once by clicking <b>Apply seeds</b>.
+  In 3D views the seed point is placed on the surface that is displayed at the clicked position. Seed markers are shown in slice views near the seed points.
 </p>
 <p>
   Options:
   <ul style="feature: 0">
     <li><b>Minimum diameter:</b> Prevent leaks through features that are smaller than the specified size.</li>
+    <li><b>Morphology:</b> Method used for enforcing minimum diameter. <i>Kernel</i> erodes and dilates using an ellipsoidal kernel.
+      <i>Distance map</i> gets similar results by thresholding a distance map, which is much faster for large diameters
+      and is not recomputed when only the minimum diameter is changed.
+      <i>Separable box</i> uses a box-shaped kernel, with computation time that does not depend on the minimum diameter.</li>
     <li><b>Feature size:</b> Spatial smoothness constraint used for WaterShed. Larger values result in smoother extracted surface.</li>
     <li><b>Segmentation algorithm:</b> Algorithm used to perform the selection on the specified region.</li>
     <li><b>ROI:</b> Region of interest that the threshold segmentation will be perfomed within. Selecting a smaller region will reduce leaks and improve speed.</li>
+    <li><b>Automatic region:</b> If no ROI is selected, process only a region around the clicked point. The region is enlarged automatically if the selected island does not fit in it.</li>
+    <li><b>Batch seeds:</b> Collect seed points with Ctrl + left-click and add all the selected islands in one step, which can be undone at once.</li>
   </ul>
 </p>
 </html>"""
@@ -95,6 +125,31 @@ Fill segment in a selected region based on source volume intensity range<br>.
       pipeline.lookupTable.SetTableValue(1,  r, g, b,  opacity)
       sliceWidget.sliceView().scheduleRender()
 
+  def activate(self):
+    SegmentEditorThresholdEffect.activate(self)
+    # Cached images must not be kept after the scene is closed
+    self.sceneEndCloseObserver = slicer.mrmlScene.AddObserver(slicer.mrmlScene.EndCloseEvent, self.onSceneEndClose)
+
+  def deactivate(self):
+    SegmentEditorThresholdEffect.deactivate(self)
+    self.clearHoverPreview()
+    self.clearBatchSeeds()
+    if self.sceneEndCloseObserver is not None:
+      slicer.mrmlScene.RemoveObserver(self.sceneEndCloseObserver)
+      self.sceneEndCloseObserver = None
+    self.clearCachedImages()
+
+  def onSceneEndClose(self, caller=None, event=None):
+    self.clearCachedImages()
+
+  def clearCachedImages(self):
+    # Clipped source image may share voxels with the source volume, release it so that the source voxels can be freed
+    self.islandLabelmapKey = None
+    self.thresholdLabelmapKey = None
+    self.clippedSourceImageData = None
+    self.thresholdDistanceVoxels = None
+    self.islandIdVoxels = None
+
   def setupOptionsFrame(self):
     SegmentEditorThresholdEffect.setupOptionsFrame(self)
 
@@ -118,6 +173,18 @@ Fill segment in a selected region based on source volume intensity range<br>.
     self.minimumDiameterMmLabel = self.scriptedEffect.addLabeledOptionsWidget("Minimum diameter:", minimumDiameterFrame)
     self.scriptedEffect.addOptionsWidget(minimumDiameterFrame)
 
+    self.morphologyEngineSelector = qt.QComboBox()
+    self.morphologyEngineSelector.addItem(MORPHOLOGY_ENGINE_KERNEL)
+    self.morphologyEngineSelector.addItem(MORPHOLOGY_ENGINE_DISTANCE_MAP)
+    self.morphologyEngineSelector.addItem(MORPHOLOGY_ENGINE_SEPARABLE_BOX)
+    self.morphologyEngineSelector.setToolTip("Method used for enforcing minimum diameter.\n"
+      "Kernel: erode and dilate using an ellipsoidal kernel.\n"
+      "Distance map: erode and dilate using a spherical kernel, by thresholding a distance map."
+      " Computation time does not depend on the minimum diameter and the distance map is reused when only the minimum diameter is changed.\n"
+      "Separable box: erode and dilate using a box-shaped kernel, decomposed into running minimum/maximum along each axis."
+      " Computation time does not depend on the minimum diameter.")
+    self.scriptedEffect.addLabeledOptionsWidget("Morphology: ", self.morphologyEngineSelector)
+
     # Add algorithm options
     self.segmentationAlgorithmSelector = qt.QComboBox()
     self.segmentationAlgorithmSelector.addItem(SEGMENTATION_ALGORITHM_MASKING)
@@ -142,16 +209,52 @@ Fill segment in a selected region based on source volume intensity range<br>.
     self.scriptedEffect.addLabeledOptionsWidget("ROI: ", self.roiSelector)
     self.roiSelector.connect("currentNodeChanged(vtkMRMLNode*)", self.updateMRMLFromGUI)
 
+    self.automaticRegionCheckBox = qt.QCheckBox()
+    self.automaticRegionCheckBox.setToolTip("If checked and no ROI is selected then the segmentation is computed in a region around the clicked point."
+      " The region is enlarged until the selected island fits in it. This is much faster than processing the entire volume if the island is small.")
+    self.scriptedEffect.addLabeledOptionsWidget("Automatic region: ", self.automaticRegionCheckBox)
+    self.automaticRegionCheckBox.connect("toggled(bool)", self.updateMRMLFromGUI)
+
+    self.hoverPreviewCheckBox = qt.QCheckBox()
+    self.hoverPreviewCheckBox.setToolTip("If checked then the island that would be selected is outlined when the mouse is moved while the Ctrl key is pressed."
+      " The island is computed in the displayed slice only.")
+    self.scriptedEffect.addLabeledOptionsWidget("Hover preview: ", self.hoverPreviewCheckBox)
+    self.hoverPreviewCheckBox.connect("toggled(bool)", self.updateMRMLFromGUI)
+
+    self.batchSeedsCheckBox = qt.QCheckBox()
+    self.batchSeedsCheckBox.setToolTip("If checked then Ctrl + left-click only adds a seed point."
+      " Islands of all the seed points are added to the segment when 'Apply seeds' is clicked, as a single undoable step."
+      " In 3D views the seed point is placed on the surface that is displayed at the clicked position.")
+    self.applyBatchSeedsButton = qt.QPushButton("Apply seeds")
+    self.applyBatchSeedsButton.objectName = self.__class__.__name__ + 'ApplySeeds'
+    self.applyBatchSeedsButton.setToolTip("Add islands of all the seed points to the selected segment.")
+    self.clearBatchSeedsButton = qt.QPushButton("Clear seeds")
+    self.clearBatchSeedsButton.objectName = self.__class__.__name__ + 'ClearSeeds'
+    self.clearBatchSeedsButton.setToolTip("Remove all seed points.")
+    batchSeedsFrame = qt.QHBoxLayout()
+    batchSeedsFrame.addWidget(self.batchSeedsCheckBox)
+    batchSeedsFrame.addWidget(self.applyBatchSeedsButton)
+    batchSeedsFrame.addWidget(self.clearBatchSeedsButton)
+    self.scriptedEffect.addLabeledOptionsWidget("Batch seeds: ", batchSeedsFrame)
+    self.batchSeedsCheckBox.connect("toggled(bool)", self.updateMRMLFromGUI)
+    self.applyBatchSeedsButton.connect("clicked()", self.onApplyBatchSeeds)
+    self.clearBatchSeedsButton.connect("clicked()", self.clearBatchSeeds)
+
     # Connections
     self.minimumDiameterSpinBox.connect("valueChanged(double)", self.updateMRMLFromGUI)
     self.featureSizeSpinBox.connect("valueChanged(double)", self.updateMRMLFromGUI)
     self.segmentationAlgorithmSelector.connect("currentIndexChanged(int)", self.updateMRMLFromGUI)
+    self.morphologyEngineSelector.connect("currentIndexChanged(int)", self.updateMRMLFromGUI)
 
   def setMRMLDefaults(self):
     self.scriptedEffect.setParameterDefault(MINIMUM_DIAMETER_MM_PARAMETER_NAME, 3)
     self.scriptedEffect.setParameterDefault(FEATURE_SIZE_MM_PARAMETER_NAME, 3)
     self.scriptedEffect.setParameterDefault(SEGMENTATION_ALGORITHM_PARAMETER_NAME, SEGMENTATION_ALGORITHM_GROWCUT)
     self.scriptedEffect.setParameterDefault(HISTOGRAM_BRUSH_TYPE_PARAMETER_NAME, HISTOGRAM_BRUSH_TYPE_DRAW)
+    self.scriptedEffect.setParameterDefault(AUTOMATIC_REGION_PARAMETER_NAME, 0)
+    self.scriptedEffect.setParameterDefault(HOVER_PREVIEW_PARAMETER_NAME, 0)
+    self.scriptedEffect.setParameterDefault(BATCH_SEEDS_PARAMETER_NAME, 0)
+    self.scriptedEffect.setParameterDefault(MORPHOLOGY_ENGINE_PARAMETER_NAME, MORPHOLOGY_ENGINE_KERNEL)
     SegmentEditorThresholdEffect.setMRMLDefaults(self)
 
   def updateGUIFromMRML(self):
@@ -176,6 +279,11 @@ Fill segment in a selected region based on source volume intensity range<br>.
     self.segmentationAlgorithmSelector.setCurrentText(segmentationAlgorithm)
     self.segmentationAlgorithmSelector.blockSignals(wasBlocked)
 
+    morphologyEngine = self.scriptedEffect.parameter(MORPHOLOGY_ENGINE_PARAMETER_NAME)
+    wasBlocked = self.morphologyEngineSelector.blockSignals(True)
+    self.morphologyEngineSelector.setCurrentText(morphologyEngine)
+    self.morphologyEngineSelector.blockSignals(wasBlocked)
+
     kernelSizePixel = self.getKernelSizePixel()
 
     if kernelSizePixel[0]<=0 and kernelSizePixel[1]<=0 and kernelSizePixel[2]<=0:
@@ -189,6 +297,22 @@ Fill segment in a selected region based on source volume intensity range<br>.
     self.roiSelector.setCurrentNode(self.scriptedEffect.parameterSetNode().GetNodeReference(self.ROI_NODE_REFERENCE_ROLE))
     self.roiSelector.blockSignals(wasBlocked)
 
+    wasBlocked = self.automaticRegionCheckBox.blockSignals(True)
+    self.automaticRegionCheckBox.checked = (self.scriptedEffect.integerParameter(AUTOMATIC_REGION_PARAMETER_NAME) != 0)
+    self.automaticRegionCheckBox.blockSignals(wasBlocked)
+    # Automatic region is only used if no ROI is selected
+    self.automaticRegionCheckBox.enabled = (self.roiSelector.currentNode() is None)
+
+    wasBlocked = self.hoverPreviewCheckBox.blockSignals(True)
+    self.hoverPreviewCheckBox.checked = (self.scriptedEffect.integerParameter(HOVER_PREVIEW_PARAMETER_NAME) != 0)
+    self.hoverPreviewCheckBox.blockSignals(wasBlocked)
+
+    batchSeeds = (self.scriptedEffect.integerParameter(BATCH_SEEDS_PARAMETER_NAME) != 0)
+    wasBlocked = self.batchSeedsCheckBox.blockSignals(True)
+    self.batchSeedsCheckBox.checked = batchSeeds
+    self.batchSeedsCheckBox.blockSignals(wasBlocked)
+    self.updateBatchSeedsButtons()
+
   def updateMRMLFromGUI(self):
     SegmentEditorThresholdEffect.updateMRMLFromGUI(self)
 
@@ -201,54 +325,206 @@ Fill segment in a selected region based on source volume intensity range<br>.
     segmentationAlgorithm = self.segmentationAlgorithmSelector.currentText
     self.scriptedEffect.setParameter(SEGMENTATION_ALGORITHM_PARAMETER_NAME, segmentationAlgorithm)
 
+    morphologyEngine = self.morphologyEngineSelector.currentText
+    self.scriptedEffect.setParameter(MORPHOLOGY_ENGINE_PARAMETER_NAME, morphologyEngine)
+
     self.scriptedEffect.parameterSetNode().SetNodeReferenceID(self.ROI_NODE_REFERENCE_ROLE, self.roiSelector.currentNodeID)
 
+    self.scriptedEffect.setParameter(AUTOMATIC_REGION_PARAMETER_NAME, 1 if self.automaticRegionCheckBox.checked else 0)
+    self.scriptedEffect.setParameter(HOVER_PREVIEW_PARAMETER_NAME, 1 if self.hoverPreviewCheckBox.checked else 0)
+    self.scriptedEffect.setParameter(BATCH_SEEDS_PARAMETER_NAME, 1 if self.batchSeedsCheckBox.checked else 0)
+
   def processInteractionEvents(self, callerInteractor, eventId, viewWidget):
     abortEvent = False
 
     if not callerInteractor.GetControlKey():
+      self.clearHoverPreview()
       return SegmentEditorThresholdEffect.processInteractionEvents(self, callerInteractor, eventId, viewWidget)
 
-    if eventId == vtk.vtkCommand.LeftButtonPressEvent:
+    if eventId == vtk.vtkCommand.MouseMoveEvent:
+      if (self.scriptedEffect.integerParameter(HOVER_PREVIEW_PARAMETER_NAME) != 0
+          and viewWidget.className() == "qMRMLSliceWidget"):
+        # Island outline is only updated when the timer expires, to not slow down mouse movement
+        self.hoverViewWidget = viewWidget
+        self.hoverPosition = callerInteractor.GetEventPosition()
+        if not self.hoverTimer.isActive():
+          self.hoverTimer.start()
+
+    elif eventId == vtk.vtkCommand.LeftButtonPressEvent:
       abortEvent = True
 
       sourceImageData = self.scriptedEffect.sourceVolumeImageData()
 
       xy = callerInteractor.GetEventPosition()
-      ijk = self.xyToIjk(xy, viewWidget, sourceImageData)
 
-      ijkPoints = vtk.vtkPoints()
-      ijkPoints.InsertNextPoint(ijk[0], ijk[1], ijk[2])
-      self.apply(ijkPoints)
+      if self.scriptedEffect.integerParameter(BATCH_SEEDS_PARAMETER_NAME) != 0:
+        if viewWidget.className() == "qMRMLSliceWidget":
+          self.addBatchSeed(self.xyToIjk(xy, viewWidget, sourceImageData), self.xyToRas(xy, viewWidget))
+        else:
+          # Place the seed on the surface (segment, model, volume rendering) displayed at the clicked position
+          ras = SegmentEditorEffect.pickRas(xy, self.scriptedEffect.renderer(viewWidget))
+          ijk = SegmentEditorEffect.rasToIjk(ras, sourceImageData) if (ras is not None and sourceImageData is not None) else None
+          if ijk is None:
+            slicer.util.showStatusMessage("Local threshold: seed point is not added,"
+              " no surface is displayed inside the source volume at the clicked position", 3000)
+          else:
+            self.addBatchSeed(ijk, ras)
+      else:
+        ijk = self.xyToIjk(xy, viewWidget, sourceImageData)
+        ijkPoints = vtk.vtkPoints()
+        ijkPoints.InsertNextPoint(ijk[0], ijk[1], ijk[2])
+        self.apply(ijkPoints)
 
     return abortEvent
 
-  def runMasking(self, ijkPoints, seedLabelmap, outputLabelmap):
+  def updateHoverPreview(self):
+    """Outline the island under the mouse position in the displayed slice"""
+    sliceWidget = self.hoverViewWidget
+    previewPipeline = self.previewPipelines.get(sliceWidget) if sliceWidget is not None else None
+    if previewPipeline is None:
+      return
+
+    hoverPipeline = self.hoverPipelines.get(sliceWidget)
+    if hoverPipeline is None:
+      hoverPipeline = IslandHoverPipeline()
+      self.scriptedEffect.renderer(sliceWidget).AddActor2D(hoverPipeline.actor)
+      self.hoverPipelines[sliceWidget] = hoverPipeline
+
+    # Minimum diameter in slice view pixels. When zoomed in, the slice is downsampled so that the kernel size
+    # (and so the computation time) remains bounded.
+    xyToRas = sliceWidget.sliceLogic().GetSliceNode().GetXYToRAS()
+    pixelSizeMm = math.sqrt(sum([xyToRas.GetElement(row, 0)**2 for row in range(3)]))
+    minimumDiameterMm = abs(self.scriptedEffect.doubleParameter(MINIMUM_DIAMETER_MM_PARAMETER_NAME))
+    shrinkFactor = max(1, int(math.ceil(minimumDiameterMm / pixelSizeMm / HOVER_PREVIEW_MAXIMUM_KERNEL_SIZE_PIXEL)))
+    kernelSizePixel = int(round((minimumDiameterMm / (pixelSizeMm * shrinkFactor) + 1) / 2)) * 2 - 1
+
+    # Thresholded slice is already computed by the threshold preview
+    previewPipeline.thresholdFilter.Update()
+    hoverPipeline.shrink.SetInputConnection(previewPipeline.thresholdFilter.GetOutputPort())
+    hoverPipeline.shrink.SetShrinkFactors(shrinkFactor, shrinkFactor, 1)
+    hoverPipeline.erode.SetKernelSize(max(kernelSizePixel, 1), max(kernelSizePixel, 1), 1)
+    seedPoints = vtk.vtkPoints()
+    seedPoints.InsertNextPoint(self.hoverPosition[0], self.hoverPosition[1], 0)
+    hoverPipeline.connectivity.SetSeedPoints(seedPoints)
+    hoverPipeline.contour.Update()
+    hoverPipeline.actor.SetVisibility(hoverPipeline.contour.GetOutput().GetNumberOfPoints() > 0)
+    sliceWidget.sliceView().scheduleRender()
+
+  def clearHoverPreview(self):
+    self.hoverTimer.stop()
+    self.hoverViewWidget = None
+    for sliceWidget, hoverPipeline in self.hoverPipelines.items():
+      self.scriptedEffect.renderer(sliceWidget).RemoveActor2D(hoverPipeline.actor)
+      sliceWidget.sliceView().scheduleRender()
+    self.hoverPipelines = {}
+
+  def addBatchSeed(self, ijk, ras):
+    self.batchSeedIJKPoints.InsertNextPoint(ijk[0], ijk[1], ijk[2])
+    self.batchSeedRASPoints.InsertNextPoint(ras[0], ras[1], ras[2])
+    self.batchSeedRASPoints.Modified()
+    self.updateBatchSeedMarkers()
+    self.updateBatchSeedsButtons()
+
+  def clearBatchSeeds(self):
+    self.batchSeedIJKPoints.Reset()
+    self.batchSeedRASPoints.Reset()
+    self.batchSeedRASPoints.Modified()
+    self.updateBatchSeedMarkers()
+    self.updateBatchSeedsButtons()
+
+  def onApplyBatchSeeds(self):
+    if self.batchSeedIJKPoints.GetNumberOfPoints() == 0:
+      return
+    # All seeds are processed in one pipeline run, which results in a single undo state
+    ijkPoints = vtk.vtkPoints()
+    ijkPoints.DeepCopy(self.batchSeedIJKPoints)
+    self.apply(ijkPoints)
+    self.clearBatchSeeds()
+
+  def updateBatchSeedsButtons(self):
+    if not hasattr(self, "batchSeedsCheckBox"):
+      # options frame is not set up yet
+      return
+    batchSeeds = self.batchSeedsCheckBox.checked
+    numberOfSeeds = self.batchSeedIJKPoints.GetNumberOfPoints()
+    self.applyBatchSeedsButton.text = f"Apply seeds ({numberOfSeeds})" if numberOfSeeds > 0 else "Apply seeds"
+    self.applyBatchSeedsButton.enabled = batchSeeds and numberOfSeeds > 0
+    self.clearBatchSeedsButton.enabled = numberOfSeeds > 0
+
+  def updateBatchSeedMarkers(self):
+    """Show markers of the batch seed points in all slice views"""
+    numberOfSeeds = self.batchSeedRASPoints.GetNumberOfPoints()
+    if numberOfSeeds == 0 and not self.batchSeedPipelines:
+      return
+    layoutManager = slicer.app.layoutManager()
+    for sliceViewName in layoutManager.sliceViewNames():
+      sliceWidget = layoutManager.sliceWidget(sliceViewName)
+      pipeline = self.batchSeedPipelines.get(sliceWidget)
+      if pipeline is None:
+        if numberOfSeeds == 0:
+          continue
+        pipeline = BatchSeedPipeline(self.batchSeedRASPoints, sliceWidget.sliceLogic().GetSliceNode())
+        self.scriptedEffect.renderer(sliceWidget).AddActor2D(pipeline.actor)
+        self.batchSeedPipelines[sliceWidget] = pipeline
+      pipeline.actor.SetVisibility(numberOfSeeds > 0)
+      sliceWidget.sliceView().scheduleRender()
+    if numberOfSeeds == 0:
+      for sliceWidget, pipeline in self.batchSeedPipelines.items():
+        self.scriptedEffect.renderer(sliceWidget).RemoveActor2D(pipeline.actor)
+      self.batchSeedPipelines = {}
+
+  @staticmethod
+  def pickRas(xy, renderer):
+    """Get RAS position of the surface displayed at the specified display position of a 3D view.
+    Returns None if there is no surface at that position.
+    """
+    picker = vtk.vtkCellPicker()
+    picker.SetTolerance(0.005)
+    if not picker.Pick(xy[0], xy[1], 0, renderer):
+      return None
+    return list(picker.GetPickPosition())
+
+  @staticmethod
+  def rasToIjk(ras, sourceImageData):
+    """Get IJK voxel index of a RAS position in the source image data. Returns None if the position is outside of it."""
+    worldToImageMatrix = vtk.vtkMatrix4x4()
+    sourceImageData.GetWorldToImageMatrix(worldToImageMatrix)
+    ijk = [int(round(coordinate)) for coordinate in worldToImageMatrix.MultiplyPoint(list(ras) + [1.0])[:3]]
+    extent = sourceImageData.GetExtent()
+    if any(ijk[axis] < extent[axis*2] or ijk[axis] > extent[axis*2+1] for axis in range(3)):
+      return None
+    return ijk
+
+  def runMasking(self, ijkPoints, otherIslandsLabelmap, outputLabelmap):
+    """Fill the thresholded region from the seed points, but keep away from all other (not selected) islands.
+    :param otherIslandsLabelmap: labelmap containing LABEL_VALUE in all islands except the selected ones
+    """
     kernelSizePixel = self.getKernelSizePixel()
 
-    self.floodFillingFilterIsland = vtk.vtkImageThresholdConnectivity()
-    self.floodFillingFilterIsland.SetInputData(seedLabelmap)
-    self.floodFillingFilterIsland.SetInValue(BACKGROUND_VALUE)
-    self.floodFillingFilterIsland.ReplaceInOn()
-    self.floodFillingFilterIsland.ReplaceOutOff()
-    self.floodFillingFilterIsland.ThresholdBetween(LABEL_VALUE, LABEL_VALUE)
-    self.floodFillingFilterIsland.SetSeedPoints(ijkPoints)
-
-    self.dilate = vtk.vtkImageDilateErode3D()
-    self.dilate.SetInputConnection(self.floodFillingFilterIsland.GetOutputPort())
-    self.dilate.SetDilateValue(LABEL_VALUE)
-    self.dilate.SetErodeValue(BACKGROUND_VALUE)
-    self.dilate.SetKernelSize(
-      2*kernelSizePixel[0]-1,
-      2*kernelSizePixel[1]-1,
-      2*kernelSizePixel[2]-1)
-    self.dilate.Update()
+    if self.scriptedEffect.parameter(MORPHOLOGY_ENGINE_PARAMETER_NAME) == MORPHOLOGY_ENGINE_DISTANCE_MAP:
+      # Dilate by the minimum diameter (twice the erosion radius)
+      minimumDiameterMm = abs(self.scriptedEffect.doubleParameter(MINIMUM_DIAMETER_MM_PARAMETER_NAME))
+      dilatedOtherIslandsLabelmap = SegmentEditorEffect.dilateByDistanceMap(otherIslandsLabelmap, minimumDiameterMm)
+    elif self.scriptedEffect.parameter(MORPHOLOGY_ENGINE_PARAMETER_NAME) == MORPHOLOGY_ENGINE_SEPARABLE_BOX:
+      dilatedOtherIslandsLabelmap = SegmentEditorEffect.dilateErodeBox(otherIslandsLabelmap,
+        [2*kernelSizePixel[0]-1, 2*kernelSizePixel[1]-1, 2*kernelSizePixel[2]-1], dilate=True)
+    else:
+      self.dilate = vtk.vtkImageDilateErode3D()
+      self.dilate.SetInputData(otherIslandsLabelmap)
+      self.dilate.SetDilateValue(LABEL_VALUE)
+      self.dilate.SetErodeValue(BACKGROUND_VALUE)
+      self.dilate.SetKernelSize(
+        2*kernelSizePixel[0]-1,
+        2*kernelSizePixel[1]-1,
+        2*kernelSizePixel[2]-1)
+      self.dilate.Update()
+      dilatedOtherIslandsLabelmap = self.dilate.GetOutput()
 
     self.imageMask = vtk.vtkImageMask()
     self.imageMask.SetInputConnection(self.thresh.GetOutputPort())
     self.imageMask.SetMaskedOutputValue(BACKGROUND_VALUE)
     self.imageMask.NotMaskOn()
-    self.imageMask.SetMaskInputData(self.dilate.GetOutput())
+    self.imageMask.SetMaskInputData(dilatedOtherIslandsLabelmap)
 
     self.floodFillingFilter = vtk.vtkImageThresholdConnectivity()
     self.floodFillingFilter.SetInputConnection(self.imageMask.GetOutputPort())
@@ -344,54 +620,64 @@ Fill segment in a selected region based on source volume intensity range<br>.
     parameterSetNode.SetSourceVolumeIntensityMaskRange(intensityRange)
 
     roiNode = self.scriptedEffect.parameterSetNode().GetNodeReference(self.ROI_NODE_REFERENCE_ROLE)
+    automaticRegion = False
     if roiNode is not None:
-      clippedSourceImageData = SegmentEditorEffect.cropOrientedImage(sourceImageData, roiNode)
+      clipExtent = SegmentEditorEffect.getROIExtent(sourceImageData, roiNode)
+    elif self.scriptedEffect.integerParameter(AUTOMATIC_REGION_PARAMETER_NAME) != 0:
+      # Start with a small region around the points, it is enlarged if the selected island does not fit in it
+      clipExtent = SegmentEditorEffect.getAutomaticRegionExtent(sourceImageData, ijkPoints, AUTOMATIC_REGION_INITIAL_SIZE_MM)
+      automaticRegion = True
     else:
-      clippedSourceImageData = sourceImageData
+      clipExtent = None
+
+    sourceExtent = sourceImageData.GetExtent()
+    while True:
+      islandLabelmap = self.updateIslandLabelmap(sourceImageData, clipExtent, minimumThreshold, maximumThreshold, kernelSizePixel)
+
+      # Points may be outside the region after it is eroded.
+      # Snap the points to LABEL_VALUE voxels,
+      snappedIJKPoints = self.snapIJKPointsToLabel(ijkPoints, islandLabelmap)
+      canGrowRegion = automaticRegion and clipExtent is not None
+      if snappedIJKPoints.GetNumberOfPoints() == 0:
+        if canGrowRegion:
+          # Island under the points may have been removed because only a small part of it is in the region
+          clipExtent = SegmentEditorEffect.growAutomaticRegionExtent(sourceImageData, clipExtent, AUTOMATIC_REGION_GROWTH_FACTOR)
+          continue
+        parameterSetNode.SetSourceVolumeIntensityMask(oldSourceVolumeIntensityMask)
+        parameterSetNode.SetSourceVolumeIntensityMaskRange(oldIntensityMaskRange)
+        qt.QApplication.restoreOverrideCursor()
+        return
+
+      # Islands under the points are looked up in the island index (no flood filling is needed)
+      selectedIslandIds = self.getIslandIdsAtPoints(snappedIJKPoints)
+
+      if canGrowRegion and SegmentEditorEffect.isAnyIslandOnRegionBoundary(
+          [self.islandBoundingExtents[islandId] for islandId in selectedIslandIds], clipExtent, sourceExtent):
+        # Island may continue outside the region, try again in a larger region
+        clipExtent = SegmentEditorEffect.growAutomaticRegionExtent(sourceImageData, clipExtent, AUTOMATIC_REGION_GROWTH_FACTOR)
+        continue
 
-    # Pipeline
-    self.thresh = vtk.vtkImageThreshold()
-    self.thresh.SetInValue(LABEL_VALUE)
-    self.thresh.SetOutValue(BACKGROUND_VALUE)
-    self.thresh.SetInputData(clippedSourceImageData)
-    self.thresh.ThresholdBetween(minimumThreshold, maximumThreshold)
-    self.thresh.SetOutputScalarTypeToUnsignedChar()
-    self.thresh.Update()
+      self.segmentSelectedIslands(sourceImageData, snappedIJKPoints, selectedIslandIds, kernelSizePixel, modifierLabelmap)
 
-    self.erode = vtk.vtkImageDilateErode3D()
-    self.erode.SetInputConnection(self.thresh.GetOutputPort())
-    self.erode.SetDilateValue(BACKGROUND_VALUE)
-    self.erode.SetErodeValue(LABEL_VALUE)
-    self.erode.SetKernelSize(
-      kernelSizePixel[0],
-      kernelSizePixel[1],
-      kernelSizePixel[2])
+      if canGrowRegion and SegmentEditorEffect.isLabelOnRegionBoundary(modifierLabelmap, clipExtent, sourceExtent):
+        # Segmentation result (which may be larger than the eroded islands) may continue outside the region
+        clipExtent = SegmentEditorEffect.growAutomaticRegionExtent(sourceImageData, clipExtent, AUTOMATIC_REGION_GROWTH_FACTOR)
+        continue
+      break
 
-    self.erodeCast = vtk.vtkImageCast()
-    self.erodeCast.SetInputConnection(self.erode.GetOutputPort())
-    self.erodeCast.SetOutputScalarTypeToUnsignedInt()
-    self.erodeCast.Update()
+    self.scriptedEffect.saveStateForUndo()
+    self.scriptedEffect.modifySelectedSegmentByLabelmap(modifierLabelmap, slicer.qSlicerSegmentEditorAbstractEffect.ModificationModeAdd)
 
-    # Remove small islands
-    self.islandMath = vtkITK.vtkITKIslandMath()
-    self.islandMath.SetInputConnection(self.erodeCast.GetOutputPort())
-    self.islandMath.SetFullyConnected(False)
-    self.islandMath.SetMinimumSize(125)  # remove regions smaller than 5x5x5 voxels
+    parameterSetNode.SetSourceVolumeIntensityMask(oldSourceVolumeIntensityMask)
+    parameterSetNode.SetSourceVolumeIntensityMaskRange(oldIntensityMaskRange)
 
-    self.islandThreshold = vtk.vtkImageThreshold()
-    self.islandThreshold.SetInputConnection(self.islandMath.GetOutputPort())
-    self.islandThreshold.ThresholdByLower(BACKGROUND_VALUE)
-    self.islandThreshold.SetInValue(BACKGROUND_VALUE)
-    self.islandThreshold.SetOutValue(LABEL_VALUE)
-    self.islandThreshold.SetOutputScalarTypeToUnsignedChar()
-    self.islandThreshold.Update()
+    qt.QApplication.restoreOverrideCursor()
 
-    # Points may be outside the region after it is eroded.
-    # Snap the points to LABEL_VALUE voxels,
-    snappedIJKPoints = self.snapIJKPointsToLabel(ijkPoints, self.islandThreshold.GetOutput())
-    if snappedIJKPoints.GetNumberOfPoints() == 0:
-      qt.QApplication.restoreOverrideCursor()
-      return
+  def segmentSelectedIslands(self, sourceImageData, snappedIJKPoints, selectedIslandIds, kernelSizePixel, modifierLabelmap):
+    """Segment the selected islands of the current island labelmap (see updateIslandLabelmap)
+    using the chosen segmentation algorithm and store the result in modifierLabelmap.
+    """
+    clippedSourceImageData = self.clippedSourceImageData
 
     # Convert points to real data coordinates. Required for vtkImageThresholdConnectivity.
     seedPoints = vtk.vtkPoints()
@@ -406,17 +692,10 @@ Fill segment in a selected region based on source volume intensity range<br>.
 
     segmentationAlgorithm = self.scriptedEffect.parameter(SEGMENTATION_ALGORITHM_PARAMETER_NAME)
     if segmentationAlgorithm == SEGMENTATION_ALGORITHM_MASKING:
-      self.runMasking(seedPoints, self.islandThreshold.GetOutput(), modifierLabelmap)
+      self.runMasking(seedPoints, self.getIslandSelectionLabelmap(selectedIslandIds, BACKGROUND_VALUE), modifierLabelmap)
 
     else:
-      self.floodFillingFilterIsland = vtk.vtkImageThresholdConnectivity()
-      self.floodFillingFilterIsland.SetInputConnection(self.islandThreshold.GetOutputPort())
-      self.floodFillingFilterIsland.SetInValue(SELECTED_ISLAND_VALUE)
-      self.floodFillingFilterIsland.ReplaceInOn()
-      self.floodFillingFilterIsland.ReplaceOutOff()
-      self.floodFillingFilterIsland.ThresholdBetween(LABEL_VALUE, LABEL_VALUE)
-      self.floodFillingFilterIsland.SetSeedPoints(seedPoints)
-      self.floodFillingFilterIsland.Update()
+      selectedIslandLabelmap = self.getIslandSelectionLabelmap(selectedIslandIds, SELECTED_ISLAND_VALUE)
 
       self.maskCast = vtk.vtkImageCast()
       self.maskCast.SetInputData(self.thresh.GetOutput())
@@ -424,7 +703,7 @@ Fill segment in a selected region based on source volume intensity range<br>.
       self.maskCast.Update()
 
       self.imageMask = vtk.vtkImageMask()
-      self.imageMask.SetInputConnection(self.floodFillingFilterIsland.GetOutputPort())
+      self.imageMask.SetInputData(selectedIslandLabelmap)
       self.imageMask.SetMaskedOutputValue(OUTSIDE_THRESHOLD_VALUE)
       self.imageMask.SetMaskInputData(self.maskCast.GetOutput())
       self.imageMask.Update()
@@ -433,14 +712,21 @@ Fill segment in a selected region based on source volume intensity range<br>.
       imageMaskOutput.ShallowCopy(self.imageMask.GetOutput())
       imageMaskOutput.CopyDirections(clippedSourceImageData)
 
+      # Only the selected islands and their surroundings can be added to the segment,
+      # so the segmentation algorithm is only run in that region
+      selectedIslandsExtent = SegmentEditorEffect.getPaddedIslandsExtent(
+        [self.islandBoundingExtents[islandId] for islandId in selectedIslandIds], kernelSizePixel, imageMaskOutput.GetExtent())
+      croppedSourceImageData = SegmentEditorEffect.cropOrientedImageToExtent(clippedSourceImageData, selectedIslandsExtent)
+      croppedImageMaskOutput = SegmentEditorEffect.cropOrientedImageToExtent(imageMaskOutput, selectedIslandsExtent)
+
       imageToWorldMatrix = vtk.vtkMatrix4x4()
       imageMaskOutput.GetImageToWorldMatrix(imageToWorldMatrix)
 
       segmentOutputLabelmap = slicer.vtkOrientedImageData()
       if segmentationAlgorithm == SEGMENTATION_ALGORITHM_GROWCUT:
-        self.runGrowCut(clippedSourceImageData, imageMaskOutput, segmentOutputLabelmap)
+        self.runGrowCut(croppedSourceImageData, croppedImageMaskOutput, segmentOutputLabelmap)
       elif segmentationAlgorithm == SEGMENTATION_ALGORITHM_WATERSHED:
-        self.runWatershed(clippedSourceImageData, imageMaskOutput, segmentOutputLabelmap)
+        self.runWatershed(croppedSourceImageData, croppedImageMaskOutput, segmentOutputLabelmap)
       else:
         logging.error("Unknown segmentation algorithm: \"" + segmentationAlgorithm + "\"")
 
@@ -455,52 +741,306 @@ Fill segment in a selected region based on source volume intensity range<br>.
       self.selectedSegmentThreshold.Update()
       modifierLabelmap.ShallowCopy(self.selectedSegmentThreshold.GetOutput())
 
-    self.scriptedEffect.saveStateForUndo()
-    self.scriptedEffect.modifySelectedSegmentByLabelmap(modifierLabelmap, slicer.qSlicerSegmentEditorAbstractEffect.ModificationModeAdd)
+  def updateIslandLabelmap(self, sourceImageData, clipExtent, minimumThreshold, maximumThreshold, kernelSizePixel):
+    """Threshold the source volume (clipped to clipExtent, if specified), erode it, and remove small islands.
+    Results of the pipeline are kept and only recomputed if any of the inputs changed since the last call.
+    The clipped source image is stored in self.clippedSourceImageData.
+    Returns labelmap that contains LABEL_VALUE in the remaining islands.
+    """
+    sourceVolumeNode = self.scriptedEffect.parameterSetNode().GetSourceVolumeNode()
+    morphologyEngine = self.scriptedEffect.parameter(MORPHOLOGY_ENGINE_PARAMETER_NAME)
+    minimumDiameterMm = abs(self.scriptedEffect.doubleParameter(MINIMUM_DIAMETER_MM_PARAMETER_NAME))
+    thresholdLabelmapKey = (
+      minimumThreshold, maximumThreshold,
+      tuple(clipExtent) if clipExtent is not None else None,
+      sourceVolumeNode.GetID() if sourceVolumeNode else None,
+      sourceImageData.GetMTime())
+    islandLabelmapKey = thresholdLabelmapKey + (tuple(kernelSizePixel), morphologyEngine, minimumDiameterMm)
+    if self.islandLabelmapKey == islandLabelmapKey:
+      return self.islandThreshold.GetOutput()
+    self.islandLabelmapKey = None
+    self.islandIdVoxels = None
+
+    if self.thresholdLabelmapKey != thresholdLabelmapKey:
+      self.thresholdLabelmapKey = None
+      self.thresholdDistanceVoxels = None
+      if clipExtent is not None:
+        self.clippedSourceImageData = SegmentEditorEffect.cropOrientedImageToExtent(sourceImageData, clipExtent)
+      else:
+        self.clippedSourceImageData = sourceImageData
+
+      # Pipeline
+      self.thresh = vtk.vtkImageThreshold()
+      self.thresh.SetInValue(LABEL_VALUE)
+      self.thresh.SetOutValue(BACKGROUND_VALUE)
+      self.thresh.SetInputData(self.clippedSourceImageData)
+      self.thresh.ThresholdBetween(minimumThreshold, maximumThreshold)
+      self.thresh.SetOutputScalarTypeToUnsignedChar()
+      self.thresh.Update()
+      self.thresholdLabelmapKey = thresholdLabelmapKey
+
+    if morphologyEngine == MORPHOLOGY_ENGINE_DISTANCE_MAP:
+      # Distance map only depends on the thresholded labelmap, so changing the minimum diameter only requires thresholding it
+      if self.thresholdDistanceVoxels is None:
+        self.thresholdDistanceVoxels = SegmentEditorEffect.computeDistanceMap(self.thresh.GetOutput(), BACKGROUND_VALUE)
+      erodedLabelmap = SegmentEditorEffect.thresholdDistanceMap(self.thresholdDistanceVoxels, self.thresh.GetOutput(),
+        minimumDiameterMm / 2.0, erode=True, scalarType=vtk.VTK_UNSIGNED_INT)
+    elif morphologyEngine == MORPHOLOGY_ENGINE_SEPARABLE_BOX:
+      erodedLabelmap = SegmentEditorEffect.dilateErodeBox(self.thresh.GetOutput(), kernelSizePixel, dilate=False,
+        scalarType=vtk.VTK_UNSIGNED_INT)
+    else:
+      self.erode = vtk.vtkImageDilateErode3D()
+      self.erode.SetInputConnection(self.thresh.GetOutputPort())
+      self.erode.SetDilateValue(BACKGROUND_VALUE)
+      self.erode.SetErodeValue(LABEL_VALUE)
+      self.erode.SetKernelSize(
+        kernelSizePixel[0],
+        kernelSizePixel[1],
+        kernelSizePixel[2])
+
+      self.erodeCast = vtk.vtkImageCast()
+      self.erodeCast.SetInputConnection(self.erode.GetOutputPort())
+      self.erodeCast.SetOutputScalarTypeToUnsignedInt()
+      self.erodeCast.Update()
+      erodedLabelmap = self.erodeCast.GetOutput()
 
-    parameterSetNode.SetSourceVolumeIntensityMask(oldSourceVolumeIntensityMask)
-    parameterSetNode.SetSourceVolumeIntensityMaskRange(oldIntensityMaskRange)
+    # Remove small islands
+    self.islandMath = vtkITK.vtkITKIslandMath()
+    self.islandMath.SetInputData(erodedLabelmap)
+    self.islandMath.SetFullyConnected(False)
+    self.islandMath.SetMinimumSize(125)  # remove regions smaller than 5x5x5 voxels
 
-    qt.QApplication.restoreOverrideCursor()
+    self.islandThreshold = vtk.vtkImageThreshold()
+    self.islandThreshold.SetInputConnection(self.islandMath.GetOutputPort())
+    self.islandThreshold.ThresholdByLower(BACKGROUND_VALUE)
+    self.islandThreshold.SetInValue(BACKGROUND_VALUE)
+    self.islandThreshold.SetOutValue(LABEL_VALUE)
+    self.islandThreshold.SetOutputScalarTypeToUnsignedChar()
+    self.islandThreshold.Update()
+
+    self.updateIslandIndex()
+    self.islandLabelmapKey = islandLabelmapKey
+    return self.islandThreshold.GetOutput()
+
+  def updateIslandIndex(self):
+    """Store island id of each voxel and bounding extent and number of voxels of each island.
+    Island ids are computed by the island math filter (connected components of the eroded labelmap).
+    """
+    import numpy as np
+    from vtk.util import numpy_support
+    islandIdImage = self.islandMath.GetOutput()
+    self.islandIdExtent = islandIdImage.GetExtent()
+    dimensions = islandIdImage.GetDimensions()
+    self.islandIdVoxels = numpy_support.vtk_to_numpy(islandIdImage.GetPointData().GetScalars()).reshape(
+      dimensions[2], dimensions[1], dimensions[0])
+
+    lowerIndices, upperIndices, numberOfVoxels = SegmentEditorEffect.getLabelBoundingBoxes(self.islandIdVoxels)
+    self.islandBoundingExtents = {}
+    self.islandNumberOfVoxels = {}
+    islandIds = np.flatnonzero(numberOfVoxels)
+    islandIds = islandIds[islandIds != BACKGROUND_VALUE]
+    self.maximumIslandId = int(islandIds[-1]) if len(islandIds) else 0
+    for islandId in islandIds.tolist():
+      # Bounding boxes are in KJI axis order
+      self.islandBoundingExtents[islandId] = [
+        self.islandIdExtent[0] + int(lowerIndices[2, islandId]), self.islandIdExtent[0] + int(upperIndices[2, islandId]),
+        self.islandIdExtent[2] + int(lowerIndices[1, islandId]), self.islandIdExtent[2] + int(upperIndices[1, islandId]),
+        self.islandIdExtent[4] + int(lowerIndices[0, islandId]), self.islandIdExtent[4] + int(upperIndices[0, islandId])]
+      self.islandNumberOfVoxels[islandId] = int(numberOfVoxels[islandId])
+
+  @staticmethod
+  def getLabelBoundingBoxes(labelVoxels):
+    """Get bounding box and number of voxels of each label value of a non-negative integer NumPy array (KJI axis order).
+    The array is processed in slabs, so that only a limited number of voxel coordinates are stored at a time.
+    :return: lowest and highest index along each axis (arrays of shape 3 x (maximum label + 1), in KJI axis order)
+      and number of voxels of each label. Bounds of labels that do not occur (and of label 0) are not valid.
+    """
+    import numpy as np
+    numberOfLabels = int(labelVoxels.max()) + 1 if labelVoxels.size else 1
+    lowerIndices = np.full((3, numberOfLabels), np.iinfo(np.int64).max, np.int64)
+    upperIndices = np.full((3, numberOfLabels), -1, np.int64)
+    numberOfVoxels = np.zeros(numberOfLabels, np.int64)
+    sliceNumberOfVoxels = max(1, labelVoxels.shape[1] * labelVoxels.shape[2])
+    slabSlices = max(1, LABEL_BOUNDING_BOX_SLAB_NUMBER_OF_VOXELS // sliceNumberOfVoxels)
+    for slabStart in range(0, labelVoxels.shape[0], slabSlices):
+      slabVoxels = labelVoxels[slabStart:slabStart + slabSlices]
+      indices = np.nonzero(slabVoxels)
+      labels = slabVoxels[indices]
+      numberOfVoxels += np.bincount(labels, minlength=numberOfLabels)
+      for axis in range(3):
+        axisIndices = indices[axis] + slabStart if axis == 0 else indices[axis]
+        np.minimum.at(lowerIndices[axis], labels, axisIndices)
+        np.maximum.at(upperIndices[axis], labels, axisIndices)
+    return lowerIndices, upperIndices, numberOfVoxels
+
+  def getIslandIdsAtPoints(self, ijkPoints):
+    """Get ids of the islands at the specified IJK points (points outside of islands are ignored)"""
+    islandIds = set()
+    for pointIndex in range(ijkPoints.GetNumberOfPoints()):
+      i, j, k = [int(round(coordinate)) for coordinate in ijkPoints.GetPoint(pointIndex)]
+      islandId = int(self.islandIdVoxels[k - self.islandIdExtent[4], j - self.islandIdExtent[2], i - self.islandIdExtent[0]])
+      if islandId != 0:
+        islandIds.add(islandId)
+    return sorted(islandIds)
+
+  def getIslandSelectionLabelmap(self, selectedIslandIds, selectedIslandValue):
+    """Create labelmap that contains selectedIslandValue in the selected islands and LABEL_VALUE in all other islands.
+    The labelmap is computed from the island index using a lookup table.
+    """
+    import numpy as np
+    from vtk.util import numpy_support
+    lookupTable = np.full(self.maximumIslandId + 1, LABEL_VALUE, np.uint8)
+    lookupTable[BACKGROUND_VALUE] = BACKGROUND_VALUE
+    lookupTable[selectedIslandIds] = selectedIslandValue
+    islandSelectionLabelmap = vtk.vtkImageData()
+    islandSelectionLabelmap.CopyStructure(self.islandThreshold.GetOutput())
+    islandSelectionLabelmap.AllocateScalars(vtk.VTK_UNSIGNED_CHAR, 1)
+    voxels = numpy_support.vtk_to_numpy(islandSelectionLabelmap.GetPointData().GetScalars()).reshape(self.islandIdVoxels.shape)
+    np.take(lookupTable, self.islandIdVoxels, out=voxels)
+    return islandSelectionLabelmap
+
+  @staticmethod
+  def computeDistanceMap(labelmap, labelValue):
+    """Compute Euclidean distance (in physical units) of each voxel from the nearest voxel that has labelValue.
+    Voxels that have labelValue get a zero or negative value.
+    :param labelmap: vtkImageData with a single scalar component
+    :return: distance map NumPy array (KJI axis order)
+    """
+    from vtk.util import numpy_support
+    dimensions = labelmap.GetDimensions()
+    voxels = numpy_support.vtk_to_numpy(labelmap.GetPointData().GetScalars()).reshape(dimensions[2], dimensions[1], dimensions[0])
+    labelImage = sitk.GetImageFromArray((voxels == labelValue).view('uint8'))
+    labelImage.SetSpacing(labelmap.GetSpacing())
+    distanceFilter = sitk.SignedMaurerDistanceMapImageFilter()
+    distanceFilter.SetInsideIsPositive(False)
+    distanceFilter.SetUseImageSpacing(True)
+    distanceFilter.SetSquaredDistance(False)
+    return sitk.GetArrayFromImage(distanceFilter.Execute(labelImage))
+
+  @staticmethod
+  def thresholdDistanceMap(distanceVoxels, referenceImage, radiusMm, erode, scalarType=vtk.VTK_UNSIGNED_CHAR):
+    """Erode or dilate a labelmap with a spherical kernel, using its distance map.
+    For erosion, distanceVoxels must be the distance from the background; for dilation, the distance from the foreground
+    (see computeDistanceMap).
+    :param referenceImage: image that defines the geometry of the output
+    :param radiusMm: kernel radius
+    :return: vtkImageData that contains LABEL_VALUE in the eroded or dilated region, BACKGROUND_VALUE elsewhere
+    """
+    from vtk.util import numpy_support
+    outputLabelmap = vtk.vtkImageData()
+    outputLabelmap.CopyStructure(referenceImage)
+    outputLabelmap.AllocateScalars(scalarType, 1)
+    outputVoxels = numpy_support.vtk_to_numpy(outputLabelmap.GetPointData().GetScalars()).reshape(distanceVoxels.shape)
+    if erode:
+      outputVoxels[:] = (distanceVoxels > radiusMm)
+    else:
+      outputVoxels[:] = (distanceVoxels < radiusMm)
+    return outputLabelmap
+
+  @staticmethod
+  def dilateByDistanceMap(labelmap, radiusMm):
+    """Dilate LABEL_VALUE region of the labelmap with a spherical kernel of the specified radius"""
+    distanceVoxels = SegmentEditorEffect.computeDistanceMap(labelmap, LABEL_VALUE)
+    return SegmentEditorEffect.thresholdDistanceMap(distanceVoxels, labelmap, radiusMm, erode=False)
+
+  @staticmethod
+  def dilateErodeBox(labelmap, kernelSize, dilate, scalarType=None):
+    """Dilate (maximum filter) or erode (minimum filter) an unsigned integer image with a box-shaped kernel.
+    The kernel is decomposed into 1D running maximum/minimum along each axis (van Herk/Gil-Werman algorithm),
+    therefore computation time does not depend on the kernel size. Voxels outside the image are ignored.
+    This is a utility function that can be used in other effects.
+    :param labelmap: vtkImageData with a single unsigned integer scalar component
+    :param kernelSize: kernel size in voxels along I, J, K axes (odd numbers)
+    :param dilate: dilate if True, erode if False
+    :param scalarType: scalar type of the output image, by default the same as the input
+    :return: vtkImageData containing the result
+    """
+    from vtk.util import numpy_support
+    dimensions = labelmap.GetDimensions()
+    voxels = numpy_support.vtk_to_numpy(labelmap.GetPointData().GetScalars()).reshape(dimensions[2], dimensions[1], dimensions[0])
+    for axis in range(3):
+      # kernel size is in IJK order, voxels array is in KJI order
+      voxels = SegmentEditorEffect.runningMaximumMinimum(voxels, 2-axis, kernelSize[axis], dilate)
+    outputLabelmap = vtk.vtkImageData()
+    outputLabelmap.CopyStructure(labelmap)
+    outputLabelmap.AllocateScalars(scalarType if scalarType is not None else labelmap.GetScalarType(), 1)
+    numpy_support.vtk_to_numpy(outputLabelmap.GetPointData().GetScalars()).reshape(voxels.shape)[:] = voxels
+    return outputLabelmap
+
+  @staticmethod
+  def runningMaximumMinimum(voxels, axis, windowSize, maximum):
+    """Compute maximum (or minimum) in a sliding window along an axis of a NumPy array of unsigned integers.
+    The window is centered on each element, elements outside of the array are ignored.
+    Uses van Herk/Gil-Werman algorithm: 3 comparisons per element, regardless of the window size.
+    """
+    import numpy as np
+    if windowSize <= 1:
+      return voxels
+    operation = np.maximum if maximum else np.minimum
+    padValue = 0 if maximum else np.iinfo(voxels.dtype).max
+    voxels = np.moveaxis(voxels, axis, -1)
+    length = voxels.shape[-1]
+    # Pad the array so that it consists of full blocks of windowSize length
+    lowerPadding = (windowSize - 1) // 2
+    paddedLength = int(math.ceil(float(length + windowSize - 1) / windowSize)) * windowSize
+    padded = np.full(voxels.shape[:-1] + (paddedLength,), padValue, voxels.dtype)
+    padded[..., lowerPadding:lowerPadding+length] = voxels
+    blocks = padded.reshape(voxels.shape[:-1] + (paddedLength // windowSize, windowSize))
+    # Running maximum from the start and from the end of each block
+    prefix = operation.accumulate(blocks, axis=-1).reshape(padded.shape)
+    suffix = operation.accumulate(blocks[..., ::-1], axis=-1)[..., ::-1].reshape(padded.shape)
+    del padded, blocks
+    # Each window spans at most two blocks: combine the end of the first and the start of the second one
+    result = operation(suffix[..., :length], prefix[..., windowSize-1:windowSize-1+length])
+    return np.moveaxis(result, -1, axis)
 
   def snapIJKPointsToLabel(self, ijkPoints, labelmap):
-    import math
+    """Move each point to the closest non-empty voxel of the labelmap within the kernel window around the point.
+    Points that have no non-empty voxels in their window are removed.
+    All points are processed at once, using NumPy arrays.
+    """
+    import numpy as np
+    from vtk.util import numpy_support
     snapIJKPoints = vtk.vtkPoints()
+    numberOfPoints = ijkPoints.GetNumberOfPoints()
+    if numberOfPoints == 0:
+      return snapIJKPoints
     kernelSize = self.getKernelSizePixel()
-    kernelOffset = [0,0,0]
     labelmapExtent = labelmap.GetExtent()
-    for i in range(len(kernelOffset)):
-      kernelOffset[i] = int(math.ceil(kernelSize[i]-1)/2)
-    for pointIndex in range(ijkPoints.GetNumberOfPoints()):
-      point = ijkPoints.GetPoint(pointIndex)
-      closestDistance = vtk.VTK_INT_MAX
-      closestPoint = None
-      # Try to find the closest point to the original within the kernel
-      # If more IJK points are used in the future, this could be made faster
-      for kOffset in range(-kernelOffset[2], kernelOffset[2]+1):
-        k = int(point[2] + kOffset)
-        for jOffset in range(-kernelOffset[1], kernelOffset[1]+1):
-          j = int(point[1] + jOffset)
-          for iOffset in range(-kernelOffset[0], kernelOffset[0]+1):
-            i = int(point[0] + iOffset)
-
-            if (labelmapExtent[0] > i or labelmapExtent[1] < i or
-                labelmapExtent[2] > j or labelmapExtent[3] < j or
-                labelmapExtent[4] > k or labelmapExtent[5] < k):
-              continue # Voxel not in image
-            value = labelmap.GetScalarComponentAsFloat(i, j, k, 0)
-            if value <= 0:
-              continue # Label is empty
-
-            offsetPoint = [i, j, k]
-            distance = vtk.vtkMath.Distance2BetweenPoints(point, offsetPoint)
-            if distance >= closestDistance:
-              continue
-            closestPoint = offsetPoint
-            closestDistance = distance
-      if closestPoint is None:
-        continue
-      snapIJKPoints.InsertNextPoint(closestPoint[0], closestPoint[1], closestPoint[2])
+    labelmapDimensions = labelmap.GetDimensions()
+    labelVoxels = numpy_support.vtk_to_numpy(labelmap.GetPointData().GetScalars()).reshape(
+      labelmapDimensions[2], labelmapDimensions[1], labelmapDimensions[0])
+
+    points = np.array([ijkPoints.GetPoint(pointIndex) for pointIndex in range(numberOfPoints)])
+    # For each point and axis: voxel indices in the kernel window (point index, window index)
+    windowIndices = []
+    windowValid = []
+    for axis in range(3):
+      kernelOffset = int(math.ceil(kernelSize[axis]-1)/2)
+      offsets = np.arange(-kernelOffset, kernelOffset+1)
+      indices = np.trunc(points[:, axis, np.newaxis] + offsets).astype(int)
+      windowValid.append((indices >= labelmapExtent[2*axis]) & (indices <= labelmapExtent[2*axis+1]))
+      windowIndices.append(np.clip(indices, labelmapExtent[2*axis], labelmapExtent[2*axis+1]))
+    i, j, k = windowIndices
+
+    # Label values and squared distances in the window, in (point, k, j, i) order
+    values = labelVoxels[
+      (k - labelmapExtent[4])[:, :, np.newaxis, np.newaxis],
+      (j - labelmapExtent[2])[:, np.newaxis, :, np.newaxis],
+      (i - labelmapExtent[0])[:, np.newaxis, np.newaxis, :]]
+    valid = (values > 0) & windowValid[2][:, :, np.newaxis, np.newaxis] & windowValid[1][:, np.newaxis, :, np.newaxis] & windowValid[0][:, np.newaxis, np.newaxis, :]
+    distances = (((points[:, 0, np.newaxis] - i)**2)[:, np.newaxis, np.newaxis, :]
+      + ((points[:, 1, np.newaxis] - j)**2)[:, np.newaxis, :, np.newaxis]
+      + ((points[:, 2, np.newaxis] - k)**2)[:, :, np.newaxis, np.newaxis])
+    distances[~valid] = np.inf
+
+    # Closest voxel (first one in k, j, i order if there are several at the same distance)
+    closestIndices = np.argmin(distances.reshape(numberOfPoints, -1), axis=1)
+    closestK, closestJ, closestI = np.unravel_index(closestIndices, distances.shape[1:])
+    for pointIndex in range(numberOfPoints):
+      if not valid[pointIndex, closestK[pointIndex], closestJ[pointIndex], closestI[pointIndex]]:
+        continue # No label in the kernel window
+      snapIJKPoints.InsertNextPoint(i[pointIndex, closestI[pointIndex]], j[pointIndex, closestJ[pointIndex]], k[pointIndex, closestK[pointIndex]])
     return snapIJKPoints
 
 
@@ -516,9 +1056,30 @@ Fill segment in a selected region based on source volume intensity range<br>.
     return kernelSizePixel
 
   @staticmethod
-  def cropOrientedImage(sourceImageData, roiNode):
-    """Clip source image data with annotation ROI and return result in a new vtkOrientedImageData"""
+  def cropOrientedImage(sourceImageData, roiNode, croppedImageCache=None, sourceVolumeNode=None):
+    """Clip source image data with annotation ROI and return result in a vtkOrientedImageData.
+    If croppedImageCache (a list owned by the caller) and sourceVolumeNode are specified then recent results are kept
+    in the list and returned again while the ROI and the source volume are not modified, therefore the result must not
+    be modified by the caller. Cropped images may share voxels with the source image data, so the caller should
+    clear the list when the images are no longer needed (for example, when the effect is deactivated).
+    """
     # This is a utility function, also used in FloodFilling effect.
+    if croppedImageCache is None or sourceVolumeNode is None:
+      extent = SegmentEditorEffect.getROIExtent(sourceImageData, roiNode)
+      return SegmentEditorEffect.cropOrientedImageToExtent(sourceImageData, extent)
+    key = (roiNode.GetID(), roiNode.GetMTime(), sourceVolumeNode.GetID(), sourceImageData.GetMTime())
+    for cachedKey, croppedImageData in croppedImageCache:
+      if cachedKey == key:
+        return croppedImageData
+    extent = SegmentEditorEffect.getROIExtent(sourceImageData, roiNode)
+    croppedImageData = SegmentEditorEffect.cropOrientedImageToExtent(sourceImageData, extent)
+    croppedImageCache.insert(0, (key, croppedImageData))
+    del croppedImageCache[CROPPED_IMAGE_CACHE_SIZE:]
+    return croppedImageData
+
+  @staticmethod
+  def getROIExtent(sourceImageData, roiNode):
+    """Get extent of the source image data that contains the ROI"""
     # Probably we should apply relative transform between ROI and source image data node
 
     worldToImageMatrix = vtk.vtkMatrix4x4()
@@ -540,10 +1101,35 @@ Fill segment in a selected region based on source volume intensity range<br>.
         upperPoint = max(corner1IJK[i], corner2IJK[i])
         extent[2*i] = int(math.floor(lowerPoint))
         extent[2*i+1] = int(math.ceil(upperPoint))
+    return extent
 
+  @staticmethod
+  def cropOrientedImageToExtent(sourceImageData, extent):
+    """Clip source image data to the specified extent and return result in a new vtkOrientedImageData.
+    Regions outside of the source image data are filled with 0.
+    If the extent only crops the source along the K axis then the result shares the voxels of the source image data.
+    """
     imageToWorldMatrix = vtk.vtkMatrix4x4()
     sourceImageData.GetImageToWorldMatrix(imageToWorldMatrix)
     clippedSourceImageData = slicer.vtkOrientedImageData()
+
+    sourceExtent = sourceImageData.GetExtent()
+    if (list(extent[0:4]) == list(sourceExtent[0:4])
+        and sourceExtent[4] <= extent[4] <= extent[5] <= sourceExtent[5]):
+      # Voxels of full slices are contiguous in memory, so they can be used without copying
+      from vtk.util import numpy_support
+      sourceScalars = sourceImageData.GetPointData().GetScalars()
+      sourceVoxels = numpy_support.vtk_to_numpy(sourceScalars)
+      numberOfVoxelsInSlice = (sourceExtent[1]-sourceExtent[0]+1) * (sourceExtent[3]-sourceExtent[2]+1)
+      clippedScalars = numpy_support.numpy_to_vtk(
+        sourceVoxels[(extent[4]-sourceExtent[4])*numberOfVoxelsInSlice:(extent[5]-sourceExtent[4]+1)*numberOfVoxelsInSlice],
+        deep=False, array_type=sourceScalars.GetDataType())
+      clippedScalars.SetName(sourceScalars.GetName())
+      clippedSourceImageData.SetExtent(extent)
+      clippedSourceImageData.GetPointData().SetScalars(clippedScalars)
+      clippedSourceImageData.SetImageToWorldMatrix(imageToWorldMatrix)
+      return clippedSourceImageData
+
     padder = vtk.vtkImageConstantPad()
     padder.SetInputData(sourceImageData)
     padder.SetOutputWholeExtent(extent)
@@ -553,6 +1139,177 @@ Fill segment in a selected region based on source volume intensity range<br>.
 
     return clippedSourceImageData
 
+  @staticmethod
+  def getPaddedIslandsExtent(islandExtents, padding, limitExtent):
+    """Get extent that contains all the islands, padded by the specified number of voxels along each axis
+    and limited to limitExtent.
+    """
+    extent = [0, -1, 0, -1, 0, -1]
+    for axis in range(3):
+      extent[2*axis] = max(min([islandExtent[2*axis] for islandExtent in islandExtents]) - abs(padding[axis]),
+        limitExtent[2*axis])
+      extent[2*axis+1] = min(max([islandExtent[2*axis+1] for islandExtent in islandExtents]) + abs(padding[axis]),
+        limitExtent[2*axis+1])
+    return extent
+
+  @staticmethod
+  def getAutomaticRegionExtent(sourceImageData, ijkPoints, sizeMm):
+    """Get extent of a region of approximately sizeMm size around the points, clipped to the source image extent"""
+    spacing = sourceImageData.GetSpacing()
+    sourceExtent = sourceImageData.GetExtent()
+    bounds = [0, 0, 0, 0, 0, 0]
+    ijkPoints.GetBounds(bounds)
+    extent = [0, -1, 0, -1, 0, -1]
+    for axis in range(3):
+      halfSizeVoxels = int(math.ceil(sizeMm / 2.0 / spacing[axis]))
+      extent[2*axis] = max(sourceExtent[2*axis], int(math.floor(bounds[2*axis])) - halfSizeVoxels)
+      extent[2*axis+1] = min(sourceExtent[2*axis+1], int(math.ceil(bounds[2*axis+1])) + halfSizeVoxels)
+    return extent
+
+  @staticmethod
+  def growAutomaticRegionExtent(sourceImageData, extent, growthFactor):
+    """Enlarge the region extent by growthFactor (around its center), clipped to the source image extent.
+    Returns None if the enlarged region covers the entire source image.
+    """
+    sourceExtent = sourceImageData.GetExtent()
+    grownExtent = [0, -1, 0, -1, 0, -1]
+    for axis in range(3):
+      margin = int(math.ceil((extent[2*axis+1] - extent[2*axis] + 1) * (growthFactor - 1) / 2.0))
+      grownExtent[2*axis] = max(sourceExtent[2*axis], extent[2*axis] - margin)
+      grownExtent[2*axis+1] = min(sourceExtent[2*axis+1], extent[2*axis+1] + margin)
+    if list(grownExtent) == list(sourceExtent):
+      return None
+    return grownExtent
+
+  @staticmethod
+  def isAnyIslandOnRegionBoundary(islandExtents, regionExtent, sourceExtent):
+    """Check if any of the islands touches a side of the region that is not a side of the source image"""
+    for islandExtent in islandExtents:
+      for axis in range(3):
+        if islandExtent[2*axis] <= regionExtent[2*axis] and regionExtent[2*axis] > sourceExtent[2*axis]:
+          return True
+        if islandExtent[2*axis+1] >= regionExtent[2*axis+1] and regionExtent[2*axis+1] < sourceExtent[2*axis+1]:
+          return True
+    return False
+
+  @staticmethod
+  def isLabelOnRegionBoundary(labelmap, regionExtent, sourceExtent):
+    """Check if the labelmap has non-empty voxels on a side of the region that is not a side of the source image"""
+    import numpy as np
+    from vtk.util import numpy_support
+    labelmapExtent = labelmap.GetExtent()
+    dimensions = labelmap.GetDimensions()
+    if labelmap.GetPointData().GetScalars() is None or min(dimensions) <= 0:
+      return False
+    labelVoxels = numpy_support.vtk_to_numpy(labelmap.GetPointData().GetScalars()).reshape(
+      dimensions[2], dimensions[1], dimensions[0])
+    for axis in range(3):
+      for side, isInsideSource in [(regionExtent[2*axis], regionExtent[2*axis] > sourceExtent[2*axis]),
+          (regionExtent[2*axis+1], regionExtent[2*axis+1] < sourceExtent[2*axis+1])]:
+        if not isInsideSource or not (labelmapExtent[2*axis] <= side <= labelmapExtent[2*axis+1]):
+          continue
+        # Array axes are in KJI order
+        if np.any(np.take(labelVoxels, side - labelmapExtent[2*axis], axis=2-axis)):
+          return True
+    return False
+
+
+class IslandHoverPipeline:
+  """ Visualization objects and pipeline for each slice view for outlining the island under the mouse
+  """
+
+  def __init__(self):
+    # Input is the thresholded slice (LABEL_VALUE inside the threshold range)
+    self.shrink = vtk.vtkImageShrink3D()
+    self.shrink.AveragingOff()
+
+    self.erode = vtk.vtkImageDilateErode3D()
+    self.erode.SetInputConnection(self.shrink.GetOutputPort())
+    self.erode.SetDilateValue(BACKGROUND_VALUE)
+    self.erode.SetErodeValue(LABEL_VALUE)
+
+    self.connectivity = vtk.vtkImageThresholdConnectivity()
+    self.connectivity.SetInputConnection(self.erode.GetOutputPort())
+    self.connectivity.ThresholdBetween(LABEL_VALUE, LABEL_VALUE)
+    self.connectivity.SetInValue(LABEL_VALUE)
+    self.connectivity.SetOutValue(BACKGROUND_VALUE)
+
+    self.contour = vtk.vtkMarchingSquares()
+    self.contour.SetInputConnection(self.connectivity.GetOutputPort())
+    self.contour.SetValue(0, 0.5)
+
+    # Feedback actor
+    self.mapper = vtk.vtkPolyDataMapper2D()
+    self.mapper.SetInputConnection(self.contour.GetOutputPort())
+    self.actor = vtk.vtkActor2D()
+    self.actor.SetMapper(self.mapper)
+    self.actor.SetVisibility(False)
+    actorProperty = self.actor.GetProperty()
+    actorProperty.SetColor(HOVER_PREVIEW_COLOR)
+    actorProperty.SetLineWidth(2)
+
+
+class BatchSeedPipeline:
+  """ Visualization objects and pipeline for each slice view for showing the batch seed points.
+  Markers are faded out with increasing distance from the slice plane and are not shown farther than
+  BATCH_SEED_MARKER_FADE_DISTANCE_MM.
+  """
+
+  def __init__(self, rasPoints, sliceNode):
+    self.polyData = vtk.vtkPolyData()
+    self.polyData.SetPoints(rasPoints)
+
+    # Transform points from RAS to slice coordinates (z is the distance from the slice plane in mm),
+    # then to slice view XY coordinates. Follows changes of the slice position.
+    self.sliceToRAS = vtk.vtkMatrixToLinearTransform()
+    self.sliceToRAS.SetInput(sliceNode.GetSliceToRAS())
+    self.sliceTransformFilter = vtk.vtkTransformPolyDataFilter()
+    self.sliceTransformFilter.SetInputData(self.polyData)
+    self.sliceTransformFilter.SetTransform(self.sliceToRAS.GetInverse())
+
+    # Scalar value is 0.5 in the slice plane, 0 and 1 at the fade distance on the two sides of the plane
+    self.distanceFilter = vtk.vtkElevationFilter()
+    self.distanceFilter.SetInputConnection(self.sliceTransformFilter.GetOutputPort())
+    self.distanceFilter.SetLowPoint(0, 0, -BATCH_SEED_MARKER_FADE_DISTANCE_MM)
+    self.distanceFilter.SetHighPoint(0, 0, BATCH_SEED_MARKER_FADE_DISTANCE_MM)
+    self.distanceFilter.SetScalarRange(0.0, 1.0)
+
+    self.xyToSlice = vtk.vtkMatrixToLinearTransform()
+    self.xyToSlice.SetInput(sliceNode.GetXYToSlice())
+    self.transformFilter = vtk.vtkTransformPolyDataFilter()
+    self.transformFilter.SetInputConnection(self.distanceFilter.GetOutputPort())
+    self.transformFilter.SetTransform(self.xyToSlice.GetInverse())
+
+    self.glyphSource = vtk.vtkGlyphSource2D()
+    self.glyphSource.SetGlyphTypeToCross()
+    self.glyphSource.SetScale(BATCH_SEED_MARKER_SIZE_PIXEL)
+    self.glyph = vtk.vtkGlyph2D()
+    self.glyph.SetInputConnection(self.transformFilter.GetOutputPort())
+    self.glyph.SetSourceConnection(self.glyphSource.GetOutputPort())
+    # Distance scalar is only used for coloring (as glyph scale value), not for scaling the markers
+    self.glyph.ScalingOff()
+
+    # Marker opacity decreases linearly with the distance from the slice plane
+    self.lookupTable = vtk.vtkLookupTable()
+    numberOfTableValues = 65
+    self.lookupTable.SetNumberOfTableValues(numberOfTableValues)
+    self.lookupTable.SetTableRange(0.0, 1.0)
+    for index in range(numberOfTableValues):
+      opacity = 1.0 - abs(2.0 * index / (numberOfTableValues - 1) - 1.0)
+      self.lookupTable.SetTableValue(index, BATCH_SEED_MARKER_COLOR[0], BATCH_SEED_MARKER_COLOR[1], BATCH_SEED_MARKER_COLOR[2], opacity)
+
+    # Feedback actor
+    self.mapper = vtk.vtkPolyDataMapper2D()
+    self.mapper.SetInputConnection(self.glyph.GetOutputPort())
+    self.mapper.SetLookupTable(self.lookupTable)
+    self.mapper.SetScalarRange(0.0, 1.0)
+    self.mapper.ScalarVisibilityOn()
+    self.actor = vtk.vtkActor2D()
+    self.actor.SetMapper(self.mapper)
+    actorProperty = self.actor.GetProperty()
+    actorProperty.SetColor(BATCH_SEED_MARKER_COLOR)
+    actorProperty.SetLineWidth(2)
+
 
 MINIMUM_DIAMETER_MM_PARAMETER_NAME = "MinimumDiameterMm"
 FEATURE_SIZE_MM_PARAMETER_NAME = "FeatureSizeMm"
@@ -560,6 +1317,34 @@ SEGMENTATION_ALGORITHM_PARAMETER_NAME = "SegmentationAlgorithm"
 SEGMENTATION_ALGORITHM_MASKING = "Masking"
 SEGMENTATION_ALGORITHM_GROWCUT = "GrowCut"
 SEGMENTATION_ALGORITHM_WATERSHED = "WaterShed"
+AUTOMATIC_REGION_PARAMETER_NAME = "AutomaticRegion"
+HOVER_PREVIEW_PARAMETER_NAME = "HoverPreview"
+BATCH_SEEDS_PARAMETER_NAME = "BatchSeeds"
+MORPHOLOGY_ENGINE_PARAMETER_NAME = "MorphologyEngine"
+MORPHOLOGY_ENGINE_KERNEL = "Kernel"
+MORPHOLOGY_ENGINE_DISTANCE_MAP = "Distance map"
+MORPHOLOGY_ENGINE_SEPARABLE_BOX = "Separable box"
+
+# Size of the region that is processed first in automatic region mode, and the factor it is enlarged by
+# if the selected island does not fit in it
+AUTOMATIC_REGION_INITIAL_SIZE_MM = 50.0
+AUTOMATIC_REGION_GROWTH_FACTOR = 2.0
+
+# Number of cropped images kept by cropOrientedImage
+CROPPED_IMAGE_CACHE_SIZE = 4
+
+# Label bounding boxes are computed in slabs of about this many voxels, to limit the size of voxel coordinate arrays
+LABEL_BOUNDING_BOX_SLAB_NUMBER_OF_VOXELS = 4*1024*1024
+
+HOVER_PREVIEW_UPDATE_INTERVAL_MS = 50
+# Slice is downsampled for the island outline if the minimum diameter is larger than this in slice view pixels
+HOVER_PREVIEW_MAXIMUM_KERNEL_SIZE_PIXEL = 15
+HOVER_PREVIEW_COLOR = (1.0, 1.0, 0.0)
+
+BATCH_SEED_MARKER_SIZE_PIXEL = 10
+BATCH_SEED_MARKER_COLOR = (1.0, 0.5, 0.0)
+# Batch seed markers are faded out with distance from the slice plane and hidden beyond this distance
+BATCH_SEED_MARKER_FADE_DISTANCE_MM = 10.0
 
 BACKGROUND_VALUE = 0
 LABEL_VALUE = 1
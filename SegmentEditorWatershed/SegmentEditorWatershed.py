@@ -28,3 +28,119 @@ class SegmentEditorWatershed(ScriptedLoadableModule):
     effectFilename = os.path.join(os.path.dirname(__file__), self.__class__.__name__+'Lib/SegmentEditorEffect.py')
     instance.setPythonSource(effectFilename.replace('\\','/'))
     instance.self().register()
+
+class SegmentEditorWatershedTest(ScriptedLoadableModuleTest):
+  """
+  This is the test case for your scripted module.
+  Uses ScriptedLoadableModuleTest base class, available at:
+  https://github.com/Slicer/Slicer/blob/master/Base/Python/slicer/ScriptedLoadableModule.py
+  """
+
+  def setUp(self):
+    """ Do whatever is needed to reset the state - typically a scene clear will be enough.
+    """
+    slicer.mrmlScene.Clear(0)
+
+  def runTest(self):
+    """Run as few or as many tests as needed here.
+    """
+    self.setUp()
+    self.test_SegmentEditorWatershedRegionGraph()
+    self.setUp()
+    self.test_SegmentEditorWatershedSlabWise()
+
+  def test_SegmentEditorWatershedRegionGraph(self):
+    """
+    Compare seed propagation in the region graph to MorphologicalWatershedFromMarkers at full resolution,
+    on an image that consists of noisy blocks, with and without merging basins to limit the number of regions.
+    """
+    self.delayDisplay("Starting test_SegmentEditorWatershedRegionGraph")
+
+    import numpy as np
+    import SimpleITK as sitk
+    import SegmentEditorWatershedLib
+
+    randomGenerator = np.random.RandomState(1)
+    size = 32
+    sourceVoxels = (randomGenerator.rand(size, size, size) * 100).astype(np.float32)
+    sourceVoxels[:, :, size//2:] += 200
+    sourceVoxels[size//2:, :, :] += 400
+    seedVoxels = np.zeros(sourceVoxels.shape, np.uint8)
+    seedVoxels[size//4, size//2, size//4] = 1
+    seedVoxels[size//4, size//2, 3*size//4] = 2
+    seedVoxels[3*size//4, size//4, size//2] = 3
+
+    execute = lambda imageFilter, *inputs: imageFilter.Execute(*inputs)
+    for objectScaleMm in [1.0, 2.0]:
+      featureImage = sitk.GradientMagnitudeRecursiveGaussian(sitk.GetImageFromArray(sourceVoxels), objectScaleMm)
+      expectedVoxels = sitk.GetArrayFromImage(sitk.MorphologicalWatershedFromMarkers(featureImage, sitk.GetImageFromArray(seedVoxels),
+        markWatershedLine=False, fullyConnected=False))
+      for targetNumberOfRegions in [None, 100, 10]:
+        regionGraph = SegmentEditorWatershedLib.WatershedRegionGraph(featureImage, execute, targetNumberOfRegions)
+        if targetNumberOfRegions is not None:
+          self.assertEqual(regionGraph.numberOfRegions, targetNumberOfRegions)
+        labelVoxels = regionGraph.labelRegions(seedVoxels, np.uint8)
+        self.assertEqual(np.count_nonzero(labelVoxels != expectedVoxels), 0,
+          f"Region graph result differs from watershed (object scale={objectScaleMm}, regions={regionGraph.numberOfRegions})")
+
+    self.delayDisplay('test_SegmentEditorWatershedRegionGraph passed')
+
+  def test_SegmentEditorWatershedSlabWise(self):
+    """
+    Compare slab-wise computation to the full resolution watershed computed in a single pass.
+    With a large memory budget the whole region is computed at once. With a small budget the region is segmented
+    at low resolution and then refined in several slabs.
+    """
+    self.delayDisplay("Starting test_SegmentEditorWatershedSlabWise")
+
+    import numpy as np
+    import SimpleITK as sitk
+    import SegmentEditorWatershedLib
+    from vtk.util import numpy_support
+
+    def createImage(voxels):
+      imageData = slicer.vtkOrientedImageData()
+      imageData.SetDimensions(voxels.shape[2], voxels.shape[1], voxels.shape[0])
+      imageData.SetSpacing(0.7, 0.9, 1.3)
+      imageData.GetPointData().SetScalars(numpy_support.numpy_to_vtk(voxels.ravel(), deep=True))
+      return imageData
+
+    # Sphere and a slab with different intensities, with noise
+    shape = (60, 40, 40)
+    randomGenerator = np.random.RandomState(0)
+    k, j, i = np.mgrid[0:shape[0], 0:shape[1], 0:shape[2]]
+    sourceVoxels = np.zeros(shape, np.float32)
+    sourceVoxels[(k-20)**2 + (j-20)**2 + (i-20)**2 < 12**2] = 100
+    sourceVoxels[40:, :, :] += 200
+    sourceVoxels += randomGenerator.rand(*shape).astype(np.float32) * 10
+    seedVoxels = np.zeros(shape, np.uint8)
+    seedVoxels[20, 20, 20] = 1
+    seedVoxels[5, 3, 3] = 2
+    seedVoxels[50, 20, 20] = 3
+    sourceImageData = createImage(sourceVoxels)
+    seedImageData = createImage(seedVoxels)
+    extent = seedImageData.GetExtent()
+    objectScaleMm = 1.0
+
+    computation = SegmentEditorWatershedLib.WatershedPreviewComputation(seedImageData, sourceImageData, extent, objectScaleMm,
+      SegmentEditorWatershedLib.COMPUTATION_MODE_FULL, True)
+    computation.labelType = np.uint8
+    computation.run()
+    self.assertIsNone(computation.errorMessage)
+    expectedVoxels = sitk.GetArrayFromImage(computation.labelImage)
+    self.assertTrue(all(np.count_nonzero(expectedVoxels == label) > 0 for label in [1, 2, 3]))
+
+    for memoryBudgetMegabytes, minimumNumberOfSlabs in [(100, 1), (1, 2)]:
+      computation = SegmentEditorWatershedLib.WatershedPreviewComputation(seedImageData, sourceImageData, extent, objectScaleMm,
+        SegmentEditorWatershedLib.COMPUTATION_MODE_SLABS, True)
+      computation.labelType = np.uint8
+      computation.memoryBudgetBytes = memoryBudgetMegabytes * 1024 * 1024
+      computation.run()
+      self.assertIsNone(computation.errorMessage)
+      if minimumNumberOfSlabs > 1:
+        # Coarse labels are resampled once for each slab
+        self.assertGreaterEqual(computation.stageStatistics["resample"]["calls"], minimumNumberOfSlabs)
+      self.assertEqual(np.count_nonzero(computation.labelVoxels != expectedVoxels), 0,
+        f"Slab-wise result differs from single-pass result (memory budget={memoryBudgetMegabytes} MB)")
+
+    self.delayDisplay('test_SegmentEditorWatershedSlabWise passed')
@@ -1,4 +1,7 @@
 import os
+import math
+import time
+import threading
 import vtk, qt, ctk, slicer
 import logging
 from SegmentEditorEffects import *
@@ -12,6 +15,43 @@ class SegmentEditorEffect(AbstractScriptedSegmentEditorAutoCompleteEffect):
     self.minimumNumberOfSegments = 2
     self.clippedMasterImageDataRequired = True # source volume intensities are used by this effect
     self.growCutFilter = None
+    # Gradient magnitude image computed from the source volume, reused while only the seeds change
+    self.featureImage = None
+    self.featureImageKey = None
+    # Gradient magnitude images at a few object scales (sigma in mm -> image), for quick feedback while changing the object scale
+    self.scaleLevelFeatureImages = {}
+    self.scaleLevelFeatureImagesKey = None
+    # Region where the segmentation is computed when cropping to seeds, only grown when seeds are placed outside of it
+    self.cropExtent = None
+    self.cropExtentKey = None
+    # Background computation of the object scale levels, started when the option is enabled or the source changes
+    self.scaleLevelComputation = None
+    self.scaleLevelComputationTimer = qt.QTimer()
+    self.scaleLevelComputationTimer.interval = 100
+    self.scaleLevelComputationTimer.connect('timeout()', self.onScaleLevelComputationTimer)
+    # Over-segmentation of the feature image and adjacency graph of its regions, for quick preview updates
+    self.regionGraph = None
+    self.regionGraphKey = None
+    # Time and output size of the stages of the last preview computation
+    self.previewStatistics = []
+    # Set to True while a preview is computed that must not be approximated (refinement or apply)
+    self.fullQualityPreviewRequested = False
+    # Set to True if the current preview is an approximate result that still needs to be refined
+    self.previewIsApproximate = False
+    self.previewRefinementTimer = qt.QTimer()
+    self.previewRefinementTimer.setSingleShot(True)
+    self.previewRefinementTimer.interval = 100
+    self.previewRefinementTimer.connect('timeout()', self.onPreviewRefinement)
+    # Set to True while a preview is computed that must be available immediately (apply)
+    self.synchronousPreviewRequested = False
+    # Background computation. Outdated computations are cancelled and abandoned (their results are ignored),
+    # they are not waited for, so that the application remains responsive.
+    self.backgroundComputation = None
+    self.completedBackgroundComputation = None
+    self.lastPreviewLabelmap = None
+    self.backgroundComputationTimer = qt.QTimer()
+    self.backgroundComputationTimer.interval = 100
+    self.backgroundComputationTimer.connect('timeout()', self.onBackgroundComputationTimer)
 
   def clone(self):
     import qSlicerSegmentationsEditorEffectsPythonQt as effects
@@ -39,12 +79,32 @@ updated automatically within a few seconds</li>
 <li>Click <dfn>Apply</dfn> to update segmentation with the previewed result.</li>
 </ul><p>
 The effect is different from the Grow from seeds effect in that smoothness of structures can be defined, which can prevent leakage.<p>
+Enable <dfn>Precompute object scales</dfn> to get quick preview updates while dragging the object scale slider (requires more memory,
+edge detection results are computed in the background at a few object scales when the option is enabled or the source volume is changed).
+Enable <dfn>Crop to seeds</dfn> to compute the segmentation only in the region around the seeds (faster on large volumes).
+Choose <dfn>Progressive</dfn> computation mode to quickly show a low-resolution preview, which is then refined near segment boundaries.
+Choose <dfn>Region graph</dfn> computation mode to update the preview almost instantly when seeds are changed.
+The image is split into small regions once, then seeds are propagated between regions. Voxel-level result is computed when <dfn>Apply</dfn> is clicked.
+Choose <dfn>Slab-wise</dfn> computation mode to process very large volumes in overlapping slabs, within the specified memory budget.
+If <dfn>Compute in background</dfn> is enabled then seeds can be edited while the preview is computed.<p>
 Masking settings are bypassed. If segments overlap, segment higher in the segments table will have priority.
 The effect uses <a href="https://itk.org/Doxygen/html/classitk_1_1MorphologicalWatershedFromMarkersImageFilter.html">watershed method</a>.
 <p></html>"""
 
   def reset(self):
     self.growCutFilter = None
+    self.featureImage = None
+    self.featureImageKey = None
+    self.scaleLevelFeatureImages = {}
+    self.scaleLevelFeatureImagesKey = None
+    self.cropExtent = None
+    self.cropExtentKey = None
+    self.regionGraph = None
+    self.regionGraphKey = None
+    self.previewIsApproximate = False
+    self.cancelBackgroundComputation()
+    self.cancelScaleLevelComputation()
+    self.lastPreviewLabelmap = None
     AbstractScriptedSegmentEditorAutoCompleteEffect.reset(self)
     self.updateGUIFromMRML()
 
@@ -61,10 +121,82 @@ The effect uses <a href="https://itk.org/Doxygen/html/classitk_1_1MorphologicalW
     self.objectScaleMmSlider.setToolTip('Increasing this value smooths the segmentation and reduces leaks. This is the sigma used for edge detection.')
     self.scriptedEffect.addLabeledOptionsWidget("Object scale:", self.objectScaleMmSlider)
     self.objectScaleMmSlider.connect('valueChanged(double)', self.updateAlgorithmParameterFromGUI)
+    self.objectScaleMmSlider.slider().connect('sliderReleased()', self.onObjectScaleSliderReleased)
+
+    self.objectScaleLevelsCheckBox = qt.QCheckBox()
+    self.objectScaleLevelsCheckBox.setToolTip('If checked, edge detection results are precomputed at a few object scales ('
+      + ', '.join(['{0:g}'.format(sigma) for sigma in OBJECT_SCALE_LEVELS_MM]) + ' mm).'
+      ' These are computed in the background when the option is enabled or the source volume is changed.'
+      ' While the object scale slider is dragged, preview is computed by interpolating between these,'
+      ' and the exact result is computed when the slider is released. Object scales outside this range,'
+      ' or before the precomputation is completed, are always computed exactly. Requires additional memory.')
+    self.scriptedEffect.addLabeledOptionsWidget("Precompute object scales:", self.objectScaleLevelsCheckBox)
+    self.objectScaleLevelsCheckBox.connect('toggled(bool)', self.updateAlgorithmParameterFromGUI)
+
+    # Seed-bounded computation
+    self.cropToSeedsCheckBox = qt.QCheckBox()
+    self.cropToSeedsCheckBox.setToolTip('If checked, segmentation is only computed in the bounding box of all seeds, padded by the seed margin.'
+      ' This makes computation much faster and uses less memory when seeds only cover a small part of the volume.'
+      ' The region is only extended (by an additional seed margin) when seeds are painted outside of it,'
+      ' so that edge detection results can be reused while seeds are edited.')
+    self.scriptedEffect.addLabeledOptionsWidget("Crop to seeds:", self.cropToSeedsCheckBox)
+    self.cropToSeedsCheckBox.connect('toggled(bool)', self.updateAlgorithmParameterFromGUI)
+
+    self.seedMarginMmSlider = slicer.qMRMLSliderWidget()
+    self.seedMarginMmSlider.setMRMLScene(slicer.mrmlScene)
+    self.seedMarginMmSlider.quantity = "length"
+    self.seedMarginMmSlider.minimum = 0
+    self.seedMarginMmSlider.maximum = 100
+    self.seedMarginMmSlider.value = 10.0
+    self.seedMarginMmSlider.setToolTip('Size of the region around the seeds where the segmentation is computed when cropping to seeds.')
+    self.scriptedEffect.addLabeledOptionsWidget("Seed margin:", self.seedMarginMmSlider)
+    self.seedMarginMmSlider.connect('valueChanged(double)', self.updateAlgorithmParameterFromGUI)
+
+    # Computation mode
+    self.computationModeSelector = qt.QComboBox()
+    self.computationModeSelector.addItem(COMPUTATION_MODE_FULL)
+    self.computationModeSelector.addItem(COMPUTATION_MODE_PROGRESSIVE)
+    self.computationModeSelector.addItem(COMPUTATION_MODE_SLABS)
+    self.computationModeSelector.addItem(COMPUTATION_MODE_REGION_GRAPH)
+    self.computationModeSelector.setToolTip('Full resolution: compute segmentation at full resolution.\n'
+      'Progressive: show a low-resolution result first, then refine it at full resolution near segment boundaries.'
+      ' Recommended for large volumes.\n'
+      'Slab-wise: compute segmentation in overlapping slabs so that memory usage remains within the memory budget.'
+      ' Recommended for volumes that are too large to be processed at once.\n'
+      'Region graph: split the image into small regions once and propagate seeds between regions.'
+      ' Preview is updated almost instantly when seeds are changed, voxel-level result is computed when Apply is clicked.')
+    self.scriptedEffect.addLabeledOptionsWidget("Computation mode:", self.computationModeSelector)
+    self.computationModeSelector.connect('currentIndexChanged(int)', self.updateAlgorithmParameterFromGUI)
+
+    self.memoryBudgetMbSlider = ctk.ctkSliderWidget()
+    self.memoryBudgetMbSlider.setToolTip('Maximum amount of memory used for slab-wise computation'
+      ' (in addition to the output labelmap and the source volume, which must already be loaded in memory).'
+      ' Larger object scale requires larger memory budget, as slabs are extended by the size of the edge detection kernel.')
+    self.memoryBudgetMbSlider.minimum = 64
+    self.memoryBudgetMbSlider.maximum = 65536
+    self.memoryBudgetMbSlider.value = 2048
+    self.memoryBudgetMbSlider.singleStep = 64
+    self.memoryBudgetMbSlider.pageStep = 1024
+    self.memoryBudgetMbSlider.decimals = 0
+    self.memoryBudgetMbSlider.suffix = " MB"
+    self.scriptedEffect.addLabeledOptionsWidget("Memory budget:", self.memoryBudgetMbSlider)
+    self.memoryBudgetMbSlider.connect('valueChanged(double)', self.updateAlgorithmParameterFromGUI)
+
+    self.backgroundComputationCheckBox = qt.QCheckBox()
+    self.backgroundComputationCheckBox.setToolTip('If checked, preview is computed in the background and the application remains responsive.'
+      ' If seeds are changed during computation then the outdated computation is cancelled.')
+    self.scriptedEffect.addLabeledOptionsWidget("Compute in background:", self.backgroundComputationCheckBox)
+    self.backgroundComputationCheckBox.connect('toggled(bool)', self.updateAlgorithmParameterFromGUI)
 
   def setMRMLDefaults(self):
     AbstractScriptedSegmentEditorAutoCompleteEffect.setMRMLDefaults(self)
     self.scriptedEffect.setParameterDefault("ObjectScaleMm", 2.0)
+    self.scriptedEffect.setParameterDefault("ObjectScaleLevels", 0)
+    self.scriptedEffect.setParameterDefault("CropToSeeds", 0)
+    self.scriptedEffect.setParameterDefault("SeedMarginMm", 10.0)
+    self.scriptedEffect.setParameterDefault("ComputationMode", COMPUTATION_MODE_FULL)
+    self.scriptedEffect.setParameterDefault("MemoryBudgetMb", 2048)
+    self.scriptedEffect.setParameterDefault("BackgroundComputation", 0)
 
   def updateGUIFromMRML(self):
     AbstractScriptedSegmentEditorAutoCompleteEffect.updateGUIFromMRML(self)
@@ -73,9 +205,45 @@ The effect uses <a href="https://itk.org/Doxygen/html/classitk_1_1MorphologicalW
     self.objectScaleMmSlider.value = abs(objectScaleMm)
     self.objectScaleMmSlider.blockSignals(wasBlocked)
 
+    wasBlocked = self.objectScaleLevelsCheckBox.blockSignals(True)
+    self.objectScaleLevelsCheckBox.checked = (self.scriptedEffect.integerParameter("ObjectScaleLevels") != 0)
+    self.objectScaleLevelsCheckBox.blockSignals(wasBlocked)
+
+    cropToSeeds = (self.scriptedEffect.integerParameter("CropToSeeds") != 0)
+    wasBlocked = self.cropToSeedsCheckBox.blockSignals(True)
+    self.cropToSeedsCheckBox.checked = cropToSeeds
+    self.cropToSeedsCheckBox.blockSignals(wasBlocked)
+
+    wasBlocked = self.seedMarginMmSlider.blockSignals(True)
+    self.seedMarginMmSlider.value = abs(self.scriptedEffect.doubleParameter("SeedMarginMm"))
+    self.seedMarginMmSlider.blockSignals(wasBlocked)
+    self.seedMarginMmSlider.enabled = cropToSeeds
+
+    computationMode = self.scriptedEffect.parameter("ComputationMode")
+    wasBlocked = self.computationModeSelector.blockSignals(True)
+    self.computationModeSelector.setCurrentText(computationMode)
+    self.computationModeSelector.blockSignals(wasBlocked)
+
+    wasBlocked = self.memoryBudgetMbSlider.blockSignals(True)
+    self.memoryBudgetMbSlider.value = self.scriptedEffect.doubleParameter("MemoryBudgetMb")
+    self.memoryBudgetMbSlider.blockSignals(wasBlocked)
+    self.memoryBudgetMbSlider.enabled = (computationMode == COMPUTATION_MODE_SLABS)
+
+    wasBlocked = self.backgroundComputationCheckBox.blockSignals(True)
+    self.backgroundComputationCheckBox.checked = (self.scriptedEffect.integerParameter("BackgroundComputation") != 0)
+    self.backgroundComputationCheckBox.blockSignals(wasBlocked)
+
   def updateMRMLFromGUI(self):
     AbstractScriptedSegmentEditorAutoCompleteEffect.updateMRMLFromGUI(self)
     self.scriptedEffect.setParameter("ObjectScaleMm", self.objectScaleMmSlider.value)
+    self.scriptedEffect.setParameter("ObjectScaleLevels", 1 if self.objectScaleLevelsCheckBox.checked else 0)
+    self.scriptedEffect.setParameter("CropToSeeds", 1 if self.cropToSeedsCheckBox.checked else 0)
+    self.scriptedEffect.setParameter("SeedMarginMm", self.seedMarginMmSlider.value)
+    self.seedMarginMmSlider.enabled = self.cropToSeedsCheckBox.checked
+    self.scriptedEffect.setParameter("ComputationMode", self.computationModeSelector.currentText)
+    self.scriptedEffect.setParameter("MemoryBudgetMb", self.memoryBudgetMbSlider.value)
+    self.memoryBudgetMbSlider.enabled = (self.computationModeSelector.currentText == COMPUTATION_MODE_SLABS)
+    self.scriptedEffect.setParameter("BackgroundComputation", 1 if self.backgroundComputationCheckBox.checked else 0)
 
   def updateAlgorithmParameterFromGUI(self):
     self.updateMRMLFromGUI()
@@ -84,52 +252,1130 @@ The effect uses <a href="https://itk.org/Doxygen/html/classitk_1_1MorphologicalW
     if self.getPreviewNode():
       self.delayedAutoUpdateTimer.start()
 
+  def onObjectScaleSliderReleased(self):
+    # Preview may have been computed from precomputed object scales while dragging, compute exact result now
+    if self.getPreviewNode() and self.previewIsApproximate:
+      self.delayedAutoUpdateTimer.start()
+
+  def isObjectScaleChanging(self):
+    return self.objectScaleMmSlider.slider().isSliderDown()
+
   def computePreviewLabelmap(self, mergedImage, outputLabelmap):
 
-    import vtkSegmentationCorePython as vtkSegmentationCore
-    import vtkSlicerSegmentationsModuleLogicPython as vtkSlicerSegmentationsModuleLogic
+    if self.completedBackgroundComputation is not None:
+      # Background computation has just been completed, show its result
+      computation = self.completedBackgroundComputation
+      self.completedBackgroundComputation = None
+      self.setPreviewLabelmapFromComputation(computation, outputLabelmap)
+      return
+
+    sourceVolumeNode = self.scriptedEffect.parameterSetNode().GetSourceVolumeNode()
+    sourceImageData = self.scriptedEffect.sourceVolumeImageData()
+    sourceImageKey = (
+      sourceVolumeNode.GetID() if sourceVolumeNode else None,
+      sourceImageData.GetMTime() if sourceImageData else 0)
+
+    outputExtent = mergedImage.GetExtent()
+    if self.scriptedEffect.integerParameter("CropToSeeds") != 0:
+      # Only compute segmentation around the seeds, output labelmap is cropped to this region
+      cropExtent = self.getCropExtent(mergedImage, self.scriptedEffect.doubleParameter("SeedMarginMm"), sourceImageKey)
+      if cropExtent is not None:
+        outputExtent = cropExtent
+
+    # Reuse gradient magnitude image if only the seeds changed
+    objectScaleMm = float(self.scriptedEffect.doubleParameter("ObjectScaleMm"))
+    sourceKey = sourceImageKey + (tuple(outputExtent),)
+    featureImageKey = sourceKey + (objectScaleMm,)
+    if self.featureImageKey != featureImageKey:
+      # Release previous image before computing the new one to reduce peak memory usage
+      self.featureImage = None
+      self.featureImageKey = None
+    computationMode = self.scriptedEffect.parameter("ComputationMode")
+    useScaleLevels = (self.scriptedEffect.integerParameter("ObjectScaleLevels") != 0
+      and computationMode not in [COMPUTATION_MODE_SLABS, COMPUTATION_MODE_REGION_GRAPH])
+    if self.scaleLevelFeatureImagesKey != sourceKey or not useScaleLevels:
+      self.scaleLevelFeatureImages = {}
+      self.scaleLevelFeatureImagesKey = None
+    if useScaleLevels and self.scaleLevelFeatureImagesKey is None:
+      self.startScaleLevelComputation(mergedImage, outputExtent, sourceKey)
+    elif not useScaleLevels:
+      self.cancelScaleLevelComputation()
+
+    if computationMode == COMPUTATION_MODE_SLABS:
+      # Gradient is computed slab by slab, a full-size gradient image must not be kept in memory
+      self.featureImage = None
+      self.featureImageKey = None
+    computation = WatershedPreviewComputation(mergedImage, self.clippedMasterImageData, outputExtent,
+      objectScaleMm, computationMode, self.fullQualityPreviewRequested,
+      self.featureImage, featureImageKey)
+    computation.memoryBudgetBytes = self.scriptedEffect.doubleParameter("MemoryBudgetMb") * 1024 * 1024
+    # Label value of each segment is its index in the selected segment list + 1
+    computation.labelType = SegmentEditorEffect.getCompactLabelType(self.selectedSegmentIds.GetNumberOfValues())
+    if computationMode == COMPUTATION_MODE_REGION_GRAPH:
+      if self.regionGraphKey != featureImageKey:
+        self.regionGraph = None
+        self.regionGraphKey = None
+      computation.regionGraph = self.regionGraph
+    else:
+      # Release memory used by the region graph
+      self.regionGraph = None
+      self.regionGraphKey = None
+    if self.scaleLevelFeatureImagesKey is not None and not self.fullQualityPreviewRequested and self.isObjectScaleChanging():
+      # Object scale slider is being dragged, use gradient images precomputed at a few object scales
+      computation.scaleLevelFeatureImages = self.scaleLevelFeatureImages
+
+    if self.scriptedEffect.integerParameter("BackgroundComputation") != 0 and not self.synchronousPreviewRequested:
+      self.startBackgroundComputation(computation)
+      # Keep showing the last result (or the seeds, if there is no result yet) until the new result is available
+      outputLabelmap.ShallowCopy(self.lastPreviewLabelmap if self.lastPreviewLabelmap is not None else mergedImage)
+      self.previewIsApproximate = True
+      return
+
+    # Computation may still run in the background, stop it to not compete for memory and CPU
+    self.cancelBackgroundComputation()
 
     # This can be a long operation - indicate it to the user
     qt.QApplication.setOverrideCursor(qt.Qt.WaitCursor)
+    try:
+      computation.run()
+    finally:
+      qt.QApplication.restoreOverrideCursor()
+    self.setPreviewLabelmapFromComputation(computation, outputLabelmap)
 
-    sourceVolumeNode = slicer.vtkMRMLScalarVolumeNode()
-    slicer.mrmlScene.AddNode(sourceVolumeNode)
-    slicer.vtkSlicerSegmentationsModuleLogic.CopyOrientedImageDataToVolumeNode(self.clippedMasterImageData, sourceVolumeNode)
+  def setPreviewLabelmapFromComputation(self, computation, outputLabelmap):
+    if computation.featureImage is not None:
+      self.featureImage = computation.featureImage
+      self.featureImageKey = computation.featureImageKey
+    if computation.regionGraph is not None:
+      self.regionGraph = computation.regionGraph
+      self.regionGraphKey = computation.featureImageKey
+    startTime = time.perf_counter()
+    if computation.labelImage is not None:
+      # Pass result from SimpleITK to Slicer. The output labelmap uses the SimpleITK image buffer directly.
+      SegmentEditorEffect.sitkImageToOrientedImageData(computation.labelImage, outputLabelmap,
+        computation.imageToWorldMatrix, computation.extent)
+    elif computation.labelVoxels is not None:
+      SegmentEditorEffect.arrayToOrientedImageData(computation.labelVoxels, outputLabelmap,
+        computation.imageToWorldMatrix, computation.extent)
+    else:
+      raise RuntimeError("Watershed computation failed: {0}".format(computation.errorMessage))
+    computation.recordStage("write back", startTime)
+    self.previewStatistics = computation.getStageStatistics()
+    for stage in self.previewStatistics:
+      logging.debug("Watershed preview {0}: {1:.3f} s ({2} calls), output size {3:.1f} MB".format(
+        stage["name"], stage["seconds"], stage["calls"], stage["outputBytes"] / 1024.0**2))
+    self.lastPreviewLabelmap = slicer.vtkOrientedImageData()
+    self.lastPreviewLabelmap.ShallowCopy(outputLabelmap)
+    self.previewIsApproximate = computation.approximate
+    if computation.approximate and computation.computationMode != COMPUTATION_MODE_REGION_GRAPH:
+      # Region graph result is only refined when the result is applied, to keep seed editing responsive
+      self.previewRefinementTimer.start()
 
-    mergedLabelmapNode = slicer.vtkMRMLLabelMapVolumeNode()
-    slicer.mrmlScene.AddNode(mergedLabelmapNode)
-    slicer.vtkSlicerSegmentationsModuleLogic.CopyOrientedImageDataToVolumeNode(mergedImage, mergedLabelmapNode)
+  def getPreviewStatistics(self):
+    """Get time and output size of each stage of the last preview computation.
+    Returns a list of dicts (in the order the stages were first executed), each containing:
+    name, seconds (total wall time), calls (number of times the stage was executed),
+    outputBytes (output size: largest size of the image or array produced by the stage).
+    Output size is not the memory used by the process (temporary buffers of filters are not included),
+    it is the memory that the stage adds while its output is kept.
+    """
+    return self.previewStatistics
 
-    outputRasToIjk = vtk.vtkMatrix4x4()
-    mergedImage.GetImageToWorldMatrix(outputRasToIjk)
-    outputExtent = mergedImage.GetExtent()
+  def startBackgroundComputation(self, computation):
+    # Only the newest request matters: abandon the running computation and start this one right away
+    self.cancelBackgroundComputation()
+    self.backgroundComputation = computation
+    thread = threading.Thread(target=computation.run)
+    thread.daemon = True
+    thread.start()
+    self.backgroundComputationTimer.start()
+
+  def cancelBackgroundComputation(self):
+    self.backgroundComputationTimer.stop()
+    self.completedBackgroundComputation = None
+    if self.backgroundComputation is not None:
+      # The worker thread stops when the currently executed filter is aborted, its result is not used
+      self.backgroundComputation.cancel()
+      self.backgroundComputation = None
+
+  def onBackgroundComputationTimer(self):
+    computation = self.backgroundComputation
+    if computation is None:
+      self.backgroundComputationTimer.stop()
+      return
+    if not computation.finished.is_set():
+      return
+    self.backgroundComputation = None
+    self.backgroundComputationTimer.stop()
+    if computation.cancelled or not self.getPreviewNode():
+      return
+    if computation.errorMessage is not None:
+      # Exceptions must not be raised from a timer callback: report the error and remove the outdated preview
+      logging.error("Watershed computation failed: {0}".format(computation.errorMessage))
+      self.reset()
+      return
+    # Update the preview on the main thread, using the result of the computation
+    self.completedBackgroundComputation = computation
+    try:
+      self.preview()
+    finally:
+      self.completedBackgroundComputation = None
+
+  def startScaleLevelComputation(self, mergedImage, extent, sourceKey):
+    """Compute gradient images at all object scale levels in a worker thread, unless they are already being computed"""
+    if self.scaleLevelComputation is not None:
+      if self.scaleLevelComputation.scaleLevelFeatureImagesKey == sourceKey:
+        return
+      self.cancelScaleLevelComputation()
+    computation = WatershedPreviewComputation(mergedImage, self.clippedMasterImageData, extent,
+      float(self.scriptedEffect.doubleParameter("ObjectScaleMm")), self.scriptedEffect.parameter("ComputationMode"), False)
+    computation.scaleLevelFeatureImages = {}
+    computation.scaleLevelFeatureImagesKey = sourceKey
+    self.scaleLevelComputation = computation
+    thread = threading.Thread(target=computation.run)
+    thread.daemon = True
+    thread.start()
+    self.scaleLevelComputationTimer.start()
+
+  def cancelScaleLevelComputation(self):
+    self.scaleLevelComputationTimer.stop()
+    if self.scaleLevelComputation is not None:
+      # The worker thread stops when the currently executed filter is aborted, its result is not used
+      self.scaleLevelComputation.cancel()
+      self.scaleLevelComputation = None
+
+  def onScaleLevelComputationTimer(self):
+    computation = self.scaleLevelComputation
+    if computation is None:
+      self.scaleLevelComputationTimer.stop()
+      return
+    if not computation.finished.is_set():
+      return
+    self.scaleLevelComputation = None
+    self.scaleLevelComputationTimer.stop()
+    if computation.cancelled:
+      return
+    if computation.errorMessage is not None:
+      logging.error("Watershed object scale precomputation failed: {0}".format(computation.errorMessage))
+      return
+    self.scaleLevelFeatureImages = computation.scaleLevelFeatureImages
+    self.scaleLevelFeatureImagesKey = computation.scaleLevelFeatureImagesKey
+
+  def onPreviewRefinement(self):
+    if not self.previewIsApproximate or not self.getPreviewNode():
+      return
+    if self.delayedAutoUpdateTimer.isActive() or self.backgroundComputation is not None or self.isObjectScaleChanging():
+      # Inputs are still being changed or a computation is in progress, a new preview will be computed anyway
+      return
+    self.fullQualityPreviewRequested = True
+    try:
+      self.preview()
+    finally:
+      self.fullQualityPreviewRequested = False
+
+  def onApply(self):
+    # Make sure that the final (not an approximate or outdated) result is applied
+    self.previewRefinementTimer.stop()
+    self.fullQualityPreviewRequested = True
+    self.synchronousPreviewRequested = True
+    try:
+      if self.previewIsApproximate and not self.delayedAutoUpdateTimer.isActive():
+        self.preview()
+      AbstractScriptedSegmentEditorAutoCompleteEffect.onApply(self)
+    finally:
+      self.fullQualityPreviewRequested = False
+      self.synchronousPreviewRequested = False
+
+  def getCropExtent(self, mergedImage, marginMm, sourceImageKey):
+    """Get extent of the region where the segmentation is computed when cropping to seeds.
+    The region contains all seeds, padded by the specified margin. It is only grown (by an additional margin)
+    when seeds are placed outside of it, so that the gradient image computed for the region can be reused
+    while seeds are edited. Returns None if there are no seeds.
+    """
+    seedExtent = SegmentEditorEffect.getSeedBoundingExtent(mergedImage, marginMm)
+    if seedExtent is None:
+      return None
+    cropExtentKey = sourceImageKey + (tuple(mergedImage.GetExtent()), marginMm)
+    if self.cropExtentKey != cropExtentKey or self.cropExtent is None:
+      self.cropExtent = seedExtent
+      self.cropExtentKey = cropExtentKey
+      return self.cropExtent
+    if all(self.cropExtent[axis*2] <= seedExtent[axis*2] and seedExtent[axis*2+1] <= self.cropExtent[axis*2+1] for axis in range(3)):
+      return self.cropExtent
+    # Seeds are outside the current region: grow it with some extra margin to not need to grow it again at the next seed change
+    paddedSeedExtent = SegmentEditorEffect.getSeedBoundingExtent(mergedImage, 2 * marginMm)
+    self.cropExtent = [
+      min(self.cropExtent[i], paddedSeedExtent[i]) if i % 2 == 0 else max(self.cropExtent[i], paddedSeedExtent[i])
+      for i in range(6)]
+    return self.cropExtent
+
+  @staticmethod
+  def getSeedBoundingExtent(mergedImage, marginMm):
+    """Get extent of all non-empty voxels of the merged seed labelmap, padded by the specified margin.
+    Returns None if there are no seeds.
+    """
+    import numpy as np
+    seeds = SegmentEditorEffect.orientedImageDataToArray(mergedImage)
+    imageExtent = mergedImage.GetExtent()
+    spacing = mergedImage.GetSpacing()
+    seedExtent = [0, -1, 0, -1, 0, -1]
+    # Array axes are in KJI order
+    for axis, otherAxes in enumerate([(0, 1), (0, 2), (1, 2)]):
+      nonEmptyIndices = np.flatnonzero(np.any(seeds, axis=otherAxes))
+      if len(nonEmptyIndices) == 0:
+        return None
+      marginVoxels = int(math.ceil(marginMm / spacing[axis]))
+      seedExtent[axis*2] = max(imageExtent[axis*2], imageExtent[axis*2]+int(nonEmptyIndices[0])-marginVoxels)
+      seedExtent[axis*2+1] = min(imageExtent[axis*2+1], imageExtent[axis*2]+int(nonEmptyIndices[-1])+marginVoxels)
+    return seedExtent
+
+  @staticmethod
+  def orientedImageDataToArray(imageData, extent=None):
+    """Get a NumPy view (KJI axis order) of the scalars of an image, optionally restricted to a sub-extent.
+    No voxel data is copied.
+    """
+    from vtk.util import numpy_support
+    imageExtent = imageData.GetExtent()
+    dimensions = [imageExtent[1]-imageExtent[0]+1, imageExtent[3]-imageExtent[2]+1, imageExtent[5]-imageExtent[4]+1]
+    numberOfComponents = imageData.GetNumberOfScalarComponents()
+    voxels = numpy_support.vtk_to_numpy(imageData.GetPointData().GetScalars())
+    if numberOfComponents > 1:
+      voxels = voxels.reshape(dimensions[2], dimensions[1], dimensions[0], numberOfComponents)
+    else:
+      voxels = voxels.reshape(dimensions[2], dimensions[1], dimensions[0])
+    if extent is not None:
+      voxels = voxels[
+        extent[4]-imageExtent[4]:extent[5]-imageExtent[4]+1,
+        extent[2]-imageExtent[2]:extent[3]-imageExtent[2]+1,
+        extent[0]-imageExtent[0]:extent[1]-imageExtent[0]+1]
+    return voxels
+
+  @staticmethod
+  def getSitkImageGeometry(imageData, extent=None):
+    """Get origin, spacing, and direction of a SimpleITK image that contains the specified extent of an image.
+    Geometry is converted from RAS to LPS. Origin is the position of the first voxel of the extent (not the IJK=0 voxel).
+    """
+    if extent is None:
+      extent = imageData.GetExtent()
+    imageToWorldMatrix = vtk.vtkMatrix4x4()
+    imageData.GetImageToWorldMatrix(imageToWorldMatrix)
+    originRas = imageToWorldMatrix.MultiplyPoint([extent[0], extent[2], extent[4], 1.0])
+    directionMatrix = vtk.vtkMatrix4x4()
+    imageData.GetDirectionMatrix(directionMatrix)
+    rasToLps = [-1.0, -1.0, 1.0]
+    origin = [originRas[row]*rasToLps[row] for row in range(3)]
+    direction = [directionMatrix.GetElement(row, column)*rasToLps[row] for row in range(3) for column in range(3)]
+    return origin, list(imageData.GetSpacing()), direction
+
+  @staticmethod
+  def getCompactLabelType(maximumLabelValue):
+    """Get the smallest NumPy integer type that can store label values from 0 to maximumLabelValue.
+    The maximum value of the type is not used as label value, so that it can be used as a special value.
+    """
+    import numpy as np
+    for labelType in [np.uint8, np.uint16]:
+      if maximumLabelValue < np.iinfo(labelType).max:
+        return labelType
+    return np.int32
+
+  @staticmethod
+  def shrinkArray(voxels, shrinkFactor, labelmap=False):
+    """Downsample a NumPy array (KJI axis order) by combining each block of shrinkFactor^3 voxels into one voxel.
+    Blocks at the end of each axis may be smaller, so that the shrunk array covers all voxels of the input.
+    If labelmap is True then the maximum label value of each block is used, therefore labels are never
+    mixed and a label is only lost if it shares all its blocks with higher labels. Otherwise the mean of each block is used.
+    Blocks of shrinkFactor slices are reduced one at a time, so that temporary arrays are not larger than one block.
+    """
+    import numpy as np
+    shrunkShape = [(size + shrinkFactor - 1) // shrinkFactor for size in voxels.shape[:3]] + list(voxels.shape[3:])
+    shrunkVoxels = np.empty(shrunkShape, dtype=(voxels.dtype if labelmap else np.float32))
+    for shrunkSliceIndex in range(shrunkShape[0]):
+      blockVoxels = voxels[shrunkSliceIndex * shrinkFactor:(shrunkSliceIndex + 1) * shrinkFactor]
+      for axis in range(3):
+        blockStarts = np.arange(0, blockVoxels.shape[axis], shrinkFactor)
+        if labelmap:
+          blockVoxels = np.maximum.reduceat(blockVoxels, blockStarts, axis=axis)
+        else:
+          blockSizes = np.diff(np.append(blockStarts, blockVoxels.shape[axis])).astype(np.float32)
+          blockSizesShape = [1] * blockVoxels.ndim
+          blockSizesShape[axis] = len(blockSizes)
+          blockVoxels = np.add.reduceat(blockVoxels, blockStarts, axis=axis, dtype=np.float32) / blockSizes.reshape(blockSizesShape)
+      shrunkVoxels[shrunkSliceIndex] = blockVoxels[0]
+    return shrunkVoxels
+
+  @staticmethod
+  def arrayToSitkImage(voxels, geometry, shrinkFactor=1, dtype=None, labelmap=False):
+    """Get a SimpleITK image from a NumPy array (KJI axis order) and geometry returned by getSitkImageGeometry.
+    If shrinkFactor is larger than 1 then the image is downsampled using shrinkArray (block maximum if labelmap
+    is True, block mean otherwise). Origin of the downsampled image is in the center of the first block.
+    If dtype is specified then voxels are converted to that type.
+    The only copy made is the single contiguous buffer copy performed by SimpleITK when it imports the array
+    (and the conversion, if the voxels are not already of the requested type).
+    """
+    import SimpleITK as sitk
+    origin, spacing, direction = geometry
+    if shrinkFactor > 1:
+      voxels = SegmentEditorEffect.shrinkArray(voxels, shrinkFactor, labelmap)
+      # Shift the origin to the center of the first block, so that voxel positions are consistent with the full resolution image
+      originShift = [spacing[column] * (shrinkFactor - 1) / 2.0 for column in range(3)]
+      origin = [origin[row] + sum([direction[row*3+column] * originShift[column] for column in range(3)]) for row in range(3)]
+    if dtype is not None:
+      voxels = voxels.astype(dtype, copy=False)
+    image = sitk.GetImageFromArray(voxels, isVector=(voxels.ndim > 3))
+    image.SetOrigin(origin)
+    image.SetSpacing([componentSpacing*shrinkFactor for componentSpacing in spacing])
+    image.SetDirection(direction)
+    return image
+
+  @staticmethod
+  def orientedImageDataToSitkImage(imageData, extent=None, shrinkFactor=1, labelmap=False):
+    """Get a SimpleITK image from vtkOrientedImageData, with geometry converted from RAS to LPS.
+    If extent is specified then only that region of the image is converted.
+    If shrinkFactor is larger than 1 then the image is downsampled (see arrayToSitkImage).
+    Voxels are accessed through a NumPy view of the VTK scalars, therefore the only copy made
+    is the single contiguous buffer copy performed by SimpleITK when it imports the array.
+    """
+    voxels = SegmentEditorEffect.orientedImageDataToArray(imageData, extent)
+    geometry = SegmentEditorEffect.getSitkImageGeometry(imageData, extent)
+    return SegmentEditorEffect.arrayToSitkImage(voxels, geometry, shrinkFactor, labelmap=labelmap)
+
+  @staticmethod
+  def sitkImageToOrientedImageData(sitkImage, outputImageData, imageToWorldMatrix, extent):
+    """Set a SimpleITK image as content of a vtkOrientedImageData without copying the voxels.
+    The output scalars reference the SimpleITK image buffer, which is kept alive by the scalar array.
+    """
+    import SimpleITK as sitk
+    voxels = sitk.GetArrayViewFromImage(sitkImage)
+    # The NumPy view does not hold a reference to the image, so the array must keep the image alive
+    SegmentEditorEffect.arrayToOrientedImageData(voxels, outputImageData, imageToWorldMatrix, extent, sitkImage)
+
+  @staticmethod
+  def arrayToOrientedImageData(voxels, outputImageData, imageToWorldMatrix, extent, bufferOwner=None):
+    """Set a contiguous NumPy array (KJI axis order) as content of a vtkOrientedImageData without copying the voxels.
+    If the array does not own its memory then the owner object can be specified, which is kept alive by the scalar array.
+    """
+    from vtk.util import numpy_support
+    scalars = numpy_support.numpy_to_vtk(voxels.reshape(voxels.shape[0]*voxels.shape[1]*voxels.shape[2], -1), deep=False)
+    if bufferOwner is not None:
+      scalars._bufferOwnerReference = bufferOwner
+    outputImageData.Initialize()
+    outputImageData.SetExtent(extent)
+    outputImageData.GetPointData().SetScalars(scalars)
+    outputImageData.SetImageToWorldMatrix(imageToWorldMatrix)
+
+
+class WatershedPreviewComputation:
+  """Compute watershed segmentation preview from seeds and source volume using SimpleITK.
+
+  Inputs are captured as NumPy views of the VTK image data when the object is created, therefore run()
+  does not access VTK, MRML, or Qt objects and can be called from a worker thread.
+  A running computation can be cancelled from any thread, which aborts the currently executed ITK filter.
+  """
+
+  def __init__(self, seedImageData, sourceImageData, extent, objectScaleMm, computationMode, fullQuality,
+    featureImage=None, featureImageKey=None):
+    import numpy as np
+    self.extent = list(extent)
+    self.imageToWorldMatrix = vtk.vtkMatrix4x4()
+    seedImageData.GetImageToWorldMatrix(self.imageToWorldMatrix)
+    self.geometry = SegmentEditorEffect.getSitkImageGeometry(seedImageData, extent)
+    self.seedVoxels = SegmentEditorEffect.orientedImageDataToArray(seedImageData, extent)
+    self.sourceVoxels = SegmentEditorEffect.orientedImageDataToArray(sourceImageData, extent)
+    self.objectScaleMm = objectScaleMm
+    self.computationMode = computationMode
+    self.fullQuality = fullQuality
+    # Memory used by slab-wise computation
+    self.memoryBudgetBytes = 2048 * 1024 * 1024
+    # NumPy type of marker and output label images
+    self.labelType = np.int16
+    # Gradient magnitude image. If it is not provided then it is computed and kept here so that it can be reused.
+    self.featureImage = featureImage
+    self.featureImageKey = featureImageKey
+    # Gradient images at object scale levels (sigma in mm -> image). If specified then gradient at the requested
+    # object scale is interpolated from these. If scaleLevelFeatureImagesKey is specified then only the
+    # missing levels are computed (and no segmentation is computed).
+    self.scaleLevelFeatureImages = None
+    self.scaleLevelFeatureImagesKey = None
+    # Region adjacency graph of the over-segmented feature image. It is computed and kept here if not provided.
+    self.regionGraph = None
+    # Outputs (result is either stored in a SimpleITK image or in a NumPy array)
+    self.labelImage = None
+    self.labelVoxels = None
+    self.approximate = False
+    self.errorMessage = None
+    # Time and output size of each stage (stage name -> statistics)
+    self.stageStatistics = {}
+    # State
+    self.cancelled = False
+    self.finished = threading.Event()
+    self.currentFilter = None
+    # Protects cancelled and currentFilter, which are accessed from the main and the worker thread
+    self.lock = threading.Lock()
+
+  def run(self):
+    try:
+      if self.scaleLevelFeatureImagesKey is not None:
+        for level in OBJECT_SCALE_LEVELS_MM:
+          if level not in self.scaleLevelFeatureImages:
+            self.scaleLevelFeatureImages[level] = self.computeFeatureImage(1, level)
+        return
+      if self.computationMode == COMPUTATION_MODE_SLABS:
+        self.labelVoxels = self.computeSlabWiseWatershed()
+        return
+      if self.computationMode == COMPUTATION_MODE_REGION_GRAPH and not self.fullQuality:
+        if self.regionGraph is None:
+          featureImage = self.getFeatureImage()
+          startTime = time.perf_counter()
+          self.regionGraph = WatershedRegionGraph(featureImage, self.execute)
+          self.recordStage("region graph", startTime, self.regionGraph.regionVoxels)
+        startTime = time.perf_counter()
+        self.labelVoxels = self.regionGraph.labelRegions(self.seedVoxels, self.labelType)
+        self.recordStage("region labeling", startTime, self.labelVoxels)
+        self.approximate = True
+        return
+      startTime = time.perf_counter()
+      seedImage = SegmentEditorEffect.arrayToSitkImage(self.seedVoxels, self.geometry, dtype=self.labelType)
+      self.recordStage("copy in", startTime, seedImage)
+      # Pixel type of watershed output is the same as the marker image, therefore no conversion is needed
+      if self.computationMode == COMPUTATION_MODE_PROGRESSIVE:
+        self.computeProgressiveWatershed(seedImage)
+      else:
+        self.labelImage = self.runMarkerWatershed(self.getFeatureImage(), seedImage)
+    except Exception as e:
+      if not self.cancelled:
+        self.errorMessage = str(e)
+    finally:
+      self.finished.set()
+
+  def recordStage(self, name, startTime, output=None):
+    """Add time elapsed since startTime (obtained by time.perf_counter()) and the size of output
+    (SimpleITK image or NumPy array) to the statistics of the named stage.
+    """
+    import numpy as np
+    elapsedTime = time.perf_counter() - startTime
+    if output is None:
+      outputBytes = 0
+    elif isinstance(output, np.ndarray):
+      outputBytes = output.nbytes
+    else:
+      outputBytes = output.GetNumberOfPixels() * output.GetNumberOfComponentsPerPixel() * output.GetSizeOfPixelComponent()
+    statistics = self.stageStatistics.setdefault(name, {"name": name, "seconds": 0.0, "calls": 0, "outputBytes": 0})
+    statistics["seconds"] += elapsedTime
+    statistics["calls"] += 1
+    statistics["outputBytes"] = max(statistics["outputBytes"], outputBytes)
+
+  def getStageStatistics(self):
+    return list(self.stageStatistics.values())
+
+  def cancel(self):
+    with self.lock:
+      self.cancelled = True
+      if self.currentFilter is not None:
+        self.currentFilter.Abort()
+
+  def execute(self, imageFilter, *inputs):
+    import SimpleITK as sitk
+    with self.lock:
+      if self.cancelled:
+        raise RuntimeError("Computation cancelled")
+      self.currentFilter = imageFilter
+    # Abort() has no effect if it is called before the filter starts and the abort flag is reset when the filter starts,
+    # therefore the filter also checks if the computation is cancelled when it reports progress
+    imageFilter.AddCommand(sitk.sitkProgressEvent, lambda: imageFilter.Abort() if self.cancelled else None)
+    try:
+      return imageFilter.Execute(*inputs)
+    finally:
+      with self.lock:
+        self.currentFilter = None
+
+  def getFeatureImage(self):
+    if self.featureImage is not None:
+      return self.featureImage
+    if self.scaleLevelFeatureImages is not None:
+      return self.getInterpolatedFeatureImage()
+    self.featureImage = self.computeFeatureImage(1)
+    return self.featureImage
 
-    # Run segmentation algorithm
+  def computeFeatureImage(self, shrinkFactor, objectScaleMm=None):
+    import SimpleITK as sitk
+    startTime = time.perf_counter()
+    sourceImage = SegmentEditorEffect.arrayToSitkImage(self.sourceVoxels, self.geometry, shrinkFactor)
+    self.recordStage("copy in", startTime, sourceImage)
+    startTime = time.perf_counter()
+    gradientFilter = sitk.GradientMagnitudeRecursiveGaussianImageFilter()
+    gradientFilter.SetSigma(self.objectScaleMm if objectScaleMm is None else objectScaleMm)
+    featureImage = self.execute(gradientFilter, sourceImage)
+    self.recordStage("gradient", startTime, featureImage)
+    return featureImage
+
+  def getInterpolatedFeatureImage(self):
+    """Get gradient image at the requested object scale by interpolating between the two nearest object scale levels.
+    Interpolation is linear in log(sigma). Object scales outside the range of levels are computed exactly,
+    as extrapolation would not be accurate.
+    """
+    if not (OBJECT_SCALE_LEVELS_MM[0] <= self.objectScaleMm <= OBJECT_SCALE_LEVELS_MM[-1]):
+      self.featureImage = self.computeFeatureImage(1)
+      return self.featureImage
+    lowerLevel = max([level for level in OBJECT_SCALE_LEVELS_MM if level <= self.objectScaleMm])
+    upperLevel = min([level for level in OBJECT_SCALE_LEVELS_MM if level >= self.objectScaleMm])
+    if lowerLevel == upperLevel:
+      return self.scaleLevelFeatureImages[lowerLevel]
+    self.approximate = True
+    startTime = time.perf_counter()
+    weight = (math.log(self.objectScaleMm) - math.log(lowerLevel)) / (math.log(upperLevel) - math.log(lowerLevel))
+    featureImage = self.scaleLevelFeatureImages[lowerLevel] * (1.0 - weight) + self.scaleLevelFeatureImages[upperLevel] * weight
+    self.recordStage("gradient interpolation", startTime, featureImage)
+    return featureImage
+
+  def runMarkerWatershed(self, featureImage, markerImage):
     import SimpleITK as sitk
-    import sitkUtils
-    # Read input data from Slicer into SimpleITK
-    labelImage = sitk.ReadImage(sitkUtils.GetSlicerITKReadWriteAddress(mergedLabelmapNode.GetName()))
-    backgroundImage = sitk.ReadImage(sitkUtils.GetSlicerITKReadWriteAddress(sourceVolumeNode.GetName()))
-    # Run watershed filter
-    featureImage = sitk.GradientMagnitudeRecursiveGaussian(backgroundImage, float(self.scriptedEffect.doubleParameter("ObjectScaleMm")))
-    del backgroundImage
     f = sitk.MorphologicalWatershedFromMarkersImageFilter()
     f.SetMarkWatershedLine(False)
     f.SetFullyConnected(False)
-    labelImage = f.Execute(featureImage, labelImage)
-    del featureImage
-    # Pixel type of watershed output is the same as the input. Convert it to int16 now.
-    if labelImage.GetPixelID() != sitk.sitkInt16:
-      labelImage = sitk.Cast(labelImage, sitk.sitkInt16)
-    # Write result from SimpleITK to Slicer. This currently performs a deep copy of the bulk data.
-    sitk.WriteImage(labelImage, sitkUtils.GetSlicerITKReadWriteAddress(mergedLabelmapNode.GetName()))
-
-    # Update segmentation from labelmap node and remove temporary nodes
-    outputLabelmap.ShallowCopy(mergedLabelmapNode.GetImageData())
-    outputLabelmap.SetImageToWorldMatrix(outputRasToIjk)
-    outputLabelmap.SetExtent(outputExtent)
-
-    slicer.mrmlScene.RemoveNode(sourceVolumeNode)
-    slicer.mrmlScene.RemoveNode(mergedLabelmapNode)
-
-    qt.QApplication.restoreOverrideCursor()
+    startTime = time.perf_counter()
+    labelImage = self.execute(f, featureImage, markerImage)
+    self.recordStage("watershed", startTime, labelImage)
+    return labelImage
+
+  def computeProgressiveWatershed(self, seedImage):
+    """Compute watershed at low resolution, then refine it at full resolution near the boundaries of the segments.
+    Unless full quality is requested, only the low-resolution result is computed (and stored in labelImage),
+    so that the user gets quick feedback. The refined result is stored in labelVoxels.
+    """
+    import SimpleITK as sitk
+    numberOfVoxels = self.seedVoxels.size
+    shrinkFactor = 2 if numberOfVoxels <= PROGRESSIVE_LARGE_VOLUME_NUMBER_OF_VOXELS else 4
+
+    # Coarse segmentation. Seeds are downsampled using block maximum, so that thin seeds are not lost,
+    # source volume is downsampled using block mean.
+    startTime = time.perf_counter()
+    coarseSeedImage = SegmentEditorEffect.arrayToSitkImage(self.seedVoxels, self.geometry, shrinkFactor, self.labelType, labelmap=True)
+    self.recordStage("copy in", startTime, coarseSeedImage)
+    coarseFeatureImage = self.computeFeatureImage(shrinkFactor)
+    coarseLabelImage = self.runMarkerWatershed(coarseFeatureImage, coarseSeedImage)
+    del coarseFeatureImage
+    startTime = time.perf_counter()
+    resampleFilter = sitk.ResampleImageFilter()
+    resampleFilter.SetReferenceImage(seedImage)
+    resampleFilter.SetInterpolator(sitk.sitkNearestNeighbor)
+    resampleFilter.SetOutputPixelType(seedImage.GetPixelID())
+    coarseLabelImage = self.execute(resampleFilter, coarseLabelImage)
+    self.recordStage("resample", startTime, coarseLabelImage)
+
+    if not self.fullQuality:
+      self.approximate = True
+      self.labelImage = coarseLabelImage
+      return
+
+    # Refinement at full resolution. Gradient is only computed around the band, unless it is already available.
+    self.labelVoxels = self.refineWatershedNearBoundaries(self.seedVoxels, coarseLabelImage, shrinkFactor,
+      self.featureImage, self.sourceVoxels)
+
+  def refineWatershedNearBoundaries(self, seedVoxels, coarseLabelImage, bandRadius, featureImage=None, sourceVoxels=None):
+    """Recompute watershed in a narrow band around the boundaries of the coarse segmentation.
+    Outside the band the coarse labels are used as markers, therefore flooding is limited to the band.
+    Original seeds are always kept.
+
+    Connected components of the band are separated from each other by marker voxels, therefore they are
+    flooded independently: watershed is computed in the bounding box of each component and only the voxels
+    of the component are updated. If featureImage is not specified then the gradient is computed from
+    sourceVoxels only around each component, extended by the support of the gradient kernel.
+    seedVoxels and sourceVoxels are NumPy arrays (KJI axis order) on the voxel grid of coarseLabelImage.
+    Returns the refined labels as a NumPy array.
+    """
+    import numpy as np
+    import SimpleITK as sitk
+    # Use a background value that is not a label value, so that boundaries of unlabeled regions are refined, too.
+    # Non-boundary voxels are set to the background value in the output.
+    startTime = time.perf_counter()
+    backgroundValue = int(np.iinfo(self.labelType).max)
+    contourFilter = sitk.LabelContourImageFilter()
+    contourFilter.SetFullyConnected(False)
+    contourFilter.SetBackgroundValue(backgroundValue)
+    # Contour filter sets all non-boundary voxels to the background value
+    boundaryImage = self.execute(contourFilter, coarseLabelImage) != backgroundValue
+    dilateFilter = sitk.BinaryDilateImageFilter()
+    dilateFilter.SetKernelRadius(bandRadius)
+    bandImage = self.execute(dilateFilter, boundaryImage)
+    del boundaryImage
+    # Markers: coarse labels outside the band and the original seeds. Refined labels are written into the same array.
+    labelVoxels = sitk.GetArrayFromImage(coarseLabelImage)
+    labelVoxels[sitk.GetArrayViewFromImage(bandImage) != 0] = 0
+    np.copyto(labelVoxels, seedVoxels, casting="unsafe", where=(seedVoxels != 0))
+    # Components must be separated the same way as watershed flooding is (face connectivity)
+    componentFilter = sitk.ConnectedComponentImageFilter()
+    componentFilter.SetFullyConnected(False)
+    componentImage = self.execute(componentFilter, bandImage)
+    del bandImage
+    regions = self.getRefinementRegions(componentImage)
+    self.recordStage("refinement band", startTime, labelVoxels)
+
+    componentVoxels = sitk.GetArrayViewFromImage(componentImage)
+    for componentLabel, index, size in regions:
+      regionSlices = tuple(slice(index[axis], index[axis] + size[axis]) for axis in [2, 1, 0])
+      if featureImage is not None:
+        regionFeatureImage = sitk.RegionOfInterest(featureImage, size, index)
+      else:
+        regionFeatureImage = self.computeRegionFeatureImage(sourceVoxels, coarseLabelImage, index, size)
+      regionMarkerImage = sitk.GetImageFromArray(labelVoxels[regionSlices])
+      regionMarkerImage.CopyInformation(regionFeatureImage)
+      regionLabelImage = self.runMarkerWatershed(regionFeatureImage, regionMarkerImage)
+      del regionFeatureImage, regionMarkerImage
+      startTime = time.perf_counter()
+      if componentLabel is None:
+        regionComponentVoxels = componentVoxels[regionSlices] != 0
+      else:
+        regionComponentVoxels = componentVoxels[regionSlices] == componentLabel
+      labelVoxels[regionSlices][regionComponentVoxels] = sitk.GetArrayViewFromImage(regionLabelImage)[regionComponentVoxels]
+      self.recordStage("copy out", startTime)
+    return labelVoxels
+
+  def getRefinementRegions(self, componentImage):
+    """Get regions where watershed is recomputed during refinement, as a list of (component label, IJK index, IJK size).
+    Each region is the bounding box of a band component, padded by one voxel so that all markers adjacent to the
+    component are included. If these boxes together would be larger than the bounding box of the whole band
+    then a single region is returned (with None as component label).
+    """
+    import SimpleITK as sitk
+    statisticsFilter = sitk.LabelShapeStatisticsImageFilter()
+    statisticsFilter.SetComputePerimeter(False)
+    self.execute(statisticsFilter, componentImage)
+    imageSize = componentImage.GetSize()
+    regions = []
+    bandStart = list(imageSize)
+    bandEnd = [0, 0, 0]
+    regionsNumberOfVoxels = 0
+    for componentLabel in statisticsFilter.GetLabels():
+      boundingBox = statisticsFilter.GetBoundingBox(componentLabel)
+      start = [max(0, boundingBox[axis] - 1) for axis in range(3)]
+      end = [min(imageSize[axis], boundingBox[axis] + boundingBox[axis+3] + 1) for axis in range(3)]
+      size = [end[axis] - start[axis] for axis in range(3)]
+      regions.append((componentLabel, start, size))
+      regionsNumberOfVoxels += size[0] * size[1] * size[2]
+      bandStart = [min(bandStart[axis], start[axis]) for axis in range(3)]
+      bandEnd = [max(bandEnd[axis], end[axis]) for axis in range(3)]
+    bandSize = [max(0, bandEnd[axis] - bandStart[axis]) for axis in range(3)]
+    if regionsNumberOfVoxels > bandSize[0] * bandSize[1] * bandSize[2]:
+      return [(None, bandStart, bandSize)]
+    return regions
+
+  def computeRegionFeatureImage(self, sourceVoxels, referenceImage, index, size):
+    """Compute gradient magnitude image in a region (IJK index and size) of the voxel grid of referenceImage.
+    Only the source voxels in the region, extended by the support of the gradient kernel, are used.
+    """
+    import SimpleITK as sitk
+    startTime = time.perf_counter()
+    spacing = referenceImage.GetSpacing()
+    imageSize = referenceImage.GetSize()
+    haloSize = [int(math.ceil(SLAB_GRADIENT_SUPPORT_SIGMAS * self.objectScaleMm / spacing[axis])) for axis in range(3)]
+    start = [max(0, index[axis] - haloSize[axis]) for axis in range(3)]
+    end = [min(imageSize[axis], index[axis] + size[axis] + haloSize[axis]) for axis in range(3)]
+    sourceImage = sitk.GetImageFromArray(sourceVoxels[start[2]:end[2], start[1]:end[1], start[0]:end[0]])
+    sourceImage.SetOrigin(referenceImage.TransformIndexToPhysicalPoint(start))
+    sourceImage.SetSpacing(spacing)
+    sourceImage.SetDirection(referenceImage.GetDirection())
+    self.recordStage("copy in", startTime, sourceImage)
+    startTime = time.perf_counter()
+    gradientFilter = sitk.GradientMagnitudeRecursiveGaussianImageFilter()
+    gradientFilter.SetSigma(self.objectScaleMm)
+    featureImage = self.execute(gradientFilter, sourceImage)
+    del sourceImage
+    featureImage = sitk.RegionOfInterest(featureImage, size, [index[axis] - start[axis] for axis in range(3)])
+    self.recordStage("gradient", startTime, featureImage)
+    return featureImage
+
+
+  def computeSlabWiseWatershed(self):
+    """Compute watershed in slabs along the K axis, so that memory usage is bounded by the memory budget.
+
+    Watershed flooding is global, therefore independently segmented slabs would not be consistent.
+    Instead, the whole region is segmented at a resolution that fits into the memory budget, then this
+    coarse segmentation is refined at full resolution near segment boundaries, slab by slab.
+    Each slab is extended by a halo that is large enough for computing the gradient as in the full volume
+    and for refining boundaries that cross slab boundaries.
+
+    The memory budget only bounds the working images of the computation. The seeds and the source volume
+    are accessed directly, therefore they must already be loaded in memory, and the output labelmap
+    is allocated at full size in addition to the budget.
+    Raises RuntimeError if the budget is too small to hold a slab of at least one slice with its halo.
+    """
+    import numpy as np
+    numberOfSlices, numberOfRows, numberOfColumns = self.seedVoxels.shape[:3]
+    spacing = self.geometry[1]
+
+    shrinkFactor = 1
+    while self.seedVoxels.size / shrinkFactor**3 * SLAB_WORKING_MEMORY_BYTES_PER_VOXEL > self.memoryBudgetBytes:
+      shrinkFactor *= 2
+    if shrinkFactor > 1:
+      haloSlices = int(math.ceil(SLAB_GRADIENT_SUPPORT_SIGMAS * self.objectScaleMm / spacing[2])) + shrinkFactor + 1
+      maximumSlabSlices = int(self.memoryBudgetBytes / (numberOfRows * numberOfColumns * SLAB_WORKING_MEMORY_BYTES_PER_VOXEL))
+      if maximumSlabSlices <= 2 * haloSlices:
+        # The halo alone would not fit into the budget
+        minimumBudgetBytes = (2 * haloSlices + 1) * numberOfRows * numberOfColumns * SLAB_WORKING_MEMORY_BYTES_PER_VOXEL
+        raise RuntimeError("Memory budget is too small for slab-wise computation with this object scale,"
+          " at least {0:.0f} MB is required".format(math.ceil(minimumBudgetBytes / 1024.0**2)))
+      slabSlices = maximumSlabSlices - 2 * haloSlices
+      startTime = time.perf_counter()
+      coarseSeedImage = SegmentEditorEffect.arrayToSitkImage(self.seedVoxels, self.geometry, shrinkFactor, self.labelType, labelmap=True)
+      self.recordStage("copy in", startTime, coarseSeedImage)
+      coarseFeatureImage = self.computeFeatureImage(shrinkFactor)
+      coarseLabelImage = self.runMarkerWatershed(coarseFeatureImage, coarseSeedImage)
+      del coarseFeatureImage, coarseSeedImage
+    else:
+      # The whole region fits into the memory budget
+      coarseLabelImage = None
+      haloSlices = 0
+      slabSlices = numberOfSlices
+
+    labelVoxels = np.zeros(self.seedVoxels.shape, dtype=self.labelType)
+    for slabStart in range(0, numberOfSlices, slabSlices):
+      self.computeSlab(labelVoxels, coarseLabelImage, shrinkFactor, slabStart, min(slabStart + slabSlices, numberOfSlices), haloSlices)
+    return labelVoxels
+
+  def computeSlab(self, labelVoxels, coarseLabelImage, shrinkFactor, slabStart, slabEnd, haloSlices):
+    """Compute watershed in slices [slabStart, slabEnd) and write the result into labelVoxels.
+    If coarseLabelImage is specified then it is refined near segment boundaries, otherwise watershed is computed from the seeds.
+    """
+    import SimpleITK as sitk
+    haloStart = max(0, slabStart - haloSlices)
+    haloEnd = min(labelVoxels.shape[0], slabEnd + haloSlices)
+    geometry = self.getSlabGeometry(haloStart)
+
+    startTime = time.perf_counter()
+    seedImage = SegmentEditorEffect.arrayToSitkImage(self.seedVoxels[haloStart:haloEnd], geometry, dtype=self.labelType)
+    self.recordStage("copy in", startTime, seedImage)
+
+    if coarseLabelImage is None:
+      startTime = time.perf_counter()
+      sourceImage = SegmentEditorEffect.arrayToSitkImage(self.sourceVoxels[haloStart:haloEnd], geometry)
+      self.recordStage("copy in", startTime, sourceImage)
+      startTime = time.perf_counter()
+      gradientFilter = sitk.GradientMagnitudeRecursiveGaussianImageFilter()
+      gradientFilter.SetSigma(self.objectScaleMm)
+      featureImage = self.execute(gradientFilter, sourceImage)
+      self.recordStage("gradient", startTime, featureImage)
+      del sourceImage
+      slabLabelImage = self.runMarkerWatershed(featureImage, seedImage)
+      slabLabelVoxels = sitk.GetArrayViewFromImage(slabLabelImage)
+      del featureImage
+    else:
+      startTime = time.perf_counter()
+      resampleFilter = sitk.ResampleImageFilter()
+      resampleFilter.SetReferenceImage(seedImage)
+      resampleFilter.SetInterpolator(sitk.sitkNearestNeighbor)
+      resampleFilter.SetOutputPixelType(seedImage.GetPixelID())
+      slabCoarseLabelImage = self.execute(resampleFilter, coarseLabelImage)
+      self.recordStage("resample", startTime, slabCoarseLabelImage)
+      # Gradient is only computed around the refinement band
+      slabLabelVoxels = self.refineWatershedNearBoundaries(self.seedVoxels[haloStart:haloEnd], slabCoarseLabelImage, shrinkFactor,
+        sourceVoxels=self.sourceVoxels[haloStart:haloEnd])
+    del seedImage
+
+    startTime = time.perf_counter()
+    labelVoxels[slabStart:slabEnd] = slabLabelVoxels[slabStart-haloStart:slabEnd-haloStart]
+    self.recordStage("copy out", startTime)
+
+  def getSlabGeometry(self, firstSlice):
+    """Get geometry of a SimpleITK image that starts at the specified slice of the computed region"""
+    origin, spacing, direction = self.geometry
+    slabOrigin = [origin[row] + direction[row*3+2] * spacing[2] * firstSlice for row in range(3)]
+    return slabOrigin, spacing, direction
+
+
+class WatershedRegionGraph:
+  """Over-segmentation of a feature image into watershed regions and the merge tree of the regions.
+
+  Weight of an edge between two adjacent regions is the lowest feature value along their common boundary
+  (the level where the two regions merge when flooded). Watershed from markers can then be approximated
+  by propagating seed labels along the minimum spanning forest of the region graph.
+
+  The order in which regions are merged along the minimum spanning forest is computed once, when the graph
+  is created. Seed propagation then only requires a few vectorized NumPy operations on arrays that have
+  one element per region, therefore the preview can be updated in milliseconds after each seed change.
+  The number of regions is limited by merging the catchment basins of the least significant minima,
+  which is equivalent to flooding the image from a level that is chosen to keep the target number of regions.
+  Building the merge tree processes the edges one by one, therefore if the image has very many minima
+  (e.g., noisy image with small object scale) then the shallowest basins are merged first using vectorized operations.
+  """
+
+  def __init__(self, featureImage, execute, targetNumberOfRegions=None):
+    """Compute over-segmentation and region merge tree.
+    :param featureImage: gradient magnitude image (SimpleITK image)
+    :param execute: function that executes a SimpleITK filter (allows aborting the computation)
+    :param targetNumberOfRegions: maximum number of regions, REGION_GRAPH_TARGET_NUMBER_OF_REGIONS by default
+    """
+    import numpy as np
+    import SimpleITK as sitk
+
+    if targetNumberOfRegions is None:
+      targetNumberOfRegions = REGION_GRAPH_TARGET_NUMBER_OF_REGIONS
+
+    # Split the image into catchment basins of all regional minima
+    overSegmentationFilter = sitk.MorphologicalWatershedImageFilter()
+    overSegmentationFilter.SetLevel(0)
+    overSegmentationFilter.SetMarkWatershedLine(False)
+    overSegmentationFilter.SetFullyConnected(False)
+    basinImage = execute(overSegmentationFilter, featureImage)
+    basinVoxels = sitk.GetArrayFromImage(basinImage)
+    del basinImage
+    numberOfBasins = int(basinVoxels.max())
+    featureVoxels = sitk.GetArrayViewFromImage(featureImage)
+    basinMinima = np.full(numberOfBasins + 1, np.inf)
+    np.minimum.at(basinMinima, basinVoxels.ravel(), featureVoxels.ravel())
+    edgeBasinsA, edgeBasinsB, edgeWeights = WatershedRegionGraph.getBoundaryEdges(basinVoxels, featureVoxels, numberOfBasins)
+    if numberOfBasins > REGION_GRAPH_MAXIMUM_NUMBER_OF_BASINS:
+      basinMerges, numberOfBasins = WatershedRegionGraph.mergeShallowBasins(
+        numberOfBasins, edgeBasinsA, edgeBasinsB, edgeWeights, basinMinima, max(targetNumberOfRegions, REGION_GRAPH_MAXIMUM_NUMBER_OF_BASINS))
+      basinVoxels = basinMerges.astype(np.int32)[basinVoxels]
+      mergedBasinMinima = np.full(numberOfBasins + 1, np.inf)
+      np.minimum.at(mergedBasinMinima, basinMerges, basinMinima)
+      basinMinima = mergedBasinMinima
+      edgeBasinsA, edgeBasinsB, edgeWeights = WatershedRegionGraph.getUniqueEdges(
+        basinMerges[edgeBasinsA], basinMerges[edgeBasinsB], edgeWeights, numberOfBasins)
+    basinDynamics = self.buildMergeTree(numberOfBasins, edgeBasinsA, edgeBasinsB, edgeWeights, basinMinima)
+
+    if numberOfBasins <= targetNumberOfRegions:
+      self.regionVoxels = basinVoxels
+      self.numberOfRegions = numberOfBasins
+      return
+
+    # Keep the basins of the deepest minima (the dynamic of a minimum is the flooding level above its minimum value
+    # where its basin merges with a basin of a lower minimum). Other basins are merged into these, in the same way
+    # as flooding the image from the minima of the kept basins.
+    numberOfKeptBasins = max(targetNumberOfRegions, int(np.count_nonzero(np.isinf(basinDynamics[1:]))))
+    keptBasins = np.argsort(-basinDynamics[1:], kind='stable')[:numberOfKeptBasins] + 1
+    basinMarkers = np.zeros(numberOfBasins + 1, np.int64)
+    basinMarkers[keptBasins] = np.arange(1, numberOfKeptBasins + 1)
+    basinRegions = self.propagateLabels(basinMarkers).astype(np.int32)
+    self.regionVoxels = basinRegions[basinVoxels]
+    del basinVoxels
+    self.numberOfRegions = numberOfKeptBasins
+    edgeRegionsA, edgeRegionsB, edgeWeights = WatershedRegionGraph.getUniqueEdges(
+      basinRegions[edgeBasinsA], basinRegions[edgeBasinsB], edgeWeights, self.numberOfRegions)
+    self.buildMergeTree(self.numberOfRegions, edgeRegionsA, edgeRegionsB, edgeWeights)
+
+  @staticmethod
+  def mergeShallowBasins(numberOfBasins, edgeBasinsA, edgeBasinsB, edgeWeights, basinMinima, maximumNumberOfBasins):
+    """Merge the basins of the shallowest minima into neighbor basins, so that at most maximumNumberOfBasins basins remain.
+    Depth of a minimum is estimated by the lowest edge to a neighbor basin that has a lower minimum (an upper bound
+    of the dynamic of the minimum) and the basin is merged into that neighbor, as if it was flooded up to that edge.
+    Chains of merged basins always lead to lower minima, therefore they are resolved by pointer jumping.
+    :param edgeBasinsA, edgeBasinsB, edgeWeights: edges, see getUniqueEdges
+    :param basinMinima: lowest feature value in each basin
+    :return: new label of each basin (consecutive, starting from 1) and the number of basins after merging
+    """
+    import numpy as np
+    # Orient edges from the basin with the higher minimum to the basin with the lower minimum (ties are broken by label)
+    minimaA = basinMinima[edgeBasinsA]
+    minimaB = basinMinima[edgeBasinsB]
+    higherA = (minimaA > minimaB) | ((minimaA == minimaB) & (edgeBasinsA > edgeBasinsB))
+    higherBasins = np.where(higherA, edgeBasinsA, edgeBasinsB)
+    lowerBasins = np.where(higherA, edgeBasinsB, edgeBasinsA)
+    depths = edgeWeights - basinMinima[higherBasins]
+    # Lowest edge leading to a lower minimum, for each basin that has one
+    order = np.lexsort((depths, higherBasins))
+    _, firstIndices = np.unique(higherBasins[order], return_index=True)
+    lowestEdges = order[firstIndices]
+    numberOfMergedBasins = min(numberOfBasins - maximumNumberOfBasins, len(lowestEdges))
+    pointers = np.arange(numberOfBasins + 1)
+    if numberOfMergedBasins > 0:
+      mergedEdges = lowestEdges[np.argpartition(depths[lowestEdges], numberOfMergedBasins - 1)[:numberOfMergedBasins]]
+      pointers[higherBasins[mergedEdges]] = lowerBasins[mergedEdges]
+    while True:
+      nextPointers = pointers[pointers]
+      if np.array_equal(nextPointers, pointers):
+        break
+      pointers = nextPointers
+    isRemainingBasin = (pointers == np.arange(numberOfBasins + 1))
+    newLabels = np.cumsum(isRemainingBasin) - 1
+    return newLabels[pointers], int(np.count_nonzero(isRemainingBasin[1:]))
+
+  @staticmethod
+  def getBoundaryEdges(regionVoxels, featureVoxels, numberOfRegions):
+    """Get edges between adjacent regions (face neighbors, same as the watershed filter).
+    Weight of a boundary voxel pair is the higher feature value of the two voxels.
+    :return: region arrays of the edge endpoints and edge weights, see getUniqueEdges
+    """
+    import numpy as np
+    regionsA = []
+    regionsB = []
+    weights = []
+    for axis in range(3):
+      lower = [slice(None)] * 3
+      upper = [slice(None)] * 3
+      lower[axis] = slice(None, -1)
+      upper[axis] = slice(1, None)
+      lowerRegions = regionVoxels[tuple(lower)]
+      upperRegions = regionVoxels[tuple(upper)]
+      boundary = lowerRegions != upperRegions
+      regionsA.append(lowerRegions[boundary])
+      regionsB.append(upperRegions[boundary])
+      weights.append(np.maximum(featureVoxels[tuple(lower)][boundary], featureVoxels[tuple(upper)][boundary]))
+    return WatershedRegionGraph.getUniqueEdges(np.concatenate(regionsA), np.concatenate(regionsB), np.concatenate(weights), numberOfRegions)
+
+  @staticmethod
+  def getUniqueEdges(regionsA, regionsB, weights, numberOfRegions):
+    """Keep the lowest weight edge for each pair of different regions.
+    :return: region arrays of the edge endpoints and edge weights, sorted by weight
+    """
+    import numpy as np
+    differentRegions = regionsA != regionsB
+    lowerRegions = np.minimum(regionsA[differentRegions], regionsB[differentRegions]).astype(np.int64)
+    upperRegions = np.maximum(regionsA[differentRegions], regionsB[differentRegions]).astype(np.int64)
+    weights = weights[differentRegions]
+    order = np.argsort(weights, kind='stable')
+    edgeKeys = lowerRegions[order] * (numberOfRegions + 1) + upperRegions[order]
+    _, firstIndices = np.unique(edgeKeys, return_index=True)
+    firstIndices.sort()
+    edgeIndices = order[firstIndices]
+    return lowerRegions[edgeIndices], upperRegions[edgeIndices], weights[edgeIndices]
+
+  def buildMergeTree(self, numberOfRegions, edgeRegionsA, edgeRegionsB, edgeWeights, regionMinima=None):
+    """Compute the order in which regions are merged along the minimum spanning forest (Kruskal's algorithm).
+    Leaf nodes of the tree are the regions (node index is the region label, 0 is not used), each merge adds a node.
+    Regions are listed in depth-first order of the tree, so that each node covers a contiguous range of this list.
+    :param edgeRegionsA, edgeRegionsB, edgeWeights: edges sorted by weight
+    :param regionMinima: lowest feature value in each region. If specified then the dynamic of each region minimum
+      is computed and returned (infinite for the lowest minimum of each connected component).
+    """
+    import numpy as np
+    parents = list(range(numberOfRegions + 1))
+    componentNodes = list(range(numberOfRegions + 1))
+    if regionMinima is not None:
+      componentMinima = regionMinima.tolist()
+      componentMinimumRegions = list(range(numberOfRegions + 1))
+      dynamics = np.full(numberOfRegions + 1, np.inf)
+    def findRoot(region):
+      while parents[region] != region:
+        parents[region] = parents[parents[region]]
+        region = parents[region]
+      return region
+    childrenA = []
+    childrenB = []
+    endsA = []
+    endsB = []
+    for regionA, regionB, weight in zip(edgeRegionsA.tolist(), edgeRegionsB.tolist(), edgeWeights.tolist()):
+      rootA = findRoot(regionA)
+      rootB = findRoot(regionB)
+      if rootA == rootB:
+        continue
+      if regionMinima is not None:
+        if componentMinima[rootA] > componentMinima[rootB]:
+          rootA, rootB = rootB, rootA
+          regionA, regionB = regionB, regionA
+        # Component B has the higher minimum, it is flooded into component A at this level
+        dynamics[componentMinimumRegions[rootB]] = weight - componentMinima[rootB]
+      childrenA.append(componentNodes[rootA])
+      childrenB.append(componentNodes[rootB])
+      endsA.append(regionA)
+      endsB.append(regionB)
+      parents[rootB] = rootA
+      componentNodes[rootA] = numberOfRegions + len(childrenA)
+
+    numberOfLeaves = numberOfRegions + 1
+    numberOfNodes = numberOfLeaves + len(childrenA)
+    nodeSizes = [1] * numberOfNodes
+    for mergeIndex, (childA, childB) in enumerate(zip(childrenA, childrenB)):
+      nodeSizes[numberOfLeaves + mergeIndex] = nodeSizes[childA] + nodeSizes[childB]
+    # Place the trees of the connected components next to each other, then each child of a node next to the other
+    hasParent = np.zeros(numberOfNodes, bool)
+    hasParent[childrenA] = True
+    hasParent[childrenB] = True
+    nodeStarts = [0] * numberOfNodes
+    nextStart = 0
+    for rootNode in np.flatnonzero(~hasParent).tolist():
+      nodeStarts[rootNode] = nextStart
+      nextStart += nodeSizes[rootNode]
+    for mergeIndex in reversed(range(len(childrenA))):
+      childA = childrenA[mergeIndex]
+      nodeStarts[childA] = nodeStarts[numberOfLeaves + mergeIndex]
+      nodeStarts[childrenB[mergeIndex]] = nodeStarts[childA] + nodeSizes[childA]
+
+    self.mergeChildrenA = np.array(childrenA, np.int64)
+    self.mergeChildrenB = np.array(childrenB, np.int64)
+    self.mergeEndsA = np.array(endsA, np.int64)
+    self.mergeEndsB = np.array(endsB, np.int64)
+    self.nodeSizes = np.array(nodeSizes, np.int64)
+    self.nodeStarts = np.array(nodeStarts, np.int64)
+    self.leafOrder = np.zeros(numberOfLeaves, np.int64)
+    self.leafOrder[self.nodeStarts[:numberOfLeaves]] = np.arange(numberOfLeaves)
+    return dynamics if regionMinima is not None else None
+
+  def propagateLabels(self, regionLabels):
+    """Propagate labels of seed regions to all regions along the merge tree.
+    Regions are merged in the order of the merge tree, except if both of them are already labeled.
+    This gives the same result as Kruskal's algorithm with seeds, but instead of processing the edges one by one,
+    each unlabeled subtree is assigned to the region it is merged with first and the assignments are then resolved
+    by pointer jumping.
+    :param regionLabels: label of each region (0 if the region does not contain seeds)
+    :return: label of each region
+    """
+    import numpy as np
+    numberOfLeaves = len(regionLabels)
+    # Number of seed regions before each position in depth-first order, to quickly check if a subtree has seeds
+    seedCounts = np.zeros(numberOfLeaves + 1, np.int64)
+    np.cumsum(regionLabels[self.leafOrder] != 0, out=seedCounts[1:])
+    nodeHasSeed = seedCounts[self.nodeStarts + self.nodeSizes] > seedCounts[self.nodeStarts]
+    hasSeedA = nodeHasSeed[self.mergeChildrenA]
+    hasSeedB = nodeHasSeed[self.mergeChildrenB]
+    # Subtree without seeds is labeled by the region at the other end of the edge that merges it with seeded regions
+    unseededChildren = np.concatenate([self.mergeChildrenA[hasSeedB & ~hasSeedA], self.mergeChildrenB[hasSeedA & ~hasSeedB]])
+    targetRegions = np.concatenate([self.mergeEndsB[hasSeedB & ~hasSeedA], self.mergeEndsA[hasSeedA & ~hasSeedB]])
+    subtreeSizes = self.nodeSizes[unseededChildren]
+    subtreePositions = (np.arange(subtreeSizes.sum())
+      + np.repeat(self.nodeStarts[unseededChildren] - (np.cumsum(subtreeSizes) - subtreeSizes), subtreeSizes))
+    pointers = np.arange(numberOfLeaves)
+    pointers[self.leafOrder[subtreePositions]] = np.repeat(targetRegions, subtreeSizes)
+    # Target regions are in lower subtrees, follow the pointers until a seed region (or a region that points to itself) is reached
+    while True:
+      nextPointers = pointers[pointers]
+      if np.array_equal(nextPointers, pointers):
+        break
+      pointers = nextPointers
+    return regionLabels[pointers]
+
+  def labelRegions(self, seedVoxels, labelType):
+    """Compute label for each voxel by propagating seeds in the region graph.
+    If a region contains seeds of different segments then the segment with the most seed voxels gets the region.
+    :param seedVoxels: seed labelmap as NumPy array, same shape as the over-segmentation
+    :param labelType: NumPy type of the output labelmap
+    :return: labelmap NumPy array
+    """
+    import numpy as np
+
+    seedMask = seedVoxels != 0
+    seedRegions = self.regionVoxels[seedMask].astype(np.int64)
+    seedLabels = seedVoxels[seedMask].astype(np.int64)
+    labelRange = int(seedLabels.max()) + 1 if len(seedLabels) else 1
+    regionLabelPairs, counts = np.unique(seedRegions * labelRange + seedLabels, return_counts=True)
+    # Assign in ascending order of counts, so that the most frequent label is set last
+    regionLabelPairs = regionLabelPairs[np.argsort(counts, kind='stable')]
+    regionLabels = np.zeros(self.numberOfRegions + 1, np.int64)
+    regionLabels[regionLabelPairs // labelRange] = regionLabelPairs % labelRange
+    regionLabels = self.propagateLabels(regionLabels).astype(labelType)
+    return regionLabels[self.regionVoxels]
+
+
+COMPUTATION_MODE_FULL = "Full resolution"
+COMPUTATION_MODE_PROGRESSIVE = "Progressive"
+COMPUTATION_MODE_SLABS = "Slab-wise"
+COMPUTATION_MODE_REGION_GRAPH = "Region graph"
+
+# Number of regions of the over-segmentation used in region graph mode.
+# Fewer regions result in faster seed propagation but less accurate preview.
+REGION_GRAPH_TARGET_NUMBER_OF_REGIONS = 5000
+# Catchment basins of the least significant minima are merged before the merge tree is built if the over-segmentation
+# has more basins than this, because the merge tree is built by processing the region adjacency edges one by one.
+REGION_GRAPH_MAXIMUM_NUMBER_OF_BASINS = 100000
+
+# Object scales (in mm) where gradient images are precomputed for quick feedback while dragging the object scale slider
+OBJECT_SCALE_LEVELS_MM = [0.5, 1.0, 2.0, 4.0, 8.0]
+
+# Progressive computation downsamples volumes larger than this by a factor of 4 (instead of 2) along each axis
+PROGRESSIVE_LARGE_VOLUME_NUMBER_OF_VOXELS = 64*1024*1024
+
+# Estimated memory usage of slab-wise computation per voxel (source and marker image copies, float gradient
+# image and its temporary buffer, watershed output, boundary band and watershed internal status image)
+SLAB_WORKING_MEMORY_BYTES_PER_VOXEL = 24
+# Extent of the gradient computation kernel (in sigmas), slabs are extended by this much on each side
+SLAB_GRADIENT_SUPPORT_SIGMAS = 4